@@ -0,0 +1,293 @@
+'''
+Benchmarks and load tests for the updates of the Git Pull Tool
+
+Times whole update runs, as the app and pullrepos.py do them, over a working
+set of local clones, without any network access. Like pullrepos.py, this
+never loads Kivy.
+
+The working set is generated from a fixed seed: --repos bare "remote"
+repositories with --history commits each, written with git fast-import, and
+a clone of each. It is kept in the work directory and used again by later
+runs with the same --repos, --history and --file-size. Before every run,
+--churn-commits synthetic commits are added to a --churn fraction of the
+remotes, chosen from the seed, so every run has the same amount of work:
+that many repositories to pull, and the others to find up to date. The
+remotes keep the commits of earlier runs, which only lengthens their history
+a little; delete the work directory to start again from the seed.
+
+Each run happens in a fresh Python process, which updates all the clones
+with the settings given and records the outcome in a registry, the same way
+update_repositories does. For every case, that is every combination of
+--workers and --precheck, the fastest of --repeat runs is kept. It reports
+the wall time, the 50th, 90th and 99th percentile and slowest latency of the
+repositories, the peak RSS of the process, and, sampled from /proc on Linux,
+the largest peak RSS of any git process and the most git processes running at
+the same time.
+
+The results can be written to a JSON file with --output, and compared against
+an earlier results file with --baseline. Cases that got slower, or use more
+memory, by more than --tolerance are reported, and the exit code is 1.
+
+Usage:
+    python benchpull.py
+    python benchpull.py --repos 500 --history 200 --workers 1,8,32 --output new.json
+    python benchpull.py --churn 0.5 --baseline old.json --tolerance 0.15
+
+@author: vivian
+'''
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import benchtools
+
+SEED = 20170210
+# Number of files in each remote, which the commits change in turn.
+FILE_COUNT = 10
+PRECHECKS = ["on", "off"]
+# Branch the remotes have, and that the clones pull.
+BRANCH = "master"
+# Time of the first synthetic commit.
+EPOCH = 1486684800
+# Measurements compared with the baseline: key, whether higher is worse, and message.
+COMPARED = [("seconds", True, "%.3f s, was %.3f"),
+            ("p90", True, "%.3f s p90, was %.3f"),
+            ("peak_rss_kb", True, "%d KB peak, was %d"),
+            ("failed", True, "%d failed, was %d")]
+
+
+def git(args, cwd=None, stdin=None):
+    """ Runs git, and returns its stdout. Raises CalledProcessError if it fails.
+    """
+    return subprocess.run(["git"] + list(args), cwd=cwd, input=stdin, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+
+
+def fast_import_stream(rng, first, count, file_size, append):
+    """ Returns the git fast-import input for count commits on BRANCH, numbered
+        from first. If append is True, the first one follows the commits the
+        branch already has.
+    """
+    chunks = []
+    for number in range(first, first + count):
+        message = ("Synthetic commit %d\n" % number).encode("utf-8")
+        content = "".join("%016x\n" % rng.getrandbits(64)
+                          for _ in range(max(1, file_size // 17))).encode("ascii")
+        chunks.append(b"commit refs/heads/%s\n" % BRANCH.encode("ascii"))
+        chunks.append(b"committer Bench <bench@example.com> %d +0000\n" % (EPOCH + number))
+        chunks.append(b"data %d\n%s" % (len(message), message))
+        if append and number == first:
+            chunks.append(b"from refs/heads/%s^0\n" % BRANCH.encode("ascii"))
+        chunks.append(b"M 644 inline file-%d.txt\n" % (number % FILE_COUNT))
+        chunks.append(b"data %d\n%s\n" % (len(content), content))
+    return b"".join(chunks)
+
+
+def add_commits(remote, rng, count, file_size):
+    """ Adds count commits to the branch of a bare remote repository.
+    """
+    first = int(git(["rev-list", "--count", BRANCH], cwd=remote))
+    git(["fast-import", "--quiet"], cwd=remote,
+        stdin=fast_import_stream(rng, first, count, file_size, True))
+
+
+def set_dir(args):
+    return os.path.join(args.work_dir, "set-%d-%d-%d" % (args.repos, args.history, args.file_size))
+
+
+def make_repo(set_directory, index, history, file_size):
+    """ Creates the remote and the clone of a repository of the working set.
+    """
+    name = "repo%04d" % index
+    remote = os.path.join(set_directory, "remotes", name + ".git")
+    clone = os.path.join(set_directory, "clones", name)
+    rng = random.Random("%d-%d" % (SEED, index))
+    git(["init", "--quiet", "--bare", remote])
+    git(["symbolic-ref", "HEAD", "refs/heads/" + BRANCH], cwd=remote)
+    git(["fast-import", "--quiet"], cwd=remote,
+        stdin=fast_import_stream(rng, 0, history, file_size, False))
+    git(["clone", "--quiet", "--branch", BRANCH, remote, clone])
+
+
+def generate_working_set(args):
+    """ Creates the remotes and clones of the working set, unless they already
+        exist, and returns the paths of the clones. The same arguments always
+        give the same working set.
+    """
+    directory = set_dir(args)
+    clones = [os.path.join(directory, "clones", "repo%04d" % index)
+              for index in range(args.repos)]
+    if os.path.exists(os.path.join(directory, "ready")):
+        return clones
+    import concurrent.futures
+    import shutil
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(os.path.join(directory, "remotes"))
+    os.makedirs(os.path.join(directory, "clones"))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        list(executor.map(lambda index: make_repo(directory, index, args.history,
+                                                  args.file_size), range(args.repos)))
+    open(os.path.join(directory, "ready"), "w").close()
+    return clones
+
+
+def add_churn(args, clones, run_number):
+    """ Adds the synthetic commits of a run to a fraction of the remotes, and
+        returns how many remotes got them.
+    """
+    rng = random.Random("%d-churn-%d" % (SEED, run_number))
+    count = int(round(len(clones) * args.churn))
+    for clone in rng.sample(clones, count):
+        remote = os.path.join(set_dir(args), "remotes", os.path.basename(clone) + ".git")
+        add_commits(remote, rng, args.churn_commits, args.file_size)
+    return count
+
+
+def percentile(values, fraction):
+    """ Returns the value below which fraction of the sorted values lie, by the
+        nearest rank.
+    """
+    if not values:
+        return None
+    return values[max(0, min(len(values), math.ceil(fraction * len(values))) - 1)]
+
+
+def run_case(case):
+    """ Updates the clones of the working set once, as described by the case, in
+        this process, and returns the measurements.
+    """
+    import gitmetrics
+    import gitstatus
+    import pullrepos
+    import reporegistry
+    config = pullrepos.read_config(os.devnull)
+    config.set("Setup", "workers", str(case["workers"]))
+    config.set("Setup", "precheck", "1" if case["precheck"] == "on" else "0")
+    registry = reporegistry.RepoRegistry(os.path.join(case["work_dir"],
+                                                      reporegistry.REGISTRY_NAME))
+    registry.add_many(case["clones"])
+    status_cache = gitstatus.StatusCache()
+    metrics = gitmetrics.UpdateMetrics()
+    def record(result):
+        if result.timing is not None:
+            pullrepos.record_result(registry, status_cache, result)
+    updater = pullrepos.make_updater(config, listener=record, metrics=metrics)
+    with benchtools.ProcessSampler(commands=("git",)) as sampler:
+        start_time = time.perf_counter()
+        results = updater.update(case["clones"])
+        seconds = time.perf_counter() - start_time
+    registry.close()
+    latencies = sorted(metrics.repos[clone].seconds for clone in case["clones"])
+    summary = metrics.last_summary
+    return {"seconds": seconds, "ok": summary.ok, "up_to_date": summary.up_to_date,
+            "failed": summary.failed, "bytes_received": summary.bytes_received,
+            "p50": percentile(latencies, 0.5), "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99), "max": latencies[-1] if latencies else None,
+            "peak_rss_kb": benchtools.peak_rss_kb(), "git_peak_rss_kb": sampler.peak_rss_kb,
+            "peak_processes": sampler.peak, "repositories": len(results)}
+
+
+def run_benchmarks(args):
+    """ Runs every combination of the chosen worker counts and prechecks, and
+        returns a list of results, one per combination.
+    """
+    start_time = time.time()
+    clones = generate_working_set(args)
+    print("Working set of %d repositories ready in %.1f s" % (len(clones), time.time() - start_time))
+    results = []
+    run_number = 0
+    for workers in args.workers:
+        for precheck in args.precheck:
+            case = {"clones": clones, "workers": workers, "precheck": precheck,
+                    "work_dir": set_dir(args)}
+            runs = []
+            for _ in range(args.repeat):
+                churned = add_churn(args, clones, run_number)
+                run_number += 1
+                run = benchtools.measure(__file__, case)
+                run["churned"] = churned
+                runs.append(run)
+            # The fastest of the repeats is kept, as the others were slowed down by
+            # something else.
+            best = min(runs, key=lambda run: run["seconds"])
+            result = {
+                "name": "r%d-h%d-c%g-w%d-precheck-%s" % (args.repos, args.history, args.churn,
+                                                         workers, precheck),
+                "repos": args.repos, "history": args.history, "file_size": args.file_size,
+                "churn": args.churn, "churn_commits": args.churn_commits,
+                "workers": workers, "precheck": precheck,
+                "repos_per_s": best["repositories"] / max(best["seconds"], 1e-9),
+            }
+            result.update(best)
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result):
+    processes = ""
+    if result["peak_processes"] is not None:
+        processes = ", %d processes, git %d KB peak" % (result["peak_processes"],
+                                                       result["git_peak_rss_kb"])
+    print("%-40s %7.2f s %7.1f repos/s  p50 %.3f p90 %.3f p99 %.3f s  %d KB peak%s%s" % (
+        result["name"], result["seconds"], result["repos_per_s"], result["p50"], result["p90"],
+        result["p99"], result["peak_rss_kb"], processes,
+        ", %d failed" % result["failed"] if result["failed"] else ""))
+    sys.stdout.flush()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the updates of the Git Pull Tool on local repositories.")
+    parser.add_argument("-n", "--repos", type=int, default=50,
+                        help="number of repositories in the working set (default 50)")
+    parser.add_argument("--history", type=int, default=20,
+                        help="commits in each remote to start with (default 20)")
+    parser.add_argument("--file-size", type=int, default=4096,
+                        help="bytes each commit writes (default 4096)")
+    parser.add_argument("--churn", type=float, default=0.2,
+                        help="fraction of the remotes that get new commits before each run "
+                             "(default 0.2)")
+    parser.add_argument("--churn-commits", type=int, default=3,
+                        help="new commits for each of those remotes (default 3)")
+    parser.add_argument("-w", "--workers", type=lambda text: [int(n) for n in text.split(",")],
+                        default="1,8", help="concurrent updates to try, e.g. 1,8,32 (default 1,8)")
+    parser.add_argument("--precheck", type=lambda text: benchtools.parse_list(text, PRECHECKS),
+                        default=PRECHECKS, help="on and/or off (default both)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs per case, of which the fastest counts (default 3)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "benchpull"),
+                        help="directory for the working sets, which are kept for later runs")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="fraction by which a case may be worse than the baseline (default 0.1)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = run_benchmarks(args)
+    if args.output:
+        benchtools.write_report(args.output, results,
+                                git=git(["--version"]).decode("utf-8").strip())
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        if benchtools.compare(results, baseline, args.tolerance, COMPARED):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
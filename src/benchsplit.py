@@ -0,0 +1,295 @@
+'''
+Benchmarks for the split engines
+
+Generates synthetic corpora, splits them with each engine of splitengine, and
+reports lines/s, MB/s, peak RSS and the number of read and write system calls
+of each split. For the parallel engine, the largest peak RSS of any worker
+process is reported as well, sampled from /proc on Linux, as the workers are
+started by a forkserver and do not report to the benchmark process. Like splitfiles.py, this never loads Kivy.
+
+Corpora are generated once, from a fixed seed, and kept in the work directory,
+so later runs split exactly the same data without paying for generating it
+again. Each split runs in a fresh Python process, so that its peak RSS is its
+own and not left over from an earlier case.
+
+Read and write system calls are counted from /proc/self/io on Linux. For the
+parallel engine, these only cover the main process; use --strace to count all
+system calls of all processes, if strace is installed.
+
+The results can be written to a JSON file with --output, and compared against
+an earlier results file with --baseline. Cases that got slower, or use more
+memory, by more than --tolerance are reported, and the exit code is 1.
+
+Usage:
+    python benchsplit.py
+    python benchsplit.py --sizes 1M,256M,10G --engines mmap,parallel --output new.json
+    python benchsplit.py --baseline old.json --tolerance 0.15
+
+@author: vivian
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import benchtools
+
+# Corpus encodings, and the text used to fill lines of each.
+ENCODINGS = ["ascii", "cjk"]
+# Line length distributions, as functions that return a line length in characters.
+LINE_LENGTHS = {
+    "short": lambda rng: rng.randint(5, 40),
+    "mixed": lambda rng: min(int(rng.lognormvariate(4.0, 0.8)), 2000),
+    "long": lambda rng: rng.randint(400, 2000),
+}
+ENGINES = ["text", "mmap", "parallel"]
+MODES = ["append", "overwrite"]
+# Number of different lines a corpus is drawn from.
+POOL_SIZE = 8192
+SEED = 20181210
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+# Measurements compared with the baseline: key, whether higher is worse, and message.
+COMPARED = [("mb_per_s", False, "%.1f MB/s, was %.1f"),
+            ("peak_rss_kb", True, "%d KB peak, was %d"),
+            ("worker_peak_rss_kb", True, "%d KB worker peak, was %d")]
+
+
+def parse_size(text):
+    """ Returns the number of bytes in a size such as 512K, 64M or 10G.
+    """
+    text = text.strip().upper()
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    """ Returns a size in bytes as a short string, the inverse of parse_size.
+    """
+    for unit in ("G", "M", "K"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return "%d%s" % (size // UNITS[unit], unit)
+    return str(size)
+
+
+def make_line(rng, encoding, length):
+    """ Returns a line of text of about length characters, with a newline.
+    """
+    if encoding == "cjk":
+        # CJK Unified Ideographs, 3 bytes each in UTF-8, with a full stop now and then.
+        chars = [chr(rng.randint(0x4E00, 0x9FFF)) for _ in range(length)]
+        for i in range(rng.randint(0, length // 20), length, 20):
+            chars[i] = "。"
+        return "".join(chars) + "\n"
+    words = []
+    size = 0
+    while size < length:
+        word = "".join(chr(rng.randint(97, 122)) for _ in range(rng.randint(1, 10)))
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length] + "\n"
+
+
+def corpus_filename(work_dir, encoding, line_length, size):
+    return os.path.join(work_dir, "corpus-%s-%s-%s.txt" % (encoding, line_length, format_size(size)))
+
+
+def generate_corpus(filename, encoding, line_length, size):
+    """ Writes a corpus of whole lines of at least size bytes to the file, unless
+        it already exists. The same arguments always give the same corpus.
+    """
+    if os.path.exists(filename):
+        return
+    rng = random.Random("%d-%s-%s" % (SEED, encoding, line_length))
+    length = LINE_LENGTHS[line_length]
+    pool = [make_line(rng, encoding, max(length(rng), 1)).encode("utf-8")
+            for _ in range(POOL_SIZE)]
+    temp_filename = filename + ".tmp"
+    written = 0
+    with open(temp_filename, "wb") as stream:
+        while written < size:
+            block = b"".join(rng.choices(pool, k=1024))
+            stream.write(block)
+            written += len(block)
+    os.replace(temp_filename, filename)
+
+
+def read_io_counts():
+    """ Returns the numbers of read and write system calls of this process so far,
+        or (None, None) where /proc/self/io is not available.
+    """
+    counts = {}
+    try:
+        with open("/proc/self/io") as stream:
+            for line in stream:
+                key, value = line.split(":")
+                counts[key] = int(value)
+    except OSError:
+        return None, None
+    return counts["syscr"], counts["syscw"]
+
+
+def run_case(case):
+    """ Splits a corpus once, as described by the case, in this process, and returns
+        the measurements. The target files are removed afterwards.
+    """
+    import splitengine
+    targets = [os.path.join(case["work_dir"], "target-%d.txt" % n) for n in (1, 2)]
+    append = case["mode"] == "append"
+    for target in targets:
+        # Appending starts from target files that already hold a little text.
+        with open(target, "w") as stream:
+            if append:
+                stream.write("existing line\n")
+    pattern = [0, 1]
+    reads_before, writes_before = read_io_counts()
+    with benchtools.ProcessSampler() as sampler:
+        start_time = time.perf_counter()
+        if case["engine"] == "text":
+            line_count = splitengine.route_text(case["corpus"], targets, pattern, append,
+                                                encoding="utf-8")
+        elif case["engine"] == "mmap":
+            line_count = splitengine.route_mmap(case["corpus"], targets, pattern, append)
+        else:
+            line_count = splitengine.route_parallel(case["corpus"], targets, pattern, append,
+                                                    workers=case["workers"])
+        seconds = time.perf_counter() - start_time
+    reads_after, writes_after = read_io_counts()
+    for target in targets:
+        os.remove(target)
+    result = {"lines": line_count, "seconds": seconds, "peak_rss_kb": benchtools.peak_rss_kb(),
+              "worker_peak_rss_kb": None, "read_syscalls": None, "write_syscalls": None}
+    if case["engine"] == "parallel":
+        result["worker_peak_rss_kb"] = sampler.peak_rss_kb
+    if reads_before is not None:
+        result["read_syscalls"] = reads_after - reads_before
+        result["write_syscalls"] = writes_after - writes_before
+    return result
+
+
+def parse_strace_total(filename):
+    """ Returns the total number of system calls in the summary written by strace -c.
+    """
+    with open(filename) as stream:
+        for line in stream:
+            fields = line.split()
+            if fields and fields[-1] == "total":
+                # % time, seconds, usecs/call, calls, [errors,] total
+                return int(fields[3])
+    return None
+
+
+def measure(case, use_strace):
+    """ Runs the case in a fresh Python process and returns its measurements.
+    """
+    strace_filename = None
+    prefix = ()
+    if use_strace:
+        strace_filename = os.path.join(case["work_dir"], "strace.txt")
+        prefix = ("strace", "-f", "-c", "-q", "-o", strace_filename)
+    result = benchtools.measure(__file__, case, prefix=prefix)
+    if strace_filename is not None:
+        result["syscalls"] = parse_strace_total(strace_filename)
+        os.remove(strace_filename)
+    return result
+
+
+def run_benchmarks(args):
+    """ Runs every combination of the chosen corpora, engines and modes, and
+        returns a list of results, one per combination.
+    """
+    results = []
+    for size in args.sizes:
+        for encoding in args.encodings:
+            for line_length in args.line_lengths:
+                corpus = corpus_filename(args.work_dir, encoding, line_length, size)
+                generate_corpus(corpus, encoding, line_length, size)
+                corpus_size = os.path.getsize(corpus)
+                for engine in args.engines:
+                    for mode in args.modes:
+                        case = {"corpus": corpus, "engine": engine, "mode": mode,
+                                "workers": args.workers, "work_dir": args.work_dir}
+                        # The fastest of the repeats is kept, as the others were slowed
+                        # down by something else.
+                        best = min((measure(case, args.strace) for _ in range(args.repeat)),
+                                   key=lambda result: result["seconds"])
+                        seconds = max(best["seconds"], 1e-9)
+                        result = {
+                            "name": "%s-%s-%s-%s-%s" % (encoding, line_length,
+                                                        format_size(size), engine, mode),
+                            "encoding": encoding, "line_length": line_length,
+                            "size": format_size(size), "engine": engine, "mode": mode,
+                            "bytes": corpus_size,
+                            "lines_per_s": best["lines"] / seconds,
+                            "mb_per_s": corpus_size / 1048576.0 / seconds,
+                        }
+                        result.update(best)
+                        results.append(result)
+                        print_result(result)
+    return results
+
+
+def print_result(result):
+    syscalls = ""
+    if result["read_syscalls"] is not None:
+        syscalls = ", %d reads, %d writes" % (result["read_syscalls"], result["write_syscalls"])
+    if result.get("syscalls") is not None:
+        syscalls += ", %d syscalls" % result["syscalls"]
+    workers = ""
+    if result.get("worker_peak_rss_kb") is not None:
+        workers = ", workers %d KB peak" % result["worker_peak_rss_kb"]
+    print("%-36s %10.0f lines/s %8.1f MB/s %8d KB peak%s%s" % (
+        result["name"], result["lines_per_s"], result["mb_per_s"], result["peak_rss_kb"],
+        workers, syscalls))
+    sys.stdout.flush()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the split engines on synthetic corpora.")
+    parser.add_argument("--sizes", type=lambda text: [parse_size(size) for size in text.split(",")],
+                        default="1M,64M", help="corpus sizes, e.g. 1M,512M,10G (default 1M,64M)")
+    parser.add_argument("--encodings", type=lambda text: benchtools.parse_list(text, ENCODINGS),
+                        default=ENCODINGS, help="ascii and/or cjk (default both)")
+    parser.add_argument("--line-lengths", type=lambda text: benchtools.parse_list(text, sorted(LINE_LENGTHS)),
+                        default=sorted(LINE_LENGTHS), help="short, mixed and/or long (default all)")
+    parser.add_argument("--engines", type=lambda text: benchtools.parse_list(text, ENGINES),
+                        default=ENGINES, help="text, mmap and/or parallel (default all)")
+    parser.add_argument("--modes", type=lambda text: benchtools.parse_list(text, MODES),
+                        default=MODES, help="append and/or overwrite (default both)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for the parallel engine")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="splits per case, of which the fastest counts (default 3)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "benchsplit"),
+                        help="directory for the corpora, which are kept for later runs")
+    parser.add_argument("--strace", action="store_true",
+                        help="count all system calls with strace")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="fraction by which a case may be worse than the baseline (default 0.1)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = run_benchmarks(args)
+    if args.output:
+        benchtools.write_report(args.output, results)
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        if benchtools.compare(results, baseline, args.tolerance, COMPARED):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
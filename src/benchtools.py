@@ -0,0 +1,204 @@
+'''
+Helpers shared by the benchmarks, benchsplit.py and benchpull.py.
+
+Both run each case in a fresh Python process, running the benchmark script
+itself with --case and the case as JSON, and read its measurements from the
+last line it prints. Both write their results, with a description of the
+machine, to a JSON file, and compare them with an earlier one. Both sample the
+processes a case starts, git or the workers of a parallel split, from /proc.
+
+@author: vivian
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+# Seconds between samples of the processes started by a benchmark.
+SAMPLE_INTERVAL = 0.02
+
+
+def parse_list(text, choices):
+    """ Returns the items of a comma-separated list, each of which must be one of
+        choices, for argparse.
+    """
+    items = [item.strip() for item in text.split(",") if item.strip()]
+    for item in items:
+        if item not in choices:
+            raise argparse.ArgumentTypeError("%s is not one of %s" % (item, ", ".join(choices)))
+    return items
+
+
+def _kb(maxrss):
+    if sys.platform == "darwin":
+        # macOS reports bytes rather than KB.
+        return maxrss // 1024
+    return maxrss
+
+
+def peak_rss_kb():
+    """ Returns the peak RSS of this process, in KB.
+    """
+    own = _kb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    try:
+        # On Linux, ru_maxrss is inherited from the process that started this one,
+        # while VmHWM is this process's own.
+        with open("/proc/self/status") as stream:
+            for line in stream:
+                if line.startswith("VmHWM:"):
+                    own = int(line.split()[1])
+    except OSError:
+        pass
+    return own
+
+
+def process_peak_rss_kb(pid):
+    """ Returns the peak RSS, in KB, of a running process as read from /proc, or
+        None if it cannot be read.
+    """
+    try:
+        with open("/proc/%d/status" % pid) as stream:
+            for line in stream:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def process_tree(pid):
+    """ Returns the (pid, command name) of the processes started by pid, directly
+        or not, read from /proc, or None where /proc is not available.
+    """
+    children = {}
+    try:
+        names = os.listdir("/proc")
+    except OSError:
+        return None
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % name, "rb") as stream:
+                stat = stream.read()
+        except OSError:
+            continue
+        # The command name, in parentheses, may hold spaces.
+        end = stat.rfind(b")")
+        fields = stat[end + 2:].split()
+        command = stat[stat.find(b"(") + 1:end].decode("utf-8", "replace")
+        children.setdefault(int(fields[1]), []).append((int(name), command))
+    found = []
+    pending = [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child[0])
+    return found
+
+
+class ProcessSampler(object):
+    """ Samples the processes started by this one, on a thread, and keeps the
+        largest number of them seen at the same time, in peak, and the largest
+        peak RSS of any of them, in KB, in peak_rss_kb. If commands is given,
+        only processes whose command name starts with one of its strings count
+        for peak_rss_kb. Both are None where they cannot be told. Processes
+        that start and end between two samples are not seen.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL, commands=None):
+        self.interval = interval
+        self.commands = commands
+        self.peak = 0
+        self.peak_rss_kb = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            found = process_tree(os.getpid())
+            if found is None:
+                self.peak = self.peak_rss_kb = None
+                return
+            self.peak = max(self.peak, len(found))
+            for pid, command in found:
+                # Read from /proc, as the peak RSS that finished children report
+                # to this process starts from its own, and children of children,
+                # such as the workers of a forkserver, do not report to it at all.
+                # Children that have not run their command yet still share the
+                # memory of this process, so they are left out by commands.
+                if self.commands is not None and not command.startswith(tuple(self.commands)):
+                    continue
+                rss = process_peak_rss_kb(pid)
+                if rss is not None:
+                    self.peak_rss_kb = max(self.peak_rss_kb, rss)
+            self._stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop_event.set()
+        self._thread.join()
+
+
+def measure(script, case, cwd=None, prefix=()):
+    """ Runs the benchmark script with --case in a fresh Python process, and
+        returns the measurements it prints as JSON on its last line. prefix is
+        a command line to run the process under, such as strace.
+    """
+    command = list(prefix) + [sys.executable, os.path.abspath(script), "--case", json.dumps(case)]
+    if cwd is None:
+        cwd = os.path.dirname(os.path.abspath(script))
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True, cwd=cwd).stdout
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def write_report(filename, results, **fields):
+    """ Writes the results to a JSON file, with a description of the machine and
+        any other fields given.
+    """
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    report.update(fields)
+    report["results"] = results
+    with open(filename, "w") as stream:
+        json.dump(report, stream, indent=1)
+
+
+def compare(results, baseline, tolerance, checks):
+    """ Prints the cases that are worse than in the baseline by more than
+        tolerance, a fraction, and returns the number of such cases. checks is a
+        list of (key, higher_is_worse, format), where format has two %
+        placeholders, for the new and the old value of the key.
+    """
+    previous = dict((result["name"], result) for result in baseline["results"])
+    regressions = 0
+    for result in results:
+        old = previous.get(result["name"])
+        if old is None:
+            continue
+        problems = []
+        for key, higher_is_worse, text in checks:
+            if result.get(key) is None or old.get(key) is None:
+                continue
+            if higher_is_worse:
+                worse = result[key] > old[key] * (1 + tolerance)
+            else:
+                worse = result[key] < old[key] * (1 - tolerance)
+            if worse:
+                problems.append(text % (result[key], old[key]))
+        if problems:
+            regressions += 1
+            print("REGRESSION %s: %s" % (result["name"], "; ".join(problems)))
+    return regressions
@@ -0,0 +1,75 @@
+'''
+File chooser that lists directories through the shared dirlisting cache.
+
+FileChooserListView lists its directory, and stats every file in it, on the
+UI thread each time it is opened. CachedFileChooserListView asks
+dirlisting.cache instead, which answers at once from what it knows, and scans
+on a worker thread. The view is refreshed as more entries come in.
+
+@author: vivian
+'''
+from functools import partial
+import os
+from kivy.clock import Clock
+from kivy.uix.filechooser import FileChooserListView, FileSystemAbstract, FileSystemLocal
+import dirlisting
+
+# Shortest time between two refreshes of a file chooser while its directory is
+# being scanned.
+REFRESH_INTERVAL = 0.3
+
+
+class CachedFileSystem(FileSystemAbstract):
+    """ File system for the file choosers that answers from a DirectoryCache.
+        Files that are not in the cache are looked at directly.
+    """
+    def __init__(self, listing_cache, listener=None):
+        super(CachedFileSystem, self).__init__()
+        self.listing_cache = listing_cache
+        self.listener = listener
+        self._local = FileSystemLocal()
+
+    def listdir(self, fn):
+        return self.listing_cache.listdir(fn, self.listener)
+
+    def getsize(self, fn):
+        entry = self.listing_cache.entry(fn)
+        if entry is None:
+            return self._local.getsize(fn)
+        return entry.size
+
+    def is_hidden(self, fn):
+        entry = self.listing_cache.entry(fn)
+        if entry is None:
+            return self._local.is_hidden(fn)
+        return entry.hidden
+
+    def is_dir(self, fn):
+        entry = self.listing_cache.entry(fn)
+        if entry is None:
+            return self._local.is_dir(fn)
+        return entry.is_dir
+
+
+class CachedFileChooserListView(FileChooserListView):
+    """ A FileChooserListView that lists directories off the UI thread, through
+        dirlisting.cache, and shows the entries as they come in.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault("file_system", CachedFileSystem(dirlisting.cache, self.listing_changed))
+        self._trigger_refresh = Clock.create_trigger(self.refresh, REFRESH_INTERVAL)
+        super(CachedFileChooserListView, self).__init__(**kwargs)
+
+    def listing_changed(self, path):
+        """ Called on the scanning thread when the listing of path has changed.
+        """
+        Clock.schedule_once(partial(self.show_listing, path))
+
+    def show_listing(self, path, *args):
+        """ Refreshes the view if it shows path.
+        """
+        if os.path.abspath(os.path.expanduser(self.path)) == path:
+            self._trigger_refresh()
+
+    def refresh(self, *args):
+        self._trigger_update()
@@ -0,0 +1,227 @@
+'''
+Cached, asynchronous directory listings for the file chooser dialogs.
+
+Listing a directory with tens of thousands of files, or one on a network
+mount, can take seconds, most of it spent on one stat() per file. The
+DirectoryCache does the listing on a worker thread with os.scandir, and keeps
+the entries of each directory it has listed, so that opening a dialog on the
+same directory again is instant.
+
+A directory that has not been listed yet is filled in as the scan goes, and
+listeners are told after every batch of entries, so a dialog can show the
+first entries while the rest are still coming in. A directory that is in the
+cache is shown straight away, and checked again in the background: if its
+mtime has changed, it is listed again, and the new listing replaces the old
+one once it is complete.
+
+The mtime of a directory changes when entries are added, removed or renamed,
+but not when a file in it is rewritten, so file sizes may be out of date until
+something else in the directory changes.
+
+This module does not use Kivy, see cachedchooser for the file chooser widget.
+
+@author: vivian
+'''
+import collections
+import os
+import stat
+import threading
+import time
+
+# Number of entries a scan adds to a listing before telling the listeners.
+BATCH_SIZE = 500
+# Number of directories kept in the cache.
+MAX_DIRECTORIES = 256
+# A listing is not checked against the directory's mtime more often than this.
+RECHECK_SECONDS = 1.0
+
+
+class DirectoryEntry(collections.namedtuple("DirectoryEntry", "is_dir size hidden")):
+    """ What the file chooser needs to know about an entry of a directory.
+    """
+    __slots__ = ()
+
+
+class DirectoryListing(object):
+    """ The entries of a directory, which may still be filled in by a scan.
+    """
+    def __init__(self, path, mtime_ns):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.entries = {}        # Name to DirectoryEntry.
+        self.complete = False
+        self.error = None        # The OSError that stopped the scan, if any.
+        self.checked = time.time()
+
+
+def _read_entry(entry):
+    """ Returns the DirectoryEntry for an os.DirEntry, doing at most one stat().
+    """
+    hidden = entry.name.startswith(".")
+    try:
+        is_dir = entry.is_dir()
+        info = entry.stat()
+    except OSError:
+        # A broken link, or an entry that was removed during the scan.
+        return DirectoryEntry(False, 0, hidden)
+    attributes = getattr(info, "st_file_attributes", 0)
+    if attributes & getattr(stat, "FILE_ATTRIBUTE_HIDDEN", 0):
+        hidden = True
+    if is_dir:
+        return DirectoryEntry(True, 0, hidden)
+    return DirectoryEntry(False, info.st_size, hidden)
+
+
+class DirectoryCache(object):
+    """ Directory listings, scanned on worker threads and kept for later.
+
+        Listeners are called as listener(path) on the scanning thread, whenever
+        the listing of path has changed. A GUI must hand the call over to its
+        own thread before touching any widgets.
+    """
+    def __init__(self, max_directories=MAX_DIRECTORIES):
+        self.max_directories = max_directories
+        self._listings = collections.OrderedDict()  # Path to DirectoryListing, oldest first.
+        self._scanning = {}     # Path being scanned to the listeners of the scan.
+        self._lock = threading.Lock()
+
+    def _get(self, path):
+        """ Returns the listing of path, or None. Must be called with the lock held.
+        """
+        listing = self._listings.get(path)
+        if listing is not None:
+            self._listings.move_to_end(path)
+        return listing
+
+    def _put(self, listing):
+        """ Stores a listing, dropping the least recently used ones if the cache is
+            full. Must be called with the lock held.
+        """
+        self._listings[listing.path] = listing
+        self._listings.move_to_end(listing.path)
+        while len(self._listings) > self.max_directories:
+            self._listings.popitem(last=False)
+
+    def request(self, path, listener=None):
+        """ Makes sure the listing of path is in the cache and up to date, starting
+            a scan on a worker thread if it is not, or if it may be out of date.
+            listener, if given, is told about every change to the listing, also
+            by a scan of path that is already running.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            listeners = self._scanning.get(path)
+            if listeners is not None:
+                if listener is not None and listener not in listeners:
+                    listeners.append(listener)
+                return
+            listing = self._get(path)
+            if listing is not None and listing.complete and \
+                    time.time() - listing.checked < RECHECK_SECONDS:
+                return
+            self._scanning[path] = [listener] if listener is not None else []
+        thread = threading.Thread(target=self._scan, args=(path, listing))
+        thread.daemon = True
+        thread.start()
+
+    def _scan(self, path, old_listing):
+        """ Runs on a worker thread.
+        """
+        try:
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError as e:
+                listing = DirectoryListing(path, None)
+                listing.error = e
+                listing.complete = True
+                with self._lock:
+                    self._put(listing)
+                self._notify(path)
+                return
+            if old_listing is not None and old_listing.complete and \
+                    old_listing.error is None and old_listing.mtime_ns == mtime_ns:
+                old_listing.checked = time.time()
+                return
+            listing = DirectoryListing(path, mtime_ns)
+            # A directory that was never listed is shown while it is being scanned,
+            # while a listing that is out of date is shown until the new one is done.
+            partial = old_listing is None
+            if partial:
+                with self._lock:
+                    self._put(listing)
+            batch = {}
+            try:
+                with os.scandir(path) as iterator:
+                    for entry in iterator:
+                        batch[entry.name] = _read_entry(entry)
+                        if len(batch) >= BATCH_SIZE:
+                            with self._lock:
+                                listing.entries.update(batch)
+                            batch = {}
+                            if partial:
+                                self._notify(path)
+            except OSError as e:
+                listing.error = e
+            with self._lock:
+                listing.entries.update(batch)
+                listing.complete = True
+                listing.checked = time.time()
+                self._put(listing)
+            self._notify(path)
+        finally:
+            with self._lock:
+                self._scanning.pop(path, None)
+
+    def _notify(self, path):
+        """ Tells the listeners of the scan of path that its listing changed.
+        """
+        with self._lock:
+            listeners = list(self._scanning.get(path, ()))
+        for listener in listeners:
+            listener(path)
+
+    def listdir(self, path, listener=None):
+        """ Returns the names in the listing of path that are known so far, and
+            requests the listing as for request(). Raises the OSError that stopped
+            the scan, if there are no names because the directory cannot be read.
+        """
+        self.request(path, listener)
+        path = os.path.abspath(path)
+        with self._lock:
+            listing = self._get(path)
+            if listing is None:
+                return []
+            if listing.error is not None and not listing.entries:
+                raise listing.error
+            return list(listing.entries)
+
+    def is_complete(self, path):
+        """ Returns True if the listing of path is in the cache and complete.
+        """
+        with self._lock:
+            listing = self._listings.get(os.path.abspath(path))
+            return listing is not None and listing.complete
+
+    def entry(self, filename):
+        """ Returns the DirectoryEntry for a file from the listing of its directory,
+            or None if that is not in the cache.
+        """
+        directory, name = os.path.split(os.path.abspath(filename))
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is None:
+                return None
+            return listing.entries.get(name)
+
+    def invalidate(self, path=None):
+        """ Drops the listing of path from the cache, or all listings if path is None.
+        """
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(os.path.abspath(path), None)
+
+
+# The cache shared by all the file choosers of an app.
+cache = DirectoryCache()
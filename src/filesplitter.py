@@ -9,35 +9,54 @@ lines, with source language text in one line, and the target language text
 in the next line. This app will split the corpus into two files, one containing
 the source language text, and the other containing the target language text.
 
+More target files can be added for corpora that come as triples, or as blocks
+of lines per language. Lines then go to the target files in turn, or in the
+order given by a pattern of target file numbers such as "1,1,2,2".
+
 Created on Feb 7, 2017
 
 Feb 19, 2017:   Added checkbox to allow appending to target files.
                 Add Exit button.
+Oct 18, 2026:   Stream the source file through splitengine instead of
+                reading the whole file into memory.
+                Split on a worker thread, with progress and a Cancel button.
+                Any number of target files, with a routing pattern.
+                Resume checkbox, to only append what is new in the source file.
+                Filter checkbox, to drop duplicate and empty pairs.
+                File dialogs list directories in the background, and
+                remember them for the next time they are opened.
 
 @author: vivian
 '''
 from functools import partial
+import threading
+import time
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.properties import ObjectProperty
 from kivy.uix.popup import Popup
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.label import Label
-from kivy.uix.filechooser import FileChooserListView
 from kivy.uix.textinput import TextInput
 from kivy.config import Config
 from kivy.uix.checkbox import CheckBox
+from cachedchooser import CachedFileChooserListView
+import dirlisting
+import pairfilter
+import splitengine
+import splitindex
 #from kivy.core.window import Window
 
 # Set the size of the main window.
 Config.set('graphics', 'width', '400')
-Config.set('graphics', 'height', '300')
+Config.set('graphics', 'height', '400')
 
 # This is the global variable containing the reference to the root widget.
 root = None
 
 class LoadDialog(BoxLayout):
-    """ Opens a FileChooserListView dialog box for user to choose a file to load.
+    """ Opens a file chooser dialog box for user to choose a file to load.
     """
     set_source_file = ObjectProperty(None)
     cancel = ObjectProperty(None)
@@ -55,7 +74,7 @@ class LoadDialog(BoxLayout):
     def build_window(self):
         """ Method to draw GUI elements.
         """
-        filechooser = FileChooserListView(path=self.default_path)
+        filechooser = CachedFileChooserListView(path=self.default_path)
         ok_button = Button(text="OK", on_press=partial(self.set_source_file, filechooser))
         cancel_button = Button(text="Cancel", on_press=self.cancel)
         button_row = BoxLayout(size_hint_y=None, height=30)
@@ -66,7 +85,7 @@ class LoadDialog(BoxLayout):
 
 
 class SaveDialog(BoxLayout):
-    """ Opens a FileChooserListView dialog box for user to choose a file to save to.
+    """ Opens a file chooser dialog box for user to choose a file to save to.
         The user can also key in a new filename in the text input box to save to a
         new file.
     """
@@ -88,7 +107,7 @@ class SaveDialog(BoxLayout):
     def build_window(self):
         """ Method to draw GUI elements.
         """
-        filechooser = FileChooserListView(path=self.default_path)
+        filechooser = CachedFileChooserListView(path=self.default_path)
         text_input = TextInput(text="", multiline=False)
         ok_button = Button(text="OK", on_press=partial(self.set_target_file, filechooser, text_input))
         cancel_button = Button(text="Cancel", on_press=self.cancel)
@@ -107,8 +126,16 @@ class RootWidget(BoxLayout):
     def __init__(self, **kwargs):
         super(RootWidget, self).__init__(**kwargs)
         self.orientation = "vertical"
+        self.target_filenames = [None, None]
         self.build_main_window()
         self.default_path = "/home/" # The default path that FileChoosers will open to.
+        # List the default path in the background, so the first dialog opens at once.
+        dirlisting.cache.request(self.default_path)
+        self._split_thread = None
+        self._cancel_event = threading.Event()
+        self._progress = None # (bytes_done, total_bytes, line_count) of the running split.
+        self._progress_event = None
+        self._split_start_time = 0
         global root
         root = self
         
@@ -126,23 +153,18 @@ class RootWidget(BoxLayout):
                             size_hint=(0.9, 0.9))
         self._popup.open()
 
-    def show_save1(self, *args):
-        """ Handler when "Set Target File 1" button is pressed.
+    def show_save(self, index, *args):
+        """ Handler when a "Set Target File" button is pressed.
         """
-        content = SaveDialog(set_target_file=self.set_target_file1, cancel=self.dismiss_popup)
-        self._popup = Popup(title="Set Target File 1", content=content,
+        content = SaveDialog(set_target_file=partial(self.set_target_file, index),
+                             cancel=self.dismiss_popup)
+        self._popup = Popup(title="Set Target File %d" % (index + 1), content=content,
                             size_hint=(0.9, 0.9))
         self._popup.open()
 
-    def show_save2(self, *args):
-        """ Handler when "Set Target File 2" button is pressed.
-        """
-        content = SaveDialog(set_target_file=self.set_target_file2, cancel=self.dismiss_popup)
-        self._popup = Popup(title="Set Target File 2", content=content,
-                            size_hint=(0.9, 0.9))
-        self._popup.open()
-        
     def close_app(self, *args):
+        # Stop any running split, so that the target files are left consistent.
+        self._cancel_event.set()
         self.root_app.stop(self)
 
     def set_source_file(self, filechooser, *args):
@@ -152,36 +174,68 @@ class RootWidget(BoxLayout):
         print(self.source_filename)
         self.source_label.text = str(self.source_filename)
         # Message prompt to tell user what to do next.
-        self.message_label.text = "Set name of first target file"
+        self.show_next_step()
         self.dismiss_popup()
     
-    def set_target_file1(self, filechooser, text_input, *args):
-        """ Called by SaveDialog to set the path and filename of the first target file.
+    def set_target_file(self, index, filechooser, text_input, *args):
+        """ Called by SaveDialog to set the path and filename of a target file.
         """
         # If user did not enter a name in the text box, save to the selected file.
         # Otherwise, save to a new file with the file name given by the user.
         if text_input.text == "":
-            self.target1_filename = filechooser.selection
+            if not filechooser.selection:
+                return
+            self.target_filenames[index] = filechooser.selection[0]
         else:
-            self.target1_filename = str(filechooser.path) + "/" + text_input.text
-        self.target1_label.text = str(self.target1_filename)
-        # Message prompt to tell user what to do next.
-        self.message_label.text = "Set name of second target file"
+            self.target_filenames[index] = str(filechooser.path) + "/" + text_input.text
+        self.target_labels[index].text = str(self.target_filenames[index])
+        self.show_next_step()
         self.dismiss_popup()
-    
-    def set_target_file2(self, filechooser, text_input, *args):
-        """ Called by SaveDialog to set the path and filename of the second target file.
+
+    def show_next_step(self):
+        """ Message prompt to tell user what to do next.
         """
-        # If user did not enter a name in the text box, save to the selected file.
-        # Otherwise, save to a new file with the file name given by the user.
-        if text_input.text == "":    
-            self.target2_filename = filechooser.selection
-        else:
-            self.target2_filename = str(filechooser.path) + "/" + text_input.text
-        self.target2_label.text = str(self.target2_filename)
-        # Message prompt to tell user what to do next.
+        for index, target_filename in enumerate(self.target_filenames):
+            if target_filename is None:
+                self.message_label.text = "Set name of target file %d" % (index + 1)
+                return
         self.message_label.text = "Ready to split file"
-        self.dismiss_popup()
+
+    def add_target(self, *args):
+        """ Handler when "Add Target" button is pressed.
+        """
+        self.target_filenames.append(None)
+        self.build_target_rows()
+        self.show_next_step()
+
+    def remove_target(self, *args):
+        """ Handler when "Remove Target" button is pressed. There are always at
+            least two target files.
+        """
+        if len(self.target_filenames) > 2:
+            self.target_filenames.pop()
+            self.build_target_rows()
+            self.show_next_step()
+
+    def build_target_rows(self):
+        """ Draws a row with a "Set Target File" button and a label for each target file.
+        """
+        self.target_list.clear_widgets()
+        self.target_list.size_hint_y = 0.15 * len(self.target_filenames)
+        self.target_labels = []
+        for index, target_filename in enumerate(self.target_filenames):
+            target_button = Button(text="Set Target File %d" % (index + 1),
+                                   on_press=partial(self.show_save, index),
+                                   size_hint_x=0.4, size_hint_y=None, height=30)
+            if target_filename is None:
+                target_label = Label(text="", size_hint_x=0.6)
+            else:
+                target_label = Label(text=str(target_filename), size_hint_x=0.6)
+            target_row = BoxLayout(orientation="horizontal")
+            target_row.add_widget(target_button)
+            target_row.add_widget(target_label)
+            self.target_list.add_widget(target_row)
+            self.target_labels.append(target_label)
 
     def set_root_app(self, root_app):
         self.root_app = root_app
@@ -193,13 +247,20 @@ class RootWidget(BoxLayout):
         source_button = Button(text="Select Source File", on_press=self.show_load,
                                size_hint_x=0.4, size_hint_y=None, height=30)
         self.source_label = Label(text="", size_hint_x=0.6)
-        target1_button = Button(text="Set Target File 1", on_press=self.show_save1,
-                                size_hint_x=0.4, size_hint_y=None, height=30)
-        self.target1_label = Label(text="", size_hint_x=0.6)
-        target2_button = Button(text="Set Target File 2", on_press=self.show_save2,
-                                size_hint_x=0.4, size_hint_y=None, height=30)
-        self.target2_label = Label(text="", size_hint_x=0.6)
-        execute_button = Button(text="Split File", on_press=self.split_file,
+        self.target_list = BoxLayout(orientation="vertical")
+        self.build_target_rows()
+        add_target_button = Button(text="Add Target", on_press=self.add_target,
+                                   size_hint_x=0.2, size_hint_y=None, height=30)
+        remove_target_button = Button(text="Remove Target", on_press=self.remove_target,
+                                      size_hint_x=0.2, size_hint_y=None, height=30)
+        pattern_label = Label(text="Pattern", size_hint_x=0.2)
+        # Target file numbers, e.g. "1,2,3". Empty means all target files in turn.
+        self.pattern_input = TextInput(text="", multiline=False, size_hint_x=0.4,
+                                       size_hint_y=None, height=30)
+        self.execute_button = Button(text="Split File", on_press=self.split_file,
+                                size_hint_x=None, width=100, size_hint_y=None, height=30,
+                                pos_hint={'y': 0, 'center_x': .5})
+        self.cancel_button = Button(text="Cancel", on_press=self.cancel_split, disabled=True,
                                 size_hint_x=None, width=100, size_hint_y=None, height=30,
                                 pos_hint={'y': 0, 'center_x': .5})
         exit_button = Button(text="Exit", on_press=self.close_app,
@@ -208,30 +269,39 @@ class RootWidget(BoxLayout):
         self.message_label = Label(text="Choose file to split") # Message prompt to tell user what to do next.
         append_label = Label(text="Append", size_hint_x=0.4)
         self.append_checkbox = CheckBox(active="True", size_hint_x=0.05)
-        spacer_label = Label(text="")
+        # When appending, only split the part of the source file that is new since the last split.
+        # Off by default, as only uncompressed ASCII and UTF-8 files can be split that way.
+        resume_label = Label(text="Resume", size_hint_x=0.4)
+        self.resume_checkbox = CheckBox(active=False, size_hint_x=0.05)
         checkbox_container = BoxLayout(padding=[10,0,5,0])
         checkbox_container.add_widget(self.append_checkbox)
         checkbox_container.add_widget(append_label)
-        checkbox_container.add_widget(spacer_label)
+        checkbox_container.add_widget(self.resume_checkbox)
+        checkbox_container.add_widget(resume_label)
+        # Drop duplicate pairs and pairs with an empty side while splitting.
+        filter_label = Label(text="Filter", size_hint_x=0.4)
+        self.filter_checkbox = CheckBox(active=False, size_hint_x=0.05)
+        checkbox_container.add_widget(self.filter_checkbox)
+        checkbox_container.add_widget(filter_label)
         source_row = BoxLayout(orientation="horizontal", size_hint_y=0.15)
-        target1_row = BoxLayout(orientation="horizontal", size_hint_y=0.15)
-        target2_row = BoxLayout(orientation="horizontal", size_hint_y=0.15)
+        pattern_row = BoxLayout(orientation="horizontal", size_hint_y=0.15)
         execute_row = BoxLayout(orientation="horizontal", size_hint_y=0.15)
         exit_row = BoxLayout(orientation="horizontal", size_hint_y=0.15)
         message_row = BoxLayout(orientation="horizontal", size_hint_y=0.25)
         source_row.add_widget(source_button)
         source_row.add_widget(self.source_label)
-        target1_row.add_widget(target1_button)
-        target1_row.add_widget(self.target1_label)
-        target2_row.add_widget(target2_button)
-        target2_row.add_widget(self.target2_label)
-        execute_row.add_widget(execute_button)
+        pattern_row.add_widget(add_target_button)
+        pattern_row.add_widget(remove_target_button)
+        pattern_row.add_widget(pattern_label)
+        pattern_row.add_widget(self.pattern_input)
+        execute_row.add_widget(self.execute_button)
+        execute_row.add_widget(self.cancel_button)
         execute_row.add_widget(checkbox_container)
         exit_row.add_widget(exit_button)
         message_row.add_widget(self.message_label)
         self.add_widget(source_row)
-        self.add_widget(target1_row)
-        self.add_widget(target2_row)
+        self.add_widget(self.target_list)
+        self.add_widget(pattern_row)
         self.add_widget(execute_row)
         self.add_widget(exit_row)
         self.add_widget(message_row)
@@ -245,23 +315,98 @@ class RootWidget(BoxLayout):
             Note: In Python, although line numbering will start with 0, 1, 2,...
             the source file is being split according to normal human convention
             for odd and even line numbering, i.e. the first line in the source
-            file will be stored in the array "odd_lines" while the second line
-            will be stored in "even_lines".
+            file will be stored in the first target file while the second line
+            will be stored in the second target file.
+
+            With more target files, or a pattern such as "1,1,2,2", each line
+            goes to the target files in the order given by the pattern instead.
+
+            The source file is streamed through splitengine on a worker thread,
+            so the GUI stays responsive while a large file is being split.
         """
-        if root.append_checkbox.active == True:
-            open_flag = "a"
-        else:
-            open_flag = "w"
-        with open(self.source_filename) as stream_in:
-            lines = stream_in.readlines()
-        odd_lines, even_lines = lines[::2], lines[1::2]
-        with open(self.target1_filename, open_flag) as stream_out1:
-            for odd_line in odd_lines:
-                stream_out1.write(odd_line)
-        with open(self.target2_filename, open_flag) as stream_out2:
-            for even_line in even_lines:
-                stream_out2.write(even_line)            
-        self.message_label.text = "File split completed!"
+        if self._split_thread is not None:
+            return
+        if None in self.target_filenames:
+            self.show_next_step()
+            return
+        try:
+            pattern = splitengine.parse_pattern(self.pattern_input.text,
+                                                len(self.target_filenames))
+        except ValueError as e:
+            self.message_label.text = str(e)
+            return
+        append = self.append_checkbox.active == True
+        incremental = append and self.resume_checkbox.active
+        pair_filter = None
+        if self.filter_checkbox.active:
+            if incremental:
+                self.message_label.text = "Untick Resume to filter pairs"
+                return
+            pair_filter = pairfilter.PairFilter(len(pattern))
+        self._cancel_event.clear()
+        self._progress = None
+        self._split_start_time = time.time()
+        self._split_thread = threading.Thread(target=self.run_split,
+                                              args=(self.source_filename,
+                                                    list(self.target_filenames), pattern, append,
+                                                    incremental, pair_filter))
+        self.execute_button.disabled = True
+        self.cancel_button.disabled = False
+        self.message_label.text = "Splitting file..."
+        self._progress_event = Clock.schedule_interval(self.show_progress, 0.2)
+        self._split_thread.start()
+
+    def run_split(self, source_filename, target_filenames, pattern, append, incremental,
+                  pair_filter):
+        """ Runs the split on the worker thread, then hands the result back to the
+            Kivy event loop with Clock.
+        """
+        try:
+            line_count = splitengine.route_file(source_filename, target_filenames, pattern,
+                                                append=append, progress=self.set_progress,
+                                                cancel_event=self._cancel_event,
+                                                incremental=incremental,
+                                                pair_filter=pair_filter)
+            message = "File split completed! %d lines." % line_count
+            if pair_filter is not None:
+                message += "\n" + pair_filter.summary()
+        except splitengine.SplitCancelled:
+            message = "File split cancelled."
+        except splitindex.SourceChanged as e:
+            message = str(e) + ". Untick Append to split it again."
+        except Exception as e:
+            message = "File split failed: " + str(e)
+        Clock.schedule_once(partial(self.split_finished, message))
+
+    def set_progress(self, bytes_done, total_bytes, line_count):
+        """ Called by splitengine on the worker thread after each chunk.
+            The GUI picks up the latest value in show_progress.
+        """
+        self._progress = (bytes_done, total_bytes, line_count)
+
+    def show_progress(self, *args):
+        """ Called by Clock on the Kivy event loop to show the progress of the split.
+        """
+        if self._progress is not None:
+            bytes_done, total_bytes, line_count = self._progress
+            self.message_label.text = splitengine.format_progress(
+                bytes_done, total_bytes, line_count, time.time() - self._split_start_time)
+
+    def cancel_split(self, *args):
+        """ Handler when "Cancel" button is pressed.
+        """
+        self._cancel_event.set()
+        self.message_label.text = "Cancelling..."
+
+    def split_finished(self, message, *args):
+        """ Called by Clock on the Kivy event loop when the worker thread is done.
+        """
+        self._progress_event.cancel()
+        self._split_thread.join()
+        self._split_thread = None
+        self.execute_button.disabled = False
+        self.cancel_button.disabled = True
+        self.message_label.text = message
 
 
 class FileSplitterApp(App):
@@ -0,0 +1,292 @@
+'''
+Metrics of the updates of the Git Pull Tool.
+
+An UpdateMetrics collector is given to a gitupdater.RepoUpdater, which tells
+it about every repository as it finishes, and about the end of each update.
+It turns each UpdateResult into RepoMetrics: how long the repository waited
+in the queue, how long checking its remote, starting git, fetching and
+merging took, how many bytes came in, the exit code, and the last line git
+wrote to stderr if it failed. At the end of an update it makes a RunSummary,
+with the counts of each status and the slowest repositories.
+
+Hooks subscribe to the collector with add_hook(). A hook is an object with the
+methods of MetricsHook: repo_finished(metrics) is called for each repository,
+and run_finished(summary, metrics) at the end of each update. Hooks are called
+one at a time, on the threads of the updater, so they must be quick, and hand
+over to their own thread anything that is not. A hook that raises is logged,
+and does not stop the update or the other hooks.
+
+Two hooks come with the module. JsonLinesExporter appends a JSON object per
+repository and per update to a file. PrometheusExporter writes the latest
+metrics of every repository to a file in the Prometheus text format, for the
+textfile collector of the node exporter, replacing it atomically after each
+update so the exporter never reads half a file.
+
+This module does not use Kivy.
+
+@author: vivian
+'''
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+import gitupdater
+
+# Number of slowest repositories named in the summary of an update.
+SLOWEST_COUNT = 5
+# Longest error summary kept, in characters.
+ERROR_LENGTH = 200
+# Prefix of the names of the Prometheus metrics.
+PROMETHEUS_PREFIX = "gitpull"
+
+# Phases of a pull, as fields of RepoMetrics, in the order they happen.
+PHASES = ("queue_wait", "check", "spawn", "network", "merge")
+
+
+class RepoMetrics(collections.namedtuple("RepoMetrics",
+                                         "path status exitcode finished seconds queue_wait check "
+                                         "spawn network merge bytes_received error")):
+    """ Metrics of the update of a repository. finished is the time it ended,
+        seconds the time it took after leaving the queue, and the phases are in
+        seconds as in gitupdater.PullTiming. bytes_received is None if not
+        known. error is the last line git wrote to stderr if the update failed,
+        or None.
+    """
+    __slots__ = ()
+
+
+class RunSummary(collections.namedtuple("RunSummary",
+                                        "started finished repositories ok up_to_date failed "
+                                        "bytes_received slowest")):
+    """ Summary of an update: when it started and finished, how many repositories
+        it had, and how many of them ended in each status. bytes_received is the
+        sum of those that are known. slowest is a list of (path, seconds) of the
+        slowest repositories, slowest first.
+    """
+    __slots__ = ()
+
+    @property
+    def seconds(self):
+        return self.finished - self.started
+
+
+def error_summary(err):
+    """ Returns the last line git wrote to stderr, cut to ERROR_LENGTH, or None.
+    """
+    lines = [line.strip() for line in (err or "").splitlines() if line.strip()]
+    if not lines:
+        return None
+    return lines[-1][:ERROR_LENGTH]
+
+
+def metrics_from_result(result, finished=None):
+    """ Returns the RepoMetrics of a finished gitupdater.UpdateResult.
+    """
+    if finished is None:
+        finished = time.time()
+    timing = result.timing
+    error = None
+    if result.status == gitupdater.FAILED:
+        error = error_summary(result.err)
+    return RepoMetrics(result.path, result.status, result.exitcode, finished, result.seconds,
+                       timing.queue_wait, timing.check, timing.spawn, timing.network,
+                       timing.merge, timing.bytes_received, error)
+
+
+class MetricsHook(object):
+    """ Base class of the hooks of an UpdateMetrics. Both methods do nothing, so
+        a hook only overrides those it needs.
+    """
+    def repo_finished(self, metrics):
+        """ Called with the RepoMetrics of each repository as it finishes.
+        """
+
+    def run_finished(self, summary, metrics):
+        """ Called at the end of each update with its RunSummary and the list of
+            RepoMetrics of its repositories.
+        """
+
+
+class UpdateMetrics(object):
+    """ Collects the metrics of updates, and passes them on to its hooks. The
+        metrics of the last update of each repository are kept in repos, and the
+        summary of the last update in last_summary.
+    """
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.repos = {}             # Path to the RepoMetrics of its last update.
+        self.last_summary = None
+        self._started = None
+        self._run = []              # RepoMetrics of the update that is running.
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        with self._lock:
+            self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        with self._lock:
+            if hook in self.hooks:
+                self.hooks.remove(hook)
+
+    def _call_hooks(self, method, *args):
+        """ Calls a method of every hook. Must be called with the lock held.
+        """
+        for hook in self.hooks:
+            try:
+                getattr(hook, method)(*args)
+            except Exception:
+                # Imported here, as it slows down starting scripts that never need it.
+                import logging
+                logging.getLogger(__name__).exception("Metrics hook %r failed", hook)
+
+    def run_started(self, paths):
+        with self._lock:
+            self._started = time.time()
+            self._run = []
+
+    def repo_finished(self, result):
+        """ Takes the UpdateResult of a repository that has finished.
+        """
+        metrics = metrics_from_result(result)
+        with self._lock:
+            self.repos[metrics.path] = metrics
+            self._run.append(metrics)
+            self._call_hooks("repo_finished", metrics)
+
+    def run_finished(self, results):
+        """ Makes the RunSummary of the update that has finished, with its
+            UpdateResults, and returns it.
+        """
+        with self._lock:
+            run, self._run = self._run, []
+            finished = time.time()
+            started = self._started
+            if started is None:
+                started = min([metrics.finished - metrics.seconds - metrics.queue_wait
+                               for metrics in run] or [finished])
+            self._started = None
+            counts = collections.Counter(result.status for result in results)
+            received = [metrics.bytes_received for metrics in run
+                        if metrics.bytes_received is not None]
+            slowest = sorted(run, key=lambda metrics: metrics.seconds, reverse=True)
+            summary = RunSummary(started, finished, len(results), counts[gitupdater.OK],
+                                 counts[gitupdater.UP_TO_DATE], counts[gitupdater.FAILED],
+                                 sum(received), [(metrics.path, metrics.seconds)
+                                                 for metrics in slowest[:SLOWEST_COUNT]])
+            self.last_summary = summary
+            self._call_hooks("run_finished", summary, run)
+        return summary
+
+
+class JsonLinesExporter(MetricsHook):
+    """ Appends a JSON object to filename for each repository that finishes, with
+        "type": "repo" and the fields of its RepoMetrics, and one for each
+        update, with "type": "run" and the fields of its RunSummary.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self._lock, open(self.filename, "a", encoding="utf-8") as stream:
+            stream.write(line)
+
+    def repo_finished(self, metrics):
+        record = {"type": "repo"}
+        record.update(metrics._asdict())
+        self.write(record)
+
+    def run_finished(self, summary, metrics):
+        record = {"type": "run", "seconds": summary.seconds}
+        record.update(summary._asdict())
+        self.write(record)
+
+
+def _label(value):
+    """ Returns value escaped for a label of the Prometheus text format.
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def prometheus_text(repos, summary, prefix=PROMETHEUS_PREFIX):
+    """ Returns the Prometheus text format of the RepoMetrics in repos, a dict by
+        path, and of summary, the RunSummary of the last update, or None.
+    """
+    lines = []
+    def family(name, kind, help_text, samples):
+        lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+        lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+        for labels, value in samples:
+            label_text = ",".join('%s="%s"' % (key, _label(label_value))
+                                  for key, label_value in labels)
+            if label_text:
+                label_text = "{" + label_text + "}"
+            lines.append("%s_%s%s %s" % (prefix, name, label_text, repr(float(value))))
+    paths = sorted(repos)
+    family("repo_phase_seconds", "gauge",
+           "Seconds each phase of the last update of a repository took.",
+           [((("path", path), ("phase", phase)), getattr(repos[path], phase))
+            for path in paths for phase in PHASES])
+    family("repo_duration_seconds", "gauge",
+           "Seconds the last update of a repository took after leaving the queue.",
+           [((("path", path),), repos[path].seconds) for path in paths])
+    family("repo_received_bytes", "gauge",
+           "Bytes the object store of a repository grew by in its last update.",
+           [((("path", path),), repos[path].bytes_received) for path in paths
+            if repos[path].bytes_received is not None])
+    family("repo_exit_code", "gauge",
+           "Exit code of git in the last update of a repository, -1 if it was killed.",
+           [((("path", path),), -1 if repos[path].exitcode is None else repos[path].exitcode)
+            for path in paths])
+    family("repo_success", "gauge",
+           "1 if the last update of a repository succeeded, else 0.",
+           [((("path", path), ("status", repos[path].status)),
+             int(repos[path].status != gitupdater.FAILED)) for path in paths])
+    family("repo_last_update_timestamp_seconds", "gauge",
+           "Time the last update of a repository finished.",
+           [((("path", path),), repos[path].finished) for path in paths])
+    if summary is not None:
+        family("run_repositories", "gauge",
+               "Repositories in the last update, by status.",
+               [((("status", gitupdater.OK),), summary.ok),
+                ((("status", gitupdater.UP_TO_DATE),), summary.up_to_date),
+                ((("status", gitupdater.FAILED),), summary.failed)])
+        family("run_duration_seconds", "gauge", "Seconds the last update took.",
+               [((), summary.seconds)])
+        family("run_received_bytes", "gauge", "Bytes received in the last update.",
+               [((), summary.bytes_received)])
+        family("run_last_timestamp_seconds", "gauge", "Time the last update finished.",
+               [((), summary.finished)])
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter(MetricsHook):
+    """ Writes the latest metrics of every repository that has been updated, and
+        the summary of the last update, to filename in the Prometheus text
+        format at the end of each update. The file is written next to its
+        final place and renamed over it.
+    """
+    def __init__(self, filename, prefix=PROMETHEUS_PREFIX):
+        self.filename = filename
+        self.prefix = prefix
+        self.repos = {}
+
+    def repo_finished(self, metrics):
+        self.repos[metrics.path] = metrics
+
+    def run_finished(self, summary, metrics):
+        text = prometheus_text(self.repos, summary, self.prefix)
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        handle, temp_name = tempfile.mkstemp(prefix=".gitpull-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(handle, "w", encoding="utf-8") as stream:
+                stream.write(text)
+            os.chmod(temp_name, 0o644)
+            os.replace(temp_name, self.filename)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
@@ -4,39 +4,85 @@ Utility app to pull updates for selected Git local repositories.
 Basically loops through a list of directories, go into each directory,
 and runs "git pull origin master" command to update each local repository.
 
+The repositories are pulled by gitupdater, several at a time, in the
+background, and the list shows the status of each of them as it changes.
+The output of git for the selected repository is shown live below the list.
+Repositories that have nothing new on their remote are not pulled at all.
+The list also shows the branch, HEAD commit, ahead/behind counts and dirty
+state of each repository, read by gitstatus and refreshed every few seconds.
+The repositories, and the outcome of their last pull, are kept in an SQLite
+database by reporegistry, next to the config file.
+
+The list is a RecycleView, which only has widgets for the rows on screen, so
+it stays quick with thousands of repositories. Status changes update single
+rows, and the list can be filtered by typing part of a path or status.
+
+If scheduled updates are turned on in the settings, gitscheduler decides which
+repositories to pull in the background, stalest and most active first, within
+a budget of pulls per minute, while no other update is running.
+
+"Find repositories" adds all the repositories found under the default Git
+directory at once, searched by repodiscovery on a background thread, and
+marks the repositories in the list that are no longer there as vanished.
+
+Every update is measured by gitmetrics: where the time of each repository
+went, how much it fetched, and how it ended. A summary of each update is
+logged, and the metrics can be written as JSON lines, and as a Prometheus
+text file for the node exporter, if their files are set in the settings.
+
+pullrepos.py does the same from the command line, without the GUI, and holds
+the settings and the parts of an update that the app shares with it.
+
 Created on Feb 10, 2017
 
 @author: vivian
 '''
 
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.uix.settings import SettingsWithTabbedPanel
 from kivy.logger import Logger
 from kivy.lang import Builder
-from kivy.properties import ObjectProperty
+from kivy.properties import BooleanProperty, ObjectProperty, StringProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.popup import Popup
-from kivy.uix.filechooser import FileChooserListView
 from kivy.uix.button import Button
 from functools import partial
-from kivy.uix.listview import ListItemButton
 import os
-import shlex
-from subprocess import Popen, PIPE
-from docutils.parsers.rst.directives import path
+import threading
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from cachedchooser import CachedFileChooserListView
+import dirlisting
+import gitmetrics
+import gitscheduler
+import gitstatus
+import gitupdater
+import pullrepos
+import repodiscovery
+import reporegistry
 #from kivy.core.window import Window
 
+# Seconds between refreshes of the status of the repositories in the list.
+STATUS_INTERVAL = 10
+# Seconds between checks for repositories that are due a scheduled update.
+SCHEDULE_INTERVAL = 5
+
 # Define GUI with KV language
 kv = '''
-#: import main gitpulltool
-#: import ListAdapter kivy.adapters.listadapter.ListAdapter
-#: import ListItemButton kivy.uix.listview.ListItemButton
-
 RootWidget:
 
+<PathButton>:
+    halign: "left"
+    valign: "middle"
+    text_size: self.size
+    padding_x: 5
+    background_color: (0.3, 0.5, 0.9, 1) if self.selected else (1, 1, 1, 1)
+    on_release: app.root.select_path(self.path)
+
 <RootWidget>:
     orientation: "vertical"
     path_list: path_list_view
+    log_view: log_view
 
     BoxLayout:
         orientation: "horizontal"
@@ -44,34 +90,56 @@ RootWidget:
         Button:
             text: 'Update repositories'
             on_release: root.update_repositories()
-            size_hint_x: 0.22
+            size_hint_x: 0.2
         Label:
             text: ""
-            size_hint_x: 0.05
+            size_hint_x: 0.03
         Button:
             text: 'Add local repository'
             on_release: root.handle_add()
-            size_hint_x: 0.23
+            size_hint_x: 0.2
+        Button:
+            text: 'Find repositories'
+            on_release: root.discover_repositories()
+            size_hint_x: 0.17
         Button:
             text: 'Remove local repository'
             on_release: root.del_path()
-            size_hint_x: 0.24
+            size_hint_x: 0.22
         Label:
             text: ""
-            size_hint_x: 0.05
+            size_hint_x: 0.03
         Button:
             text: 'Configure app'
             on_release: app.open_settings()
-            size_hint_x: 0.18
+            size_hint_x: 0.15
         Button:
             text: "Exit"
             on_press: app.stop() 
             size_hint_x: 0.12
-    ListView:
+    TextInput:
+        id: filter_input
+        size_hint_y: None
+        height: 30
+        multiline: False
+        hint_text: "Filter repositories"
+        on_text: root.apply_filter(self.text)
+    RecycleView:
         id: path_list_view
-        size_hint_y: 0.9
-        adapter:
-            ListAdapter(data=[], cls=main.PathButton)
+        size_hint_y: 0.6
+        viewclass: "PathButton"
+        RecycleBoxLayout:
+            orientation: "vertical"
+            default_size: None, 25
+            default_size_hint: 1, None
+            size_hint_y: None
+            height: self.minimum_height
+    TextInput:
+        id: log_view
+        size_hint_y: 0.3
+        readonly: True
+        font_size: 12
+        text: "Select a repository to see the output of its last update."
 '''
 
 # This JSON defines entries we want to appear in our App configuration screen
@@ -90,27 +158,76 @@ json = '''
         "desc": "Choose the default directory were local repositories can be found",
         "section": "Setup",
         "key": "default_git_repo"
+    },
+    {
+        "type": "numeric",
+        "title": "Concurrent updates",
+        "desc": "Number of repositories to update at the same time",
+        "section": "Setup",
+        "key": "workers"
+    },
+    {
+        "type": "numeric",
+        "title": "Update timeout",
+        "desc": "Seconds after which the update of a repository is stopped",
+        "section": "Setup",
+        "key": "timeout"
+    },
+    {
+        "type": "bool",
+        "title": "Skip repositories that are up to date",
+        "desc": "Ask the remote first, and only pull repositories that have something new",
+        "section": "Setup",
+        "key": "precheck"
+    },
+    {
+        "type": "bool",
+        "title": "Scheduled updates",
+        "desc": "Keep the repositories up to date in the background",
+        "section": "Setup",
+        "key": "schedule"
+    },
+    {
+        "type": "numeric",
+        "title": "Scheduled update interval",
+        "desc": "Minutes between scheduled updates of a repository that has no failures",
+        "section": "Setup",
+        "key": "schedule_interval"
+    },
+    {
+        "type": "numeric",
+        "title": "Scheduled update rate",
+        "desc": "Most scheduled updates started in a minute",
+        "section": "Setup",
+        "key": "schedule_rate"
+    },
+    {
+        "type": "string",
+        "title": "Metrics log",
+        "desc": "File to append the metrics of each update to, as JSON lines, or empty",
+        "section": "Setup",
+        "key": "metrics_jsonl"
+    },
+    {
+        "type": "string",
+        "title": "Prometheus metrics file",
+        "desc": "File to write the metrics of the updates to, for the node exporter, or empty",
+        "section": "Setup",
+        "key": "metrics_prometheus"
     }
 ]
 '''
 
-def execute_shell_cmd(cmd):
-    """
-    Execute the external command and get its exitcode, stdout and stderr.
+class PathButton(RecycleDataViewBehavior, Button):
+    """ A row of the repository list. Its text, path and selected properties are
+        set from the row's entry in the data of the RecycleView.
     """
-    args = shlex.split(cmd)
-    proc = Popen(args, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate()
-    exitcode = proc.returncode
-    return exitcode, out, err
-
-
-class PathButton(ListItemButton):
-    pass
+    path = StringProperty("")
+    selected = BooleanProperty(False)
 
 
 class PathChooser(BoxLayout):
-    """ Opens a FileChooserListView dialog box for user to choose a file to load.
+    """ Opens a file chooser dialog box for user to choose a file to load.
     """
     add_path = ObjectProperty(None)
     cancel = ObjectProperty(None)
@@ -126,7 +243,7 @@ class PathChooser(BoxLayout):
     def build_window(self):
         """ Method to draw GUI elements.
         """
-        filechooser = FileChooserListView(path=self.default_path)
+        filechooser = CachedFileChooserListView(path=self.default_path)
         filechooser.dirselect = True
         ok_button = Button(text="OK", on_press=partial(self.add_path, filechooser))
         cancel_button = Button(text="Cancel", on_press=self.cancel)
@@ -139,9 +256,33 @@ class PathChooser(BoxLayout):
 
 class RootWidget(BoxLayout):
     path_list = ObjectProperty()
+    log_view = ObjectProperty()
     git_location = ""
     default_git_repo = ""
 
+    def __init__(self, **kwargs):
+        self.repo_status = {} # Path to the status of the repository in the last update.
+        self.updater = None
+        self._trigger_refresh = Clock.create_trigger(self.refresh_path_list, 0.2)
+        self.paths = []         # All repositories, in the order they were added.
+        self.selected = None    # Path of the selected repository.
+        self.filter_text = ""
+        self._row_index = {}    # Path to the index of its row in the list data.
+        self._changed_paths = set() # Paths whose rows need updating.
+        self._log_event = None
+        self._log_shown = None # (path, version) of the log in the log view.
+        self.repo_info = {} # Path to the description of the repository's status.
+        self.status_cache = None
+        self._status_thread = None
+        self.registry = None
+        self.vanished = set()   # Paths that were no longer repositories at the last search.
+        self._discover_thread = None
+        self.scheduler = gitscheduler.UpdateScheduler()
+        self.metrics = gitmetrics.UpdateMetrics()
+        self._exporters = []    # Metrics hooks made from the settings.
+        super(RootWidget, self).__init__(**kwargs)
+
+
     def dismiss_popup(self, *args):
         """ Closes any popup that is opened.
         """
@@ -159,56 +300,299 @@ class RootWidget(BoxLayout):
 
 
     def add_path(self, filechooser, *args):
-        """ Called by PathChooser to set the path and filename of the source file.
+        """ Called by PathChooser to add the chosen directory to the registry.
         """
-        self.path_list.adapter.data.extend([filechooser.selection[0]])
-        self.path_list._trigger_reset_populate()
-        repo_list_string = ",".join(self.path_list.adapter.data)
-        self.config.set('Setup', 'repo_list', repo_list_string)
-        print("repo list: "+ self.config.get('Setup', 'repo_list'))
-        self.config.write()
+        if filechooser.selection:
+            path = self.registry.add(filechooser.selection[0])
+            if path is not None:
+                self.paths.append(path)
+                self.scheduler.sync(self.paths)
+                if self.matches_filter(path):
+                    self._row_index[path] = len(self.path_list.data)
+                    self.path_list.data.append(self.row_data(path))
+                self.refresh_statuses()
         self.dismiss_popup()
 
         
     def del_path(self, *args):
         """ Handler when "Remove local directory" button is pressed.
         """
-        if self.path_list.adapter.selection:
-            selection = self.path_list.adapter.selection[0].text
-            self.path_list.adapter.data.remove(selection)
-            self.path_list._trigger_reset_populate()
+        if self.selected is not None:
+            self.registry.remove(self.selected)
+            self.paths.remove(self.selected)
+            self.scheduler.sync(self.paths)
+            self.selected = None
+            self.build_rows()
 
 
-    def add_data_from_config(self, repo_list):
-        """ Adds the paths obtained from ConfigParser to the path list.
-        
-            repo_list is a CSV string, which needs to be split into a Python list.
+    def discover_repositories(self, *args):
+        """ Handler when "Find repositories" button is pressed. Searches the default
+            Git directory on a background thread, unless that is being done already.
+        """
+        if not self.default_git_repo or \
+                (self._discover_thread is not None and self._discover_thread.is_alive()):
+            return
+        root = self.default_git_repo
+        def run():
+            scanner = repodiscovery.RepoScanner()
+            found = repodiscovery.scan_cached(scanner, self.registry, root)
+            added, vanished = repodiscovery.sync_registry(self.registry, found)
+            Logger.info("gitpulltool: Searched %s: %d directories listed, %d cached, "
+                        "%d repositories added, %d vanished" % (
+                            root, scanner.listed, scanner.cached, len(added), len(vanished)))
+            Clock.schedule_once(partial(self.show_discovered, added, vanished))
+        self._discover_thread = threading.Thread(target=run)
+        self._discover_thread.daemon = True
+        self._discover_thread.start()
+
+
+    def show_discovered(self, added, vanished, *args):
+        self.paths.extend(added)
+        self.scheduler.sync(self.paths)
+        self.vanished = set(vanished)
+        self.build_rows()
+        if added:
+            self.refresh_statuses()
+
+
+    def set_registry(self, registry):
+        """ Fills the path list with the repositories in the registry.
         """
-        self.path_list.adapter.data.clear()
-        for path in repo_list.split(","):
-            self.path_list.adapter.data.append(path)
-        self.path_list._trigger_reset_populate()
+        self.registry = registry
+        self.paths = registry.paths()
+        self.scheduler.load(registry.records())
+        self.build_rows()
 
     
     def set_config(self, config):
         self.config = config
+        self.status_cache = gitstatus.StatusCache(config.get("Setup", "git_location"))
+        self.configure_scheduler()
+        self.configure_metrics()
+
+
+    def configure_scheduler(self):
+        """ Applies the scheduled update settings to the scheduler.
+        """
+        self.scheduler.interval = float(self.config.get("Setup", "schedule_interval")) * 60
+        self.scheduler.rate = max(1, int(float(self.config.get("Setup", "schedule_rate"))))
+        self.scheduler.paused = not self.config.getboolean("Setup", "schedule")
+
+
+    def configure_metrics(self):
+        """ Replaces the metrics exporters with those set in the settings.
+        """
+        for hook in self._exporters:
+            self.metrics.remove_hook(hook)
+        self._exporters = pullrepos.metrics_hooks(self.config)
+        for hook in self._exporters:
+            self.metrics.add_hook(hook)
         
         
-    def update_repositories(self):
-        """ Handler when "Update repositories" button is pressed.
+    def row_text(self, path):
+        text = path
+        if path in self.repo_status:
+            text = "%s   [%s]" % (path, self.repo_status[path])
+        if path in self.repo_info:
+            text = "%s   %s" % (text, self.repo_info[path])
+        if path in self.vanished:
+            text = "%s   (vanished)" % text
+        return text
+
+
+    def row_data(self, path):
+        """ Returns the entry of a path in the data of the list.
+        """
+        return {"text": self.row_text(path), "path": path, "selected": path == self.selected}
+
+
+    def matches_filter(self, path):
+        return self.filter_text in self.row_text(path).lower()
+
+
+    def build_rows(self):
+        """ Sets the data of the list to the rows of the paths that match the filter.
+        """
+        rows = [self.row_data(path) for path in self.paths if self.matches_filter(path)]
+        self._row_index = dict((row["path"], index) for index, row in enumerate(rows))
+        self._changed_paths.clear()
+        self.path_list.data = rows
+
+
+    def apply_filter(self, text):
+        """ Shows only the repositories whose row contains text, in any case.
+        """
+        self.filter_text = text.strip().lower()
+        self.build_rows()
+
+
+    def path_changed(self, path):
+        """ Marks the row of a path for updating on the next refresh of the list.
+        """
+        self._changed_paths.add(path)
+        self._trigger_refresh()
+
+
+    def refresh_path_list(self, *args):
+        """ Updates the rows whose paths changed. Replacing single entries of the
+            data only rebuilds those rows, if they are on screen. The whole list is
+            only rebuilt if a row has to come or go, as its text no longer or now
+            matches the filter.
+        """
+        changed, self._changed_paths = self._changed_paths, set()
+        if len(changed) > len(self._row_index) // 2:
+            # Most rows changed anyway.
+            self.build_rows()
+            return
+        if self.filter_text and any((path in self._row_index) != self.matches_filter(path)
+                                    for path in changed):
+            self.build_rows()
+            return
+        for path in changed:
+            index = self._row_index.get(path)
+            if index is not None:
+                self.path_list.data[index] = self.row_data(path)
+
+
+    def select_path(self, path):
+        """ Called by a PathButton when it is pressed.
+        """
+        previous, self.selected = self.selected, path
+        for changed in (previous, path):
+            index = self._row_index.get(changed)
+            if index is not None:
+                self.path_list.data[index] = self.row_data(changed)
+        self.show_log()
+
+
+    def visible_paths(self):
+        """ Returns the paths of the rows on screen.
+        """
+        return [view.path for view in self.path_list.view_adapter.views.values()]
+
+
+    def refresh_statuses(self, *args):
+        """ Reads the status of the repositories in the list on a background thread,
+            unless that is being done already. git is only run for the rows on
+            screen whose .git directory changed since it last ran, and for the
+            selected repository once its status is SLOW_MAX_AGE old.
+        """
+        if self._status_thread is not None and self._status_thread.is_alive():
+            return
+        paths = list(self.paths)
+        listed = set(paths)
+        shown = [path for path in self.visible_paths() if path in listed]
+        selected = self.selected
+        def run():
+            statuses = dict(zip(paths, self.status_cache.statuses(paths, slow=False)))
+            statuses.update(zip(shown, self.status_cache.statuses(shown)))
+            if selected in statuses:
+                statuses[selected] = self.status_cache.status(
+                    selected, max_age=gitstatus.SLOW_MAX_AGE)
+            Clock.schedule_once(partial(self.show_statuses, paths,
+                                        [statuses[path] for path in paths]))
+        self._status_thread = threading.Thread(target=run)
+        self._status_thread.daemon = True
+        self._status_thread.start()
+
+
+    def show_statuses(self, paths, statuses, *args):
+        for path, status in zip(paths, statuses):
+            description = gitstatus.describe(status)
+            if self.repo_info.get(path) != description:
+                self.repo_info[path] = description
+                self.path_changed(path)
+
+
+    def show_log(self, *args):
+        """ Shows the output of git for the selected repository, if it changed.
+        """
+        path = self.selected
+        if path is None or self.updater is None or path not in self.updater.logs:
+            return
+        log = self.updater.logs[path]
+        if self._log_shown == (path, log.version):
+            return
+        self._log_shown = (path, log.version)
+        self.log_view.text = log.text()
+        # Keep the latest output in view.
+        self.log_view.cursor = self.log_view.get_cursor_from_index(len(self.log_view.text))
+
+
+    def update_repositories(self, paths=None):
+        """ Handler when "Update repositories" button is pressed. Also called for
+            scheduled updates, with the paths of the repositories that are due.
+        """
+        if self.updater is not None and self.updater.is_running():
+            return
+        if paths is None:
+            paths = self.registry.paths()
+        self.updater = pullrepos.make_updater(self.config, listener=self.repo_status_changed,
+                                              metrics=self.metrics)
+        self.updater.start(paths, finished=self.repositories_updated)
+        self._log_shown = None
+        if self._log_event is None:
+            self._log_event = Clock.schedule_interval(self.show_log, 0.25)
+
+
+    def repo_status_changed(self, result):
+        """ Called by the updater, on one of its threads, when the status of a
+            repository changes.
+        """
+        changed = False
+        if result.status in (gitupdater.OK, gitupdater.FAILED, gitupdater.UP_TO_DATE):
+            changed = pullrepos.record_result(self.registry, self.status_cache, result)
+        Clock.schedule_once(partial(self.show_status, result, changed))
+
+
+    def show_status(self, result, changed, *args):
+        self.repo_status[result.path] = result.status
+        if result.status in (gitupdater.OK, gitupdater.FAILED, gitupdater.UP_TO_DATE):
+            self.scheduler.record(result.path, result.status == gitupdater.FAILED, changed)
+            metrics = self.metrics.repos.get(result.path)
+            if metrics is not None and metrics.error is not None:
+                Logger.warning("gitpulltool: %s failed with exit code %s: %s" % (
+                    result.path, metrics.exitcode, metrics.error))
+        self.path_changed(result.path)
+
+
+    def repositories_updated(self, results):
+        """ Called by the updater, on its own thread, when all repositories are done.
         """
-        git_cmd = self.config.get("Setup", "git_location") + " " + "pull origin master"
-        current_dir = os.getcwd()
-        for path in self.config.get("Setup", "repo_list").split(","):
-            if path == "":
-                pass
-            else:
-                os.chdir(path)
-                print("Changing to: " + os.getcwd())
-                print(git_cmd)
-                exitcode, out, err = execute_shell_cmd(git_cmd)
-                print(out)
-        os.chdir(current_dir)
+        summary = self.metrics.last_summary
+        if summary is not None:
+            Logger.info("gitpulltool: Updated %d repositories in %.1f s: %d ok, %d up to date, "
+                        "%d failed, %d bytes received" % (
+                            summary.repositories, summary.seconds, summary.ok,
+                            summary.up_to_date, summary.failed, summary.bytes_received))
+            for path, seconds in summary.slowest:
+                Logger.info("gitpulltool: %.1f s %s" % (seconds, path))
+        Clock.schedule_once(self.stop_showing_log)
+        Clock.schedule_once(self.refresh_statuses)
+
+
+    def scheduled_update(self, *args):
+        """ Starts an update of the repositories that are due, unless an update is
+            running already.
+        """
+        if self.updater is not None and self.updater.is_running():
+            return
+        paths = self.scheduler.take_due()
+        if paths:
+            Logger.info("gitpulltool: Scheduled update of %d repositories" % len(paths))
+            self.update_repositories(paths)
+
+
+    def stop_showing_log(self, *args):
+        if self._log_event is not None:
+            self._log_event.cancel()
+            self._log_event = None
+        self.show_log()
+
+
+    def cancel_update(self):
+        if self.updater is not None:
+            self.updater.cancel()
 
 
 class GitPullApp(App):
@@ -225,9 +609,21 @@ class GitPullApp(App):
         # We apply the saved configuration settings or the defaults
         self.root = Builder.load_string(kv)
         self.root.default_git_repo = self.config.get('Setup', 'default_git_repo')
+        # List the default directory in the background, so the dialog opens at once.
+        dirlisting.cache.request(self.root.default_git_repo)
         self.root.set_config(self.config)
-        print("Repo: " + self.config.get('Setup', 'repo_list'))
-        self.root.add_data_from_config(self.config.get('Setup', 'repo_list'))
+        self.registry = reporegistry.RepoRegistry(os.path.join(
+            os.path.dirname(self.get_application_config()), reporegistry.REGISTRY_NAME))
+        # The repositories used to be kept in the config, and are moved over once.
+        repo_list = self.config.get('Setup', 'repo_list')
+        if repo_list:
+            self.registry.migrate_repo_list(repo_list)
+            self.config.set('Setup', 'repo_list', '')
+            self.config.write()
+        self.root.set_registry(self.registry)
+        Clock.schedule_once(self.root.refresh_statuses)
+        Clock.schedule_interval(self.root.refresh_statuses, STATUS_INTERVAL)
+        Clock.schedule_interval(self.root.scheduled_update, SCHEDULE_INTERVAL)
         return self.root
 
 
@@ -235,7 +631,13 @@ class GitPullApp(App):
         """
         Set the default values for the configs sections.
         """
-        config.setdefaults('Setup', {'git_location': 'git', 'default_git_repo': '', 'repo_list': ''})
+        config.setdefaults('Setup', pullrepos.CONFIG_DEFAULTS)
+
+
+    def on_stop(self):
+        # Stop any running pulls, rather than leaving git processes behind.
+        self.root.cancel_update()
+        self.registry.close()
 
 
     def build_settings(self, settings):
@@ -258,8 +660,13 @@ class GitPullApp(App):
         if section == "Setup":
             if key == "git_location":
                 self.root.git_location = value
+                self.root.status_cache = gitstatus.StatusCache(value)
             elif key == 'default_git_repo':
                 self.root.default_git_repo = value
+            elif key in ('schedule', 'schedule_interval', 'schedule_rate'):
+                self.root.configure_scheduler()
+            elif key in ('metrics_jsonl', 'metrics_prometheus'):
+                self.root.configure_metrics()
 
 
 def main():
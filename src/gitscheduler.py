@@ -0,0 +1,163 @@
+'''
+Background update schedule for the Git Pull Tool.
+
+Decides which repositories to pull next, so that they can be kept fresh
+without anyone pressing "Update repositories". The UpdateScheduler only keeps
+the schedule; the app asks it for the repositories that are due, pulls them
+the usual way, and tells it how each pull went.
+
+Each repository is due again an interval after its last pull. The interval is
+shorter for active repositories, whose pulls often bring something new, and
+doubles with each failure in a row, up to MAX_BACKOFF, so that a repository
+whose remote is gone is not tried over and over. Every due time is moved by
+up to JITTER of the interval either way, so that repositories added together
+spread out over time instead of all being pulled at once.
+
+Of the repositories that are due, the stalest are pulled first, weighted by
+how active they are. How many pulls are started is limited by a rate budget
+of pulls per minute, kept as a token bucket, and scheduling can be paused.
+
+This module does not use Kivy.
+
+@author: vivian
+'''
+import random
+import time
+
+# Seconds between pulls of a repository that does not change.
+DEFAULT_INTERVAL = 3600
+# Most pulls started in a minute, and so also the most started at once.
+DEFAULT_RATE = 30
+# Fraction of the interval by which due times are moved at random.
+JITTER = 0.1
+# Longest interval for a repository that keeps failing, in seconds.
+MAX_BACKOFF = 24 * 3600
+# Weight of the latest pull in the activity of a repository.
+ACTIVITY_WEIGHT = 0.3
+
+
+class RepoSchedule(object):
+    """ What the scheduler knows about a repository.
+    """
+    def __init__(self, last_pull=None, failures=0, activity=0.0):
+        self.last_pull = last_pull  # Time the last pull ended, or None.
+        self.failures = failures    # Failed pulls in a row.
+        self.activity = activity    # Between 0 and 1: how often pulls bring something new.
+        self.due = 0                # Time the next pull is due.
+
+
+class UpdateScheduler(object):
+    """ Keeps the schedule of the repositories, see the module documentation.
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL, rate=DEFAULT_RATE, jitter=JITTER,
+                 max_backoff=MAX_BACKOFF, rng=None):
+        self.interval = interval
+        self.rate = rate
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.rng = rng or random.Random()
+        self.paused = False
+        self.repos = {}             # Path to RepoSchedule.
+        self._tokens = float(rate)
+        self._tokens_time = None
+
+    def interval_for(self, schedule):
+        """ Returns the time between pulls of a repository, before jitter.
+        """
+        interval = self.interval / (1 + schedule.activity)
+        if schedule.failures:
+            interval = min(interval * 2 ** schedule.failures, self.max_backoff)
+        return interval
+
+    def _plan(self, schedule):
+        """ Sets the due time of a repository from its last pull.
+        """
+        if schedule.last_pull is None:
+            schedule.due = 0
+        else:
+            interval = self.interval_for(schedule)
+            schedule.due = schedule.last_pull + interval * (
+                1 + self.jitter * self.rng.uniform(-1, 1))
+
+    def load(self, records):
+        """ Starts the schedule from the reporegistry RepoRecords of the repositories.
+            A repository whose last pull failed is taken to have failed once.
+        """
+        self.repos = {}
+        for record in records:
+            schedule = RepoSchedule(record.last_pull, int(record.status == "failed"))
+            self._plan(schedule)
+            self.repos[record.path] = schedule
+
+    def sync(self, paths):
+        """ Adds repositories that are not in the schedule yet, due at once, and
+            drops those that are not in paths.
+        """
+        paths = list(paths)
+        keep = set(paths)
+        for path in list(self.repos):
+            if path not in keep:
+                del self.repos[path]
+        for path in paths:
+            if path not in self.repos:
+                self.repos[path] = RepoSchedule()
+
+    def _refill(self, now):
+        if self._tokens_time is not None:
+            self._tokens = min(float(self.rate),
+                               self._tokens + (now - self._tokens_time) * self.rate / 60.0)
+        self._tokens_time = now
+
+    def priority(self, schedule, now):
+        """ Returns how urgently a due repository should be pulled: the time since
+            its last pull, weighted by its activity.
+        """
+        if schedule.last_pull is None:
+            return float("inf")
+        return (now - schedule.last_pull) * (1 + schedule.activity)
+
+    def take_due(self, limit=None, now=None):
+        """ Returns the repositories to pull now, most urgent first, within the
+            rate budget and at most limit of them. Returns nothing while paused.
+        """
+        if now is None:
+            now = time.time()
+        self._refill(now)
+        if self.paused:
+            return []
+        due = [path for path, schedule in self.repos.items() if schedule.due <= now]
+        due.sort(key=lambda path: self.priority(self.repos[path], now), reverse=True)
+        count = min(len(due), int(self._tokens))
+        if limit is not None:
+            count = min(count, limit)
+        self._tokens -= count
+        return due[:count]
+
+    def record(self, path, failed, changed, now=None):
+        """ Tells the scheduler how a pull went: whether it failed, and whether it
+            brought anything new. Plans the next pull of the repository.
+        """
+        if now is None:
+            now = time.time()
+        schedule = self.repos.setdefault(path, RepoSchedule())
+        schedule.last_pull = now
+        if failed:
+            schedule.failures += 1
+        else:
+            schedule.failures = 0
+            schedule.activity = (1 - ACTIVITY_WEIGHT) * schedule.activity + \
+                ACTIVITY_WEIGHT * float(changed)
+        self._plan(schedule)
+
+    def next_due(self):
+        """ Returns the earliest due time of any repository, or None if there are none.
+        """
+        if not self.repos:
+            return None
+        return min(schedule.due for schedule in self.repos.values())
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
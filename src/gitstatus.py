@@ -0,0 +1,321 @@
+'''
+Repository status for the Git Pull Tool.
+
+Tells the branch, HEAD commit and upstream of a repository by reading HEAD,
+the loose refs, packed-refs and config straight from its .git directory,
+which takes a few stat() and read() calls instead of starting git. What was
+read is cached, along with the mtimes of the files it came from, and read
+again only when one of those files changes.
+
+Whether the work tree is dirty, and how far HEAD is ahead of or behind its
+upstream, cannot be told from the .git directory alone. They come from a
+single "git status --porcelain=v2 --branch" call, which is told not to write
+the index, so that it does not change what it is cached by. Its answer is
+kept while HEAD, the upstream and the mtime of the index stay the same, so a
+refresh of many repositories where nothing moved runs no git at all. Edits to
+tracked files that have not been added leave all of those alone, so callers
+that want them, such as for the repository the user is looking at, pass a
+max_age, such as SLOW_MAX_AGE, after which git is asked again. Repositories
+whose refs are not plain files, such as those using reftable, get all their
+status from git.
+
+This module does not use Kivy.
+
+@author: vivian
+'''
+import collections
+import os
+import re
+import threading
+import time
+import gitupdater
+
+# Seconds after which callers that pass it as max_age have the dirty state and
+# ahead/behind counts of a repository read again, even if nothing in its .git
+# directory changed.
+SLOW_MAX_AGE = 60
+# Number of git processes run at the same time to find the dirty states.
+DEFAULT_WORKERS = 8
+
+
+class RepoStatus(collections.namedtuple("RepoStatus",
+                                        "path branch head upstream ahead behind dirty error")):
+    """ Status of a repository. branch is None if HEAD is detached, head is None
+        in a repository without commits, and upstream is the short name of the
+        upstream branch, or None. ahead, behind and dirty are None when they are
+        not known. error says why the status could not be read, or is None.
+    """
+    __slots__ = ()
+
+
+def describe(status):
+    """ Returns a short description of a RepoStatus, for the repository list.
+    """
+    if status.error is not None:
+        return status.error
+    parts = [status.branch or "detached", "no commits"]
+    if status.head is not None:
+        parts[1] = status.head[:7]
+    if status.ahead:
+        parts.append("%d ahead" % status.ahead)
+    if status.behind:
+        parts.append("%d behind" % status.behind)
+    if status.dirty:
+        parts.append("dirty")
+    return " ".join(parts[:2]) + "".join(", " + part for part in parts[2:])
+
+
+def _read_text(filename):
+    """ Returns the stripped contents of a small text file, or None if it is missing.
+    """
+    try:
+        with open(filename, encoding="utf-8", errors="replace") as stream:
+            return stream.read().strip()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+def find_git_dir(path):
+    """ Returns the .git directory of the repository at path, following a .git
+        file as in worktrees and submodules, or None if path is not a repository.
+    """
+    git_path = os.path.join(path, ".git")
+    if os.path.isdir(git_path):
+        return git_path
+    text = _read_text(git_path)
+    if text is not None and text.startswith("gitdir:"):
+        return os.path.normpath(os.path.join(path, text[len("gitdir:"):].strip()))
+    if os.path.isfile(os.path.join(path, "HEAD")) and os.path.isdir(os.path.join(path, "objects")):
+        return path     # A bare repository.
+    return None
+
+
+def common_dir(git_dir):
+    """ Returns the directory with the refs and config shared by all worktrees.
+    """
+    text = _read_text(os.path.join(git_dir, "commondir"))
+    if text is None:
+        return git_dir
+    return os.path.normpath(os.path.join(git_dir, text))
+
+
+def parse_config(text):
+    """ Returns the settings of a git config file as a dict from "section.key", or
+        "section.subsection.key", to the last value given. Good enough for the
+        branch and remote sections, which is all that is read here.
+    """
+    settings = {}
+    section = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        match = re.match(r'\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]', line)
+        if match:
+            section = match.group(1).lower()
+            if match.group(2) is not None:
+                section += "." + re.sub(r"\\(.)", r"\1", match.group(2))
+            continue
+        key, _, value = line.partition("=")
+        settings[section + "." + key.strip().lower()] = value.strip().strip('"')
+    return settings
+
+
+def parse_packed_refs(text):
+    """ Returns a dict from ref name to sha for the contents of a packed-refs file.
+    """
+    refs = {}
+    for line in text.splitlines():
+        if line and line[0] not in "#^":
+            sha, _, name = line.partition(" ")
+            refs[name] = sha
+    return refs
+
+
+class StatusCache(object):
+    """ Statuses of repositories, read from their .git directories and cached.
+    """
+    def __init__(self, git_location="git"):
+        self.git_location = git_location
+        self._fast = {}         # Path to (mtimes key, RepoStatus without slow fields).
+        self._slow = {}         # Path to (key, time, (ahead, behind, dirty)).
+        self._packed = {}       # Common dir to (mtime, refs).
+        self._configs = {}      # Common dir to (mtime, settings).
+        self._lock = threading.Lock()
+
+    def _packed_refs(self, git_common_dir):
+        filename = os.path.join(git_common_dir, "packed-refs")
+        mtime = _mtime(filename)
+        cached = self._packed.get(git_common_dir)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, parse_packed_refs(_read_text(filename) or ""))
+            self._packed[git_common_dir] = cached
+        return cached[1]
+
+    def _config(self, git_common_dir):
+        filename = os.path.join(git_common_dir, "config")
+        mtime = _mtime(filename)
+        cached = self._configs.get(git_common_dir)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, parse_config(_read_text(filename) or ""))
+            self._configs[git_common_dir] = cached
+        return cached[1]
+
+    def _resolve(self, git_dir, git_common_dir, name):
+        """ Returns the sha a ref points at, following symbolic refs, or None.
+        """
+        for _ in range(5):
+            if name == "HEAD":
+                text = _read_text(os.path.join(git_dir, name))
+            else:
+                text = _read_text(os.path.join(git_common_dir, name))
+            if text is None:
+                return self._packed_refs(git_common_dir).get(name)
+            if not text.startswith("ref:"):
+                return text
+            name = text[len("ref:"):].strip()
+        return None
+
+    def _read_fast(self, path):
+        """ Returns the (key, status) of a repository read from its .git directory,
+            where key holds the mtimes of the files the status came from, or None
+            if the refs of the repository are not plain files.
+        """
+        git_dir = find_git_dir(path)
+        if git_dir is None:
+            return (None, RepoStatus(path, None, None, None, None, None, None,
+                                     "not a git repository"))
+        git_common_dir = common_dir(git_dir)
+        if not os.path.isdir(os.path.join(git_common_dir, "refs", "heads")):
+            return None
+        head_text = _read_text(os.path.join(git_dir, "HEAD"))
+        if head_text is None:
+            return None
+        files = [os.path.join(git_dir, "HEAD"), os.path.join(git_common_dir, "packed-refs"),
+                 os.path.join(git_common_dir, "config"), os.path.join(git_dir, "index")]
+        branch = upstream = upstream_ref = None
+        if head_text.startswith("ref:"):
+            ref = head_text[len("ref:"):].strip()
+            files.append(os.path.join(git_common_dir, ref))
+            if ref.startswith("refs/heads/"):
+                branch = ref[len("refs/heads/"):]
+                config = self._config(git_common_dir)
+                remote = config.get("branch.%s.remote" % branch)
+                merge = config.get("branch.%s.merge" % branch, "")
+                if remote and merge.startswith("refs/heads/"):
+                    if remote == ".":
+                        upstream_ref = merge
+                        upstream = merge[len("refs/heads/"):]
+                    else:
+                        upstream = remote + "/" + merge[len("refs/heads/"):]
+                        upstream_ref = "refs/remotes/" + upstream
+                    files.append(os.path.join(git_common_dir, upstream_ref))
+        key = tuple(_mtime(filename) for filename in files)
+        with self._lock:
+            cached = self._fast.get(path)
+        if cached is not None and cached[0] == key:
+            return cached
+        head = self._resolve(git_dir, git_common_dir, "HEAD")
+        # The sha of the upstream is kept in the head of the status, so that a
+        # change to the upstream makes the slow fields out of date as well.
+        upstream_sha = None
+        if upstream_ref is not None:
+            upstream_sha = self._resolve(git_dir, git_common_dir, upstream_ref)
+        status = RepoStatus(path, branch, head, upstream, None, None, None, None)
+        result = (key + (head, upstream_sha), status)
+        with self._lock:
+            self._fast[path] = result
+        return result
+
+    def _read_slow(self, path):
+        """ Returns the RepoStatus of a repository as told by git status.
+        """
+        exitcode, out = gitupdater.read_git(path, gitupdater.git_command(
+            self.git_location, ["--no-optional-locks", "status", "--porcelain=v2", "--branch",
+                                "--untracked-files=no"]))
+        if exitcode != 0:
+            return RepoStatus(path, None, None, None, None, None, None, "git status failed")
+        branch = head = upstream = None
+        ahead = behind = None
+        dirty = False
+        for line in out.splitlines():
+            if line.startswith("# branch.oid "):
+                head = line.split()[2]
+                if head == "(initial)":
+                    head = None
+            elif line.startswith("# branch.head "):
+                branch = line.split(" ", 2)[2]
+                if branch == "(detached)":
+                    branch = None
+            elif line.startswith("# branch.upstream "):
+                upstream = line.split(" ", 2)[2]
+            elif line.startswith("# branch.ab "):
+                fields = line.split()
+                ahead, behind = int(fields[2][1:]), int(fields[3][1:])
+            elif not line.startswith("#"):
+                dirty = True
+        if upstream is not None and ahead is None:
+            ahead = behind = 0
+        return RepoStatus(path, branch, head, upstream, ahead, behind, dirty, None)
+
+    def status(self, path, slow=True, max_age=None):
+        """ Returns the RepoStatus of the repository at path. If slow is False, git
+            is never run, and ahead, behind and dirty are None unless they are
+            in the cache. Otherwise git is run if the .git directory changed since
+            it was last run, or if that was more than max_age seconds ago.
+        """
+        path = os.path.abspath(path)
+        fast = self._read_fast(path)
+        if fast is None:
+            # The refs cannot be read directly, so git is asked for all of it.
+            if not slow:
+                return RepoStatus(path, None, None, None, None, None, None, None)
+            return self._read_slow(path)
+        key, status = fast
+        if key is None:
+            return status
+        with self._lock:
+            cached = self._slow.get(path)
+        if cached is not None and cached[0] == key and \
+                (not slow or max_age is None or time.time() - cached[1] < max_age):
+            return status._replace(ahead=cached[2][0], behind=cached[2][1], dirty=cached[2][2])
+        if not slow:
+            return status
+        slow_status = self._read_slow(path)
+        if slow_status.error is not None:
+            # Such as in a bare repository, which has no work tree.
+            return status
+        slow_fields = (slow_status.ahead, slow_status.behind, slow_status.dirty)
+        with self._lock:
+            self._slow[path] = (key, time.time(), slow_fields)
+        return status._replace(ahead=slow_fields[0], behind=slow_fields[1], dirty=slow_fields[2])
+
+    def statuses(self, paths, slow=True, workers=DEFAULT_WORKERS, max_age=None):
+        """ Returns the RepoStatuses of the repositories, in the same order. The
+            ones that need git are done up to workers at a time.
+        """
+        paths = [path for path in paths if path]
+        if not slow or workers <= 1:
+            return [self.status(path, slow, max_age) for path in paths]
+        # Imported here, so that scripts that do not need it start faster.
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda path: self.status(path, True, max_age), paths))
+
+    def invalidate(self, path=None):
+        """ Forgets what is known about the repository at path, or about all of them.
+        """
+        with self._lock:
+            if path is None:
+                self._fast.clear()
+                self._slow.clear()
+            else:
+                self._fast.pop(os.path.abspath(path), None)
+                self._slow.pop(os.path.abspath(path), None)
@@ -0,0 +1,516 @@
+'''
+Update engine for the Git Pull Tool.
+
+Pulls a list of local repositories concurrently, in a bounded pool of worker
+threads. Each pull runs git as a child process in the directory of its
+repository, so the working directory of the app itself never changes, and
+each one has a timeout after which git is killed.
+
+Listeners are told about every repository as its status goes from queued to
+running, and then to ok or failed. They are called on the worker threads, so a
+GUI must hand the call over to its own thread before touching any widgets.
+
+The output of git is read as it comes, by a thread per pipe, into a RepoLog for
+each repository. A RepoLog keeps only the last LOG_LINES lines, each cut to
+MAX_LINE_LENGTH characters, so memory stays bounded however much git writes.
+Progress lines that git ends with a carriage return replace each other, so a
+GUI that shows the log sees the progress counting up.
+
+Before pulling a repository, the updater checks whether there is anything to
+pull: it asks the remote for the commit its branch points at, with git
+ls-remote, and pulls only if that commit is not already in the repository.
+The answers of ls-remote are kept per remote URL for REMOTE_CACHE_SECONDS, in
+a RemoteHeadCache, so repositories that share a remote cost one query between
+them. Anything that goes wrong in the check just means the repository is
+pulled, so the pull can report the problem.
+
+Each finished UpdateResult carries a PullTiming, with where the time of the
+pull went: waiting in the queue, checking the remote, starting git, fetching
+and merging, and how much the object store grew. git pull writes nothing to
+stdout until the fetch is done and the merge starts, so the first output on
+stdout is where the fetch is taken to end. A metrics collector, such as the
+UpdateMetrics of gitmetrics, can be given to the updater to be told about
+every update.
+
+This module does not use Kivy, so it can be used from scripts as well.
+
+@author: vivian
+'''
+import collections
+from functools import partial
+import os
+import re
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+# Number of repositories pulled at the same time.
+DEFAULT_WORKERS = 8
+# Seconds after which a pull is killed.
+DEFAULT_TIMEOUT = 300
+# Command run in each repository, followed by the remote and the branch.
+# --progress makes git report progress even though its stderr is a pipe.
+PULL_ARGS = ("pull", "--progress")
+DEFAULT_REMOTE = "origin"
+DEFAULT_BRANCH = "master"
+# Seconds for which the heads of a remote are taken as they were last queried.
+REMOTE_CACHE_SECONDS = 60
+# Seconds after which a query of a remote, or of a local repository, is killed.
+CHECK_TIMEOUT = 30
+# Seconds between checks for cancellation while git runs.
+POLL_INTERVAL = 0.5
+# Number of lines of output kept for each repository.
+LOG_LINES = 200
+# Longest line of output kept, in characters. Longer lines are cut.
+MAX_LINE_LENGTH = 1024
+# Size of the reads from git's pipes.
+READ_SIZE = 64 * 1024
+
+# Status of a repository in an update.
+QUEUED = "queued"
+RUNNING = "running"
+OK = "ok"
+FAILED = "failed"
+UP_TO_DATE = "up to date"   # Not pulled, as there was nothing new.
+
+# Git must never wait for a password on a terminal that nobody is looking at.
+GIT_ENV = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+
+
+class UpdateResult(collections.namedtuple("UpdateResult",
+                                          "path status exitcode out err seconds timing")):
+    """ Status of a repository in an update. exitcode, out and err are None until
+        git has finished, and seconds is the time git took. timing is the
+        PullTiming of a finished repository, or None.
+    """
+    __slots__ = ()
+
+
+class PullTiming(collections.namedtuple("PullTiming",
+                                        "queue_wait check spawn network merge bytes_received")):
+    """ Where the time of the update of a repository went, in seconds: waiting for
+        a worker, checking the remote for anything new, starting git, fetching,
+        and merging. Phases that did not happen are 0. bytes_received is how
+        much the object store of the repository grew, or None if not known.
+    """
+    __slots__ = ()
+
+
+def git_command(git_location, args):
+    """ Returns the command line to run git with args. git_location is the path
+        of the git executable, or a command line that runs git.
+    """
+    if os.path.exists(git_location):
+        return [git_location] + list(args)
+    return shlex.split(git_location) + list(args)
+
+
+class RepoLog(object):
+    """ The last lines git wrote to stdout and stderr for a repository, in a ring
+        buffer. Lines are fed in as bytes, from any thread.
+    """
+    _line_end = re.compile(br"\r\n|\r|\n")
+
+    def __init__(self, max_lines=LOG_LINES, max_line_length=MAX_LINE_LENGTH):
+        self.max_line_length = max_line_length
+        self.lines = collections.deque(maxlen=max_lines)  # (stream name, text)
+        self.line_count = 0     # Lines written so far, including dropped ones.
+        self.version = 0        # Goes up whenever the lines change.
+        self._partial = {}      # Stream name to the start of an unfinished line.
+        self._progress = None   # Stream name whose last line is a progress line.
+        self._after_cr = set()  # Stream names whose last data ended with "\r".
+        self.first_output = {}  # Stream name to the time of its first output.
+        self._lock = threading.Lock()
+
+    def _add_line(self, name, data, progress):
+        """ Adds a complete line. Must be called with the lock held.
+        """
+        text = data[:self.max_line_length].decode("utf-8", "replace")
+        if self._progress == name and self.lines and self.lines[-1][0] == name:
+            # The last line was a progress line, which this one replaces.
+            self.lines[-1] = (name, text)
+        else:
+            self.lines.append((name, text))
+            self.line_count += 1
+        if progress:
+            self._progress = name
+        else:
+            self._progress = None
+        self.version += 1
+
+    def feed(self, name, data):
+        """ Adds the bytes git wrote to the stream called name, "out" or "err".
+        """
+        with self._lock:
+            self.first_output.setdefault(name, time.time())
+            partial = self._partial.pop(name, b"")
+            start = 0
+            if name in self._after_cr:
+                self._after_cr.discard(name)
+                if data.startswith(b"\n"):
+                    # The "\r" that ended the last data was the first half of "\r\n",
+                    # so the line it ended is not a progress line after all.
+                    start = 1
+                    if self._progress == name:
+                        self._progress = None
+            if data.endswith(b"\r"):
+                self._after_cr.add(name)
+            for match in self._line_end.finditer(data, start):
+                self._add_line(name, partial + data[start:match.start()],
+                               match.group() == b"\r")
+                partial = b""
+                start = match.end()
+            # An unfinished line is kept, up to the longest line that is kept.
+            partial += data[start:start + self.max_line_length - len(partial)]
+            if partial:
+                self._partial[name] = partial
+
+    def close(self):
+        """ Adds the unfinished lines, once git has exited.
+        """
+        with self._lock:
+            for name, partial in sorted(self._partial.items()):
+                self._add_line(name, partial, False)
+            self._partial.clear()
+            self._after_cr.clear()
+            # Whatever comes next is not more progress.
+            self._progress = None
+
+    def text(self, name=None):
+        """ Returns the lines kept, of the stream called name or of both streams.
+        """
+        with self._lock:
+            return "\n".join(text for line_name, text in self.lines
+                             if name is None or line_name == name)
+
+
+def _read_pipe(pipe, name, log, on_output):
+    """ Runs on a reader thread, and feeds what git writes to the pipe to the log.
+    """
+    with pipe:
+        while True:
+            data = pipe.read1(READ_SIZE)
+            if not data:
+                return
+            log.feed(name, data)
+            if on_output is not None:
+                on_output()
+
+
+def _kill(proc):
+    """ Kills git and any processes it started, such as ssh.
+    """
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        pass
+
+
+def run_git(path, command, timeout=DEFAULT_TIMEOUT, cancel_event=None, log=None,
+            on_output=None, timing=None):
+    """ Runs the command in the directory path, and returns its exit code, stdout
+        and stderr. The exit code is None if the command was killed because it
+        took longer than timeout seconds, or because cancel_event was set.
+
+        The output is read into log, a RepoLog, as it comes, and on_output, if
+        given, is called on a reader thread after each read. stdout and stderr
+        are what is left of them in the log at the end. If timing, a dict, is
+        given, the seconds it took to start the command are stored in it under
+        "spawn", and the time it exited under "exit".
+    """
+    if log is None:
+        log = RepoLog()
+    spawn_time = time.time()
+    proc = subprocess.Popen(command, cwd=path, env=GIT_ENV, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            start_new_session=(os.name == "posix"))
+    if timing is not None:
+        timing["spawn"] = time.time() - spawn_time
+    readers = [threading.Thread(target=_read_pipe, args=(pipe, name, log, on_output))
+               for pipe, name in ((proc.stdout, "out"), (proc.stderr, "err"))]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+    deadline = time.time() + timeout
+    reason = None
+    while True:
+        try:
+            proc.wait(timeout=max(0, min(POLL_INTERVAL, deadline - time.time())))
+            break
+        except subprocess.TimeoutExpired:
+            if cancel_event is not None and cancel_event.is_set():
+                reason = "cancelled"
+            elif time.time() >= deadline:
+                reason = "timed out after %g s" % timeout
+            else:
+                continue
+            _kill(proc)
+            proc.wait()
+            break
+    if timing is not None:
+        timing["exit"] = time.time()
+    for reader in readers:
+        reader.join()
+    log.close()
+    if reason is not None:
+        log.feed("err", reason.encode("utf-8") + b"\n")
+        return None, log.text("out"), log.text("err")
+    return proc.returncode, log.text("out"), log.text("err")
+
+
+def read_git(path, command, timeout=CHECK_TIMEOUT):
+    """ Runs a git command that writes little output in the directory path, and
+        returns its exit code and stdout. The exit code is None if the command
+        was killed because it took longer than timeout seconds.
+    """
+    proc = subprocess.Popen(command, cwd=path, env=GIT_ENV, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            start_new_session=(os.name == "posix"))
+    try:
+        out = proc.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired:
+        _kill(proc)
+        proc.communicate()
+        return None, ""
+    return proc.returncode, out.decode("utf-8", "replace")
+
+
+def object_store_size(path, git_location="git"):
+    """ Returns the size in bytes of the objects of the repository at path, loose
+        and packed, as told by git count-objects, or None if it cannot be told.
+    """
+    try:
+        exitcode, out = read_git(path, git_command(git_location, ["count-objects", "-v"]))
+    except OSError:
+        return None
+    if exitcode != 0:
+        return None
+    sizes = {}
+    for line in out.splitlines():
+        key, _, value = line.partition(":")
+        if value.strip().isdigit():
+            sizes[key] = int(value)
+    if "size" not in sizes or "size-pack" not in sizes:
+        return None
+    return (sizes["size"] + sizes["size-pack"]) * 1024
+
+
+def resolve_url(path, url):
+    """ Returns the URL of a remote, with a relative local path made absolute,
+        as seen from the repository at path.
+    """
+    if "://" in url or os.path.isabs(url):
+        return url
+    # host:path, but not a Windows drive letter.
+    colon = url.find(":")
+    if colon > 1 and "/" not in url[:colon]:
+        return url
+    return os.path.normpath(os.path.join(path, url))
+
+
+class RemoteHeadCache(object):
+    """ The heads of remotes, by URL, as reported by git ls-remote. Threads that
+        ask for the same remote at the same time share a single query.
+    """
+    def __init__(self, max_age=REMOTE_CACHE_SECONDS):
+        self.max_age = max_age
+        self._heads = {}        # URL to (time of the query, {ref: sha}).
+        self._url_locks = {}
+        self._lock = threading.Lock()
+
+    def heads(self, url, git_location="git", timeout=CHECK_TIMEOUT):
+        """ Returns a dict of the heads of the remote at url, from ref name to commit
+            sha, or None if the remote could not be queried.
+        """
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            with self._lock:
+                cached = self._heads.get(url)
+            if cached is not None and time.time() - cached[0] < self.max_age:
+                return cached[1]
+            exitcode, out = read_git(None, git_command(git_location, ["ls-remote", "--heads", url]),
+                                     timeout)
+            if exitcode != 0:
+                return None
+            heads = {}
+            for line in out.splitlines():
+                fields = line.split()
+                if len(fields) == 2:
+                    heads[fields[1]] = fields[0]
+            with self._lock:
+                self._heads[url] = (time.time(), heads)
+            return heads
+
+    def invalidate(self, url=None):
+        """ Forgets the heads of the remote at url, or of all remotes if url is None.
+        """
+        with self._lock:
+            if url is None:
+                self._heads.clear()
+            else:
+                self._heads.pop(url, None)
+
+
+# The cache shared by all the updaters of an app.
+remote_heads = RemoteHeadCache()
+
+
+class RepoUpdater(object):
+    """ Pulls repositories, up to workers at the same time.
+
+        listener, if given, is called as listener(result) with an UpdateResult
+        each time the status of a repository changes. output_listener, if given,
+        is called as output_listener(path) each time git writes something.
+        logs holds the RepoLog of each repository of the last update.
+        If precheck is True, repositories that have nothing new on their remote
+        are not pulled, and get the status UP_TO_DATE instead.
+        metrics, if given, is told about each update with run_started(paths),
+        about each repository as it finishes with repo_finished(result), and
+        about the end of the update with run_finished(results), as done by
+        gitmetrics.UpdateMetrics.
+    """
+    def __init__(self, git_location="git", workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT,
+                 listener=None, output_listener=None, remote=DEFAULT_REMOTE,
+                 branch=DEFAULT_BRANCH, precheck=True, head_cache=None, metrics=None):
+        self.git_location = git_location
+        self.workers = workers
+        self.timeout = timeout
+        self.listener = listener
+        self.output_listener = output_listener
+        self.remote = remote
+        self.branch = branch
+        self.precheck = precheck
+        if head_cache is None:
+            head_cache = remote_heads
+        self.head_cache = head_cache
+        self.metrics = metrics
+        self.cancel_event = threading.Event()
+        self.logs = {}
+        self._queued = {}       # Path to the time it was queued in the update.
+        self._thread = None
+
+    def _notify(self, result):
+        # The metrics come first, so that the listener can read them.
+        if self.metrics is not None and result.timing is not None:
+            self.metrics.repo_finished(result)
+        if self.listener is not None:
+            self.listener(result)
+        return result
+
+    def is_up_to_date(self, path):
+        """ Returns True if the commit the branch points at on the remote is already
+            in the repository, so that pulling would not bring anything new.
+        """
+        exitcode, url = read_git(path, git_command(
+            self.git_location, ["config", "--get", "remote.%s.url" % self.remote]))
+        if exitcode != 0 or not url.strip():
+            return False
+        heads = self.head_cache.heads(resolve_url(path, url.strip()), self.git_location)
+        if heads is None or "refs/heads/" + self.branch not in heads:
+            return False
+        exitcode, out = read_git(path, git_command(
+            self.git_location, ["merge-base", "--is-ancestor",
+                                heads["refs/heads/" + self.branch], "HEAD"]))
+        return exitcode == 0
+
+    def update_repository(self, path):
+        """ Pulls a single repository, and returns its UpdateResult.
+        """
+        start_time = time.time()
+        queue_wait = start_time - self._queued.pop(path, start_time)
+        if self.cancel_event.is_set():
+            return self._notify(UpdateResult(path, FAILED, None, "", "cancelled", 0,
+                                             PullTiming(queue_wait, 0, 0, 0, 0, None)))
+        self._notify(UpdateResult(path, RUNNING, None, None, None, 0, None))
+        log = self.logs.setdefault(path, RepoLog())
+        try:
+            up_to_date = self.precheck and self.is_up_to_date(path)
+        except OSError:
+            up_to_date = False
+        check = time.time() - start_time
+        if up_to_date:
+            message = "Nothing new on %s/%s" % (self.remote, self.branch)
+            log.feed("out", message.encode("utf-8") + b"\n")
+            return self._notify(UpdateResult(path, UP_TO_DATE, 0, message, "", check,
+                                             PullTiming(queue_wait, check, 0, 0, 0, 0)))
+        on_output = None
+        if self.output_listener is not None:
+            on_output = partial(self.output_listener, path)
+        size_before = object_store_size(path, self.git_location)
+        command = git_command(self.git_location, PULL_ARGS + (self.remote, self.branch))
+        timing = {}
+        pull_time = time.time()
+        try:
+            exitcode, out, err = run_git(path, command, self.timeout, self.cancel_event, log,
+                                         on_output, timing)
+        except OSError as e:
+            exitcode, out, err = None, "", str(e)
+            log.feed("err", err.encode("utf-8") + b"\n")
+        if exitcode == 0:
+            status = OK
+        else:
+            status = FAILED
+        spawn = timing.get("spawn", 0)
+        exit_time = timing.get("exit", time.time())
+        # The merge starts when git first writes to stdout, or not at all.
+        merge_time = log.first_output.get("out", exit_time)
+        if not pull_time <= merge_time <= exit_time:
+            merge_time = exit_time
+        network = max(0, merge_time - pull_time - spawn)
+        bytes_received = None
+        if size_before is not None and exitcode is not None:
+            size_after = object_store_size(path, self.git_location)
+            if size_after is not None and size_after >= size_before:
+                bytes_received = size_after - size_before
+        return self._notify(UpdateResult(
+            path, status, exitcode, out, err, time.time() - start_time,
+            PullTiming(queue_wait, check, spawn, network, exit_time - merge_time,
+                       bytes_received)))
+
+    def update(self, paths):
+        """ Pulls the repositories, and returns their UpdateResults in the same order.
+        """
+        paths = [path for path in paths if path]
+        if not paths:
+            return []
+        self.logs = dict((path, RepoLog()) for path in paths)
+        if self.metrics is not None:
+            self.metrics.run_started(paths)
+        queued_time = time.time()
+        for path in paths:
+            self._queued[path] = queued_time
+            self._notify(UpdateResult(path, QUEUED, None, None, None, 0, None))
+        # Imported here, so that scripts that do not update anything start faster.
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            results = list(executor.map(self.update_repository, paths))
+        if self.metrics is not None:
+            self.metrics.run_finished(results)
+        return results
+
+    def start(self, paths, finished=None):
+        """ Pulls the repositories on a background thread. finished, if given, is
+            called on that thread with the list of UpdateResults at the end.
+        """
+        self.cancel_event.clear()
+        def run():
+            results = self.update(paths)
+            if finished is not None:
+                finished(results)
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def cancel(self):
+        """ Kills the running pulls, and fails the ones that have not started yet.
+        """
+        self.cancel_event.set()
@@ -0,0 +1,134 @@
+'''
+Pair filter for the split engine.
+
+Parallel corpora hold many duplicate sentence pairs, and pairs where one side
+is empty or where the two sides are of very different lengths, which usually
+means the lines are misaligned. The pair filter drops such pairs while the
+source file is being split, so that no second pass over the data is needed.
+
+A pair is one line for each position in the routing pattern, i.e. two lines
+for an odd/even split. Whole pairs are dropped, so the target files stay line
+aligned.
+
+Duplicates are found with a Bloom filter, which takes a fixed amount of memory
+however many pairs there are. The price is that a small fraction of pairs that
+are not duplicates may be dropped as well; with the default size this is less
+than 1% of pairs for corpora of up to about 50 million pairs.
+
+@author: vivian
+'''
+import hashlib
+
+# Memory used by the Bloom filter, in bytes.
+DEFAULT_MEMORY = 64 * 1024 * 1024
+# Number of bits set in the Bloom filter for each pair.
+HASH_COUNT = 7
+
+
+class BloomFilter(object):
+    """ A set of byte strings in a fixed amount of memory, which may wrongly say
+        that a string is in the set, but never wrongly says that it is not.
+    """
+    def __init__(self, size_bytes=DEFAULT_MEMORY, hash_count=HASH_COUNT):
+        self.bits = bytearray(size_bytes)
+        self.bit_count = size_bytes * 8
+        self.hash_count = hash_count
+
+    def add(self, key):
+        """ Adds key to the set. Returns True if key was already in the set.
+        """
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        # Double hashing gives all the bit positions from two hash values.
+        hash1 = int.from_bytes(digest[:8], "little")
+        hash2 = int.from_bytes(digest[8:], "little") | 1
+        bits = self.bits
+        seen = True
+        for i in range(self.hash_count):
+            position = (hash1 + i * hash2) % self.bit_count
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                seen = False
+                bits[position >> 3] |= mask
+        return seen
+
+
+class PairFilter(object):
+    """ Drops duplicate pairs, pairs with an empty side, and pairs whose longest
+        side is more than max_ratio times as long as their shortest side.
+        period is the number of lines in a pair. Lines may be str or bytes, and
+        lengths are counted in characters either way.
+    """
+    def __init__(self, period=2, dedup=True, drop_empty=True, max_ratio=None,
+                 memory=DEFAULT_MEMORY):
+        self.period = period
+        self.drop_empty = drop_empty
+        self.max_ratio = max_ratio
+        if dedup:
+            self.seen = BloomFilter(memory)
+        else:
+            self.seen = None
+        self.pending = [] # Lines of a pair that is not complete yet.
+        self.pairs_read = 0
+        self.dropped_duplicate = 0
+        self.dropped_empty = 0
+        self.dropped_ratio = 0
+
+    def keep(self, pair):
+        """ Returns True if the pair passes the filters, and counts it if it does not.
+        """
+        if self.drop_empty or self.max_ratio is not None:
+            stripped = [line.strip() for line in pair]
+            if self.drop_empty and not all(stripped):
+                self.dropped_empty += 1
+                return False
+            if self.max_ratio is not None:
+                if isinstance(stripped[0], bytes):
+                    lengths = [len(line.decode("utf-8", "replace")) for line in stripped]
+                else:
+                    lengths = [len(line) for line in stripped]
+                if max(lengths) > self.max_ratio * max(min(lengths), 1):
+                    self.dropped_ratio += 1
+                    return False
+        if self.seen is not None:
+            key = pair[0][:0].join(pair)
+            if not isinstance(key, bytes):
+                key = key.encode("utf-8", "surrogatepass")
+            if self.seen.add(key):
+                self.dropped_duplicate += 1
+                return False
+        return True
+
+    def process(self, lines):
+        """ Returns the lines of the complete pairs that pass the filters. The lines
+            of a pair that is not complete yet are kept back for the next call.
+        """
+        if self.pending:
+            lines = self.pending + lines
+        period = self.period
+        complete = len(lines) - len(lines) % period
+        self.pending = lines[complete:]
+        kept = []
+        for start in range(0, complete, period):
+            pair = lines[start:start + period]
+            self.pairs_read += 1
+            if self.keep(pair):
+                kept.extend(pair)
+        return kept
+
+    def finish(self):
+        """ Returns the lines of an incomplete last pair, which are not filtered.
+        """
+        lines, self.pending = self.pending, []
+        return lines
+
+    def dropped(self):
+        """ Returns the number of pairs that were dropped.
+        """
+        return self.dropped_duplicate + self.dropped_empty + self.dropped_ratio
+
+    def summary(self):
+        """ Returns a one-line summary of the pairs that were dropped.
+        """
+        return "%d of %d pairs dropped: %d duplicate, %d empty, %d length ratio" % (
+            self.dropped(), self.pairs_read, self.dropped_duplicate, self.dropped_empty,
+            self.dropped_ratio)
@@ -0,0 +1,369 @@
+'''
+Git Pull Tool command line tool
+
+Pulls the repositories of the Git Pull Tool without starting the GUI, so that
+they can be updated on servers without a display, from cron, or by a daemon
+that keeps them fresh. It reads the same gitpull.ini as the app, and the same
+registry of repositories next to it, and records the outcome of every pull in
+the registry just as the app does. Kivy is never loaded, and the modules that
+only some commands need are imported by those commands, so the tool starts in
+a few tens of milliseconds.
+
+Commands:
+    update      Pulls the repositories given, or all those in the registry.
+    status      Shows the branch, HEAD, ahead/behind counts and dirty state of
+                the repositories given, or all those in the registry.
+    add         Adds repositories to the registry.
+    remove      Removes repositories from the registry.
+    discover    Adds the repositories found under a directory, by default the
+                default Git directory of the app, to the registry, and lists
+                those in the registry that are no longer repositories.
+    daemon      Keeps pulling the repositories that are due, as the scheduled
+                updates of the app do, until it gets SIGTERM or SIGINT.
+
+With --json, every repository is printed as a JSON object on a line of its
+own, as it finishes, followed by one for the summary of the update, the same
+as the lines of the metrics log of the app. Otherwise a line of text is
+printed per repository.
+
+Exit codes: 0 when all went well, 1 when any repository failed to update or
+its status could not be read, 2 for a bad command line or config file.
+
+Usage:
+    python pullrepos.py update
+    python pullrepos.py --json update ~/github/repo1 ~/github/repo2
+    python pullrepos.py --json status
+    python pullrepos.py add ~/github/repo3
+    python pullrepos.py discover --depth 2 ~/github
+    python pullrepos.py --config /etc/gitpull.ini daemon
+
+@author: vivian
+'''
+import argparse
+import configparser
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import gitstatus
+import gitupdater
+import repodiscovery
+import reporegistry
+
+# Config file of the app, which this tool reads as well.
+CONFIG_NAME = "gitpull.ini"
+# Settings of the app, and their values when the config file does not have them.
+CONFIG_DEFAULTS = {
+    "git_location": "git",
+    "default_git_repo": "",
+    "repo_list": "",
+    "workers": str(gitupdater.DEFAULT_WORKERS),
+    "timeout": str(gitupdater.DEFAULT_TIMEOUT),
+    "precheck": "1",
+    "schedule": "0",
+    # The defaults of gitscheduler, which is only imported by the commands that use it.
+    "schedule_interval": "60",
+    "schedule_rate": "30",
+    "metrics_jsonl": "",
+    "metrics_prometheus": "",
+}
+# Most seconds the daemon sleeps before it looks for repositories that are due.
+DAEMON_INTERVAL = 5
+
+
+def read_config(filename):
+    """ Returns the config of the app read from filename, with the defaults for
+        the settings it does not have. Raises ValueError if it cannot be read.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_dict({"Setup": CONFIG_DEFAULTS})
+    try:
+        with open(filename, encoding="utf-8") as stream:
+            config.read_file(stream)
+    except FileNotFoundError:
+        pass
+    except (OSError, configparser.Error) as e:
+        raise ValueError("cannot read %s: %s" % (filename, e))
+    return config
+
+
+def make_updater(config, **kwargs):
+    """ Returns a gitupdater.RepoUpdater with the settings of config. kwargs are
+        passed on to it.
+    """
+    return gitupdater.RepoUpdater(git_location=config.get("Setup", "git_location"),
+                                  workers=int(float(config.get("Setup", "workers"))),
+                                  timeout=float(config.get("Setup", "timeout")),
+                                  precheck=config.getboolean("Setup", "precheck"),
+                                  **kwargs)
+
+
+def make_scheduler(config):
+    """ Returns a gitscheduler.UpdateScheduler with the settings of config.
+    """
+    import gitscheduler
+    return gitscheduler.UpdateScheduler(
+        interval=float(config.get("Setup", "schedule_interval")) * 60,
+        rate=max(1, int(float(config.get("Setup", "schedule_rate")))))
+
+
+def metrics_hooks(config):
+    """ Returns the gitmetrics exporters whose files are set in config.
+    """
+    import gitmetrics
+    hooks = []
+    filename = config.get("Setup", "metrics_jsonl").strip()
+    if filename:
+        hooks.append(gitmetrics.JsonLinesExporter(os.path.expanduser(filename)))
+    filename = config.get("Setup", "metrics_prometheus").strip()
+    if filename:
+        hooks.append(gitmetrics.PrometheusExporter(os.path.expanduser(filename)))
+    return hooks
+
+
+def open_registry(config_filename, config):
+    """ Opens the registry of the app, next to its config file, and adds the
+        repositories still listed in the config to it, if the registry has not
+        taken them over yet. The config file is left as it is.
+    """
+    registry = reporegistry.RepoRegistry(os.path.join(
+        os.path.dirname(os.path.abspath(config_filename)), reporegistry.REGISTRY_NAME))
+    repo_list = config.get("Setup", "repo_list")
+    if repo_list:
+        registry.migrate_repo_list(repo_list)
+    return registry
+
+
+def record_result(registry, status_cache, result):
+    """ Stores the outcome of a finished pull in the registry. Returns True if
+        HEAD has moved since the last pull of the repository.
+    """
+    head = status_cache.status(result.path, slow=False).head
+    record = registry.get(result.path)
+    changed = record is not None and record.last_head != head
+    registry.record_pull(result.path, result.seconds, result.exitcode, result.status, head)
+    return changed
+
+
+def _print_json(record):
+    import json
+    print(json.dumps(record, sort_keys=True), flush=True)
+
+
+def make_printer(as_json):
+    """ Returns a gitmetrics hook that prints each repository as it finishes, and
+        the summary of each update.
+    """
+    import gitmetrics
+
+    class JsonPrinter(gitmetrics.JsonLinesExporter):
+        def write(self, record):
+            _print_json(record)
+
+    class TextPrinter(gitmetrics.MetricsHook):
+        def repo_finished(self, metrics):
+            line = "%s: %s in %.2f s" % (metrics.path, metrics.status, metrics.seconds)
+            if metrics.error is not None:
+                line += " (exit code %s: %s)" % (metrics.exitcode, metrics.error)
+            print(line, flush=True)
+
+        def run_finished(self, summary, metrics):
+            print("%d repositories in %.2f s: %d ok, %d up to date, %d failed" % (
+                summary.repositories, summary.seconds, summary.ok, summary.up_to_date,
+                summary.failed), flush=True)
+
+    if as_json:
+        return JsonPrinter(None)
+    return TextPrinter()
+
+
+class PullRunner(object):
+    """ Pulls repositories with the settings of the app, records the outcome in
+        the registry, and prints it.
+    """
+    def __init__(self, config, registry, as_json=False):
+        import gitmetrics
+        self.registry = registry
+        self.status_cache = gitstatus.StatusCache(config.get("Setup", "git_location"))
+        self.metrics = gitmetrics.UpdateMetrics([make_printer(as_json)] + metrics_hooks(config))
+        self.changed = {}           # Path to whether its last pull moved HEAD.
+        self.updater = make_updater(config, listener=self.status_changed,
+                                    metrics=self.metrics)
+
+    def status_changed(self, result):
+        if result.timing is not None:
+            self.changed[result.path] = record_result(self.registry, self.status_cache, result)
+
+    def update(self, paths):
+        """ Pulls the repositories, and returns their UpdateResults.
+        """
+        self.changed = {}
+        return self.updater.update(paths)
+
+
+def stop_on_signals(runner, stop_event=None):
+    """ Makes SIGTERM and SIGINT kill the running pulls, and set stop_event.
+        Leaving the pulls to finish would keep git running after the tool is
+        told to stop.
+    """
+    def stop(signum, frame):
+        if stop_event is not None:
+            stop_event.set()
+        runner.updater.cancel()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+
+def command_update(args, config, registry):
+    paths = [reporegistry.normalize_path(path) for path in args.paths] or registry.paths()
+    runner = PullRunner(config, registry, args.json)
+    stop_on_signals(runner)
+    results = runner.update(paths)
+    if any(result.status == gitupdater.FAILED for result in results):
+        return 1
+    return 0
+
+
+def command_status(args, config, registry):
+    paths = [reporegistry.normalize_path(path) for path in args.paths] or registry.paths()
+    status_cache = gitstatus.StatusCache(config.get("Setup", "git_location"))
+    failures = 0
+    for status in status_cache.statuses(paths):
+        if status.error is not None:
+            failures += 1
+        if args.json:
+            _print_json(status._asdict())
+        else:
+            print("%s: %s" % (status.path, gitstatus.describe(status)))
+    if failures:
+        return 1
+    return 0
+
+
+def command_add(args, config, registry):
+    for path in registry.add_many(args.paths):
+        print(path)
+    return 0
+
+
+def command_remove(args, config, registry):
+    missing = 0
+    for path in args.paths:
+        if not registry.remove(path):
+            print("pullrepos: not in the registry: %s" % path, file=sys.stderr)
+            missing += 1
+    if missing:
+        return 1
+    return 0
+
+
+def command_discover(args, config, registry):
+    root = args.root or config.get("Setup", "default_git_repo")
+    if not root:
+        print("pullrepos: no directory given, and no default Git directory set",
+              file=sys.stderr)
+        return 2
+    scanner = repodiscovery.RepoScanner(max_depth=args.depth)
+    found = repodiscovery.scan_cached(scanner, registry, root)
+    added, vanished = repodiscovery.sync_registry(registry, found)
+    for path in added:
+        if args.json:
+            _print_json({"type": "added", "path": path})
+        else:
+            print("added: %s" % path)
+    for path in vanished:
+        if args.json:
+            _print_json({"type": "vanished", "path": path})
+        else:
+            print("vanished: %s" % path)
+    return 0
+
+
+def command_daemon(args, config, registry):
+    stop_event = threading.Event()
+    runner = PullRunner(config, registry, args.json)
+    stop_on_signals(runner, stop_event)
+    scheduler = make_scheduler(config)
+    scheduler.load(registry.records())
+    while not stop_event.is_set():
+        # Repositories added or removed by the app or by this tool are picked up.
+        scheduler.sync(registry.paths())
+        paths = scheduler.take_due()
+        if paths:
+            for result in runner.update(paths):
+                scheduler.record(result.path, result.status == gitupdater.FAILED,
+                                 runner.changed.get(result.path, False))
+            continue
+        next_due = scheduler.next_due()
+        wait = DAEMON_INTERVAL
+        if next_due is not None:
+            wait = min(wait, max(0, next_due - time.time()))
+        stop_event.wait(max(wait, 0.1))
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Pull the repositories of the Git Pull Tool without its GUI.")
+    parser.add_argument("-c", "--config",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                             CONFIG_NAME),
+                        help="config file of the app, with the registry of repositories "
+                             "next to it (default: %s next to this tool)" % CONFIG_NAME)
+    parser.add_argument("--json", action="store_true",
+                        help="print a JSON object per line instead of text")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of repositories to pull at the same time")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="seconds after which the pull of a repository is stopped")
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers.required = True
+    for name, function, paths_help in (
+            ("update", command_update, "repositories to pull (default: all in the registry)"),
+            ("status", command_status, "repositories to show (default: all in the registry)"),
+            ("add", command_add, "repositories to add to the registry"),
+            ("remove", command_remove, "repositories to remove from the registry")):
+        subparser = subparsers.add_parser(name, help=paths_help)
+        subparser.add_argument("paths", nargs="+" if name in ("add", "remove") else "*",
+                               metavar="PATH", help=paths_help)
+        subparser.set_defaults(function=function)
+    subparser = subparsers.add_parser("discover", help="add the repositories found under a "
+                                                       "directory to the registry")
+    subparser.add_argument("root", nargs="?", metavar="DIRECTORY",
+                           help="directory to search (default: the default Git directory)")
+    subparser.add_argument("--depth", type=int, default=repodiscovery.MAX_DEPTH,
+                           help="levels of directories below it to search (default %d)"
+                                % repodiscovery.MAX_DEPTH)
+    subparser.set_defaults(function=command_discover)
+    subparser = subparsers.add_parser("daemon", help="keep pulling the repositories that "
+                                                     "are due, until stopped")
+    subparser.set_defaults(function=command_daemon)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        config = read_config(args.config)
+        if args.workers is not None:
+            config.set("Setup", "workers", str(args.workers))
+        if args.timeout is not None:
+            config.set("Setup", "timeout", str(args.timeout))
+        registry = open_registry(args.config, config)
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print("pullrepos: " + str(e), file=sys.stderr)
+        return 2
+    try:
+        return args.function(args, config, registry)
+    except ValueError as e:
+        # Such as a setting that is not a number.
+        print("pullrepos: " + str(e), file=sys.stderr)
+        return 2
+    finally:
+        registry.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+'''
+Discovery of the repositories of the Git Pull Tool.
+
+Finds the git repositories under a root directory, such as the default Git
+directory of the app, so that hundreds of clones can be added at once rather
+than one by one. Directories are listed with os.scandir, by a pool of worker
+threads, down to MAX_DEPTH levels below the root. A directory is taken to be
+a repository if it has a .git directory, or a .git file pointing at its git
+directory, as in submodules and worktrees. Bare repositories are found too,
+but not added, as they cannot be pulled. Repositories are not searched for
+more repositories, symbolic links are not followed, and directories that only
+hold dependencies or build output, such as node_modules, are skipped.
+
+What was found in each directory is kept in a ScanCache, along with the mtime
+of the directory, and the directory is only listed again once its mtime has
+changed, that is once entries have been added to it, removed or renamed. A
+rescan of a tree where nothing moved costs a stat() per directory. scan_cached()
+keeps the ScanCache in the registry between processes, so that this holds for
+pullrepos.py run from cron too.
+
+This module does not use Kivy.
+
+@author: vivian
+'''
+import collections
+import os
+import threading
+import gitstatus
+
+# Levels of directories below the root that are searched.
+MAX_DEPTH = 4
+# Number of directories listed at the same time.
+DEFAULT_WORKERS = 8
+# Directories that are never searched, as they are big and hold no clones.
+SKIP_NAMES = frozenset(["node_modules", "bower_components", "__pycache__", ".venv", "venv",
+                        ".tox", ".nox", ".mypy_cache", ".pytest_cache", ".gradle", ".m2",
+                        ".cache", "site-packages"])
+
+# Kinds of repository.
+REPOSITORY = "repository"   # With a .git directory.
+GITFILE = "gitfile"         # With a .git file, such as a submodule.
+WORKTREE = "worktree"       # A linked worktree, with a .git file.
+BARE = "bare"               # Without a work tree, so it cannot be pulled.
+
+
+class FoundRepo(collections.namedtuple("FoundRepo", "path kind")):
+    """ A repository found by a scan, and its kind.
+    """
+    __slots__ = ()
+
+
+def repo_kind(path, names):
+    """ Returns the kind of repository of the directory at path, whose entries are
+        names, or None if it is not a repository.
+    """
+    if ".git" in names:
+        git_path = os.path.join(path, ".git")
+        if os.path.isdir(git_path):
+            return REPOSITORY
+        git_dir = gitstatus.find_git_dir(path)
+        if git_dir is None:
+            return None
+        if os.path.basename(os.path.dirname(git_dir)) == "worktrees":
+            return WORKTREE
+        return GITFILE
+    if "HEAD" in names and "objects" in names and "refs" in names:
+        return BARE
+    return None
+
+
+class ScanCache(object):
+    """ What was found in each directory, by path, kept while the mtime of the
+        directory stays the same.
+    """
+    def __init__(self):
+        self._entries = {}      # Path to (mtime, kind, subdirectory names).
+        self._lock = threading.Lock()
+
+    def get(self, path, mtime):
+        """ Returns the (kind, subdirectory names) of a directory, or None if it has
+            changed since it was listed.
+        """
+        with self._lock:
+            cached = self._entries.get(path)
+        if cached is None or cached[0] != mtime:
+            return None
+        return cached[1:]
+
+    def put(self, path, mtime, kind, subdirs):
+        with self._lock:
+            self._entries[path] = (mtime, kind, subdirs)
+
+    def entries(self):
+        """ Returns what is cached, as a list of (path, mtime, kind, subdirectory names).
+        """
+        with self._lock:
+            return [(path,) + cached for path, cached in self._entries.items()]
+
+    def load(self, entries):
+        """ Adds entries, as returned by entries(), to the cache.
+        """
+        with self._lock:
+            for path, mtime, kind, subdirs in entries:
+                self._entries[path] = (mtime, kind, subdirs)
+
+    def is_empty(self):
+        with self._lock:
+            return not self._entries
+
+    def retain(self, root, paths):
+        """ Forgets the directories below root, root included, that are not in paths,
+            such as those that were removed.
+        """
+        with self._lock:
+            for cached_path in list(self._entries):
+                if (cached_path == root or cached_path.startswith(root + os.sep)) and \
+                        cached_path not in paths:
+                    del self._entries[cached_path]
+
+    def invalidate(self, path=None):
+        """ Forgets the directory at path and those below it, or all directories.
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                return
+            path = os.path.abspath(path)
+            for cached_path in list(self._entries):
+                if cached_path == path or cached_path.startswith(path + os.sep):
+                    del self._entries[cached_path]
+
+
+# The cache shared by all the scans of an app.
+cache = ScanCache()
+
+
+class RepoScanner(object):
+    """ Finds the repositories under a root directory, see the module documentation.
+    """
+    def __init__(self, max_depth=MAX_DEPTH, workers=DEFAULT_WORKERS, skip_names=SKIP_NAMES,
+                 scan_cache=None):
+        self.max_depth = max_depth
+        self.workers = workers
+        self.skip_names = skip_names
+        if scan_cache is None:
+            scan_cache = cache
+        self.scan_cache = scan_cache
+        self.listed = 0         # Directories listed by the last scan.
+        self.cached = 0         # Directories of the last scan answered by the cache.
+        self.visited = set()    # Directories of the last scan.
+
+    def scan_directory(self, path):
+        """ Returns the (kind, subdirectory names, cached) of a directory, where
+            cached is True if they came from the cache. A directory that cannot be
+            listed has neither a kind nor subdirectories.
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None, [], False
+        cached = self.scan_cache.get(path, mtime)
+        if cached is not None:
+            return cached + (True,)
+        names = []
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    names.append(entry.name)
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                    except OSError:
+                        pass
+        except OSError:
+            return None, [], False
+        kind = repo_kind(path, names)
+        subdirs = [name for name in subdirs
+                   if name not in self.skip_names and name != ".git"]
+        self.scan_cache.put(path, mtime, kind, subdirs)
+        return kind, subdirs, False
+
+    def scan(self, root):
+        """ Returns the FoundRepos under root, root included, sorted by path.
+        """
+        root = os.path.abspath(os.path.expanduser(root))
+        self.listed = self.cached = 0
+        self.visited = set()
+        found = []
+        # Imported here, so that scripts that do not scan start faster.
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            pending = {executor.submit(self.scan_directory, root): (root, 0)}
+            while pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    path, depth = pending.pop(future)
+                    self.visited.add(path)
+                    kind, subdirs, cached = future.result()
+                    if cached:
+                        self.cached += 1
+                    else:
+                        self.listed += 1
+                    if kind is not None:
+                        found.append(FoundRepo(path, kind))
+                        continue
+                    if depth >= self.max_depth:
+                        continue
+                    for name in subdirs:
+                        child = os.path.join(path, name)
+                        pending[executor.submit(self.scan_directory, child)] = (child, depth + 1)
+        found.sort()
+        return found
+
+
+def scan_cached(scanner, registry, root):
+    """ Scans root with a RepoScanner, as scanner.scan() does, with the scan cache
+        kept in a reporegistry.RepoRegistry. The cache of the scanner is filled
+        from the registry if it is empty, and stored back after the scan, without
+        the directories under root that the scan did not reach.
+    """
+    root = os.path.abspath(os.path.expanduser(root))
+    if scanner.scan_cache.is_empty():
+        scanner.scan_cache.load(registry.scan_entries())
+    found = scanner.scan(root)
+    scanner.scan_cache.retain(root, scanner.visited)
+    registry.replace_scan_entries(scanner.scan_cache.entries())
+    return found
+
+
+def sync_registry(registry, repos):
+    """ Adds the FoundRepos that can be pulled to a reporegistry.RepoRegistry, and
+        returns (added, vanished): the paths that were added, and the paths in
+        the registry that are no longer repositories.
+    """
+    added = registry.add_many([repo.path for repo in repos if repo.kind != BARE])
+    vanished = [path for path in registry.paths() if gitstatus.find_git_dir(path) is None]
+    return added, vanished
@@ -0,0 +1,212 @@
+'''
+Registry of the repositories of the Git Pull Tool.
+
+Keeps the list of repositories in an SQLite database rather than in a single
+comma-joined config value, so that adding or removing a repository changes
+one row instead of rewriting the whole list, and thousands of repositories
+cost nothing to load. Paths are stored normalized, and are unique, so the
+same repository cannot be added twice.
+
+Each repository also has a record of its last pull: when it ended, how long
+it took, the exit code and status, and the commit HEAD was at afterwards.
+
+The database also keeps the scan cache of repodiscovery, so that a search
+for repositories from a fresh process, such as pullrepos.py run from cron,
+only lists the directories that changed since the last search.
+
+The database can be used from several threads; its connection is guarded by
+a lock.
+
+This module does not use Kivy.
+
+@author: vivian
+'''
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Name of the database file, next to the config file of the app.
+REGISTRY_NAME = "gitpull_repos.sqlite"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS repos (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    added REAL NOT NULL,
+    last_pull REAL,
+    duration REAL,
+    exitcode INTEGER,
+    status TEXT,
+    last_head TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS scan_cache (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    kind TEXT,
+    subdirs TEXT NOT NULL
+);
+'''
+# Key of the meta row that says the repo_list config value has been moved over.
+MIGRATED_KEY = "repo_list_migrated"
+
+
+class RepoRecord(collections.namedtuple("RepoRecord",
+                                        "path added last_pull duration exitcode status last_head")):
+    """ A repository in the registry. The fields about the last pull are None
+        until the repository has been pulled.
+    """
+    __slots__ = ()
+
+
+def normalize_path(path):
+    """ Returns the form of a path that is stored in the registry.
+    """
+    return os.path.normcase(os.path.abspath(os.path.expanduser(path.strip())))
+
+
+class RepoRegistry(object):
+    """ The repositories of the app, stored in the SQLite database filename.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def add(self, path):
+        """ Adds a repository, and returns its normalized path, or None if it was
+            in the registry already.
+        """
+        path = normalize_path(path)
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO repos (path, added) VALUES (?, ?)", (path, time.time()))
+        if cursor.rowcount:
+            return path
+        return None
+
+    def add_many(self, paths):
+        """ Adds the repositories in a single transaction, skipping empty paths and
+            those in the registry already. Returns the normalized paths that were
+            added, in order.
+        """
+        with self._lock, self._connection:
+            return self._insert(paths)
+
+    def _insert(self, paths):
+        """ Adds the repositories, as add_many does. Must be called with the lock
+            held, in a transaction.
+        """
+        added = []
+        now = time.time()
+        for path in paths:
+            if not path.strip():
+                continue
+            path = normalize_path(path)
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO repos (path, added) VALUES (?, ?)", (path, now))
+            if cursor.rowcount:
+                added.append(path)
+        return added
+
+    def remove(self, path):
+        """ Removes a repository. Returns True if it was in the registry.
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute("DELETE FROM repos WHERE path = ?",
+                                              (normalize_path(path),))
+        return cursor.rowcount > 0
+
+    def paths(self):
+        """ Returns the paths of the repositories, in the order they were added.
+        """
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT path FROM repos ORDER BY id")]
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM repos WHERE path = ?",
+                                            (normalize_path(path),)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM repos").fetchone()[0]
+
+    def get(self, path):
+        """ Returns the RepoRecord of a repository, or None if it is not in the registry.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT path, added, last_pull, duration, exitcode, status, last_head "
+                "FROM repos WHERE path = ?", (normalize_path(path),)).fetchone()
+        if row is None:
+            return None
+        return RepoRecord(*row)
+
+    def records(self):
+        """ Returns the RepoRecords of all repositories, in the order they were added.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, added, last_pull, duration, exitcode, status, last_head "
+                "FROM repos ORDER BY id").fetchall()
+        return [RepoRecord(*row) for row in rows]
+
+    def record_pull(self, path, duration, exitcode, status, last_head, last_pull=None):
+        """ Stores the outcome of the last pull of a repository. last_pull is the
+            time the pull ended, and defaults to now.
+        """
+        if last_pull is None:
+            last_pull = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE repos SET last_pull = ?, duration = ?, exitcode = ?, status = ?, "
+                "last_head = ? WHERE path = ?",
+                (last_pull, duration, exitcode, status, last_head, normalize_path(path)))
+
+    def migrate_repo_list(self, repo_list):
+        """ Adds the repositories of the comma-separated repo_list config value, as
+            used before the registry, unless that has been done for this registry
+            already, so that repositories removed since do not come back. Returns
+            the paths that were added.
+        """
+        with self._lock, self._connection:
+            if self._connection.execute("SELECT 1 FROM meta WHERE key = ?",
+                                        (MIGRATED_KEY,)).fetchone() is not None:
+                return []
+            added = self._insert(repo_list.split(","))
+            self._connection.execute("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                     (MIGRATED_KEY, str(time.time())))
+        return added
+
+    def scan_entries(self):
+        """ Returns the scan cache of repodiscovery, as a list of (path, mtime, kind,
+            subdirectory names).
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, mtime, kind, subdirs FROM scan_cache").fetchall()
+        return [(path, mtime, kind, json.loads(subdirs)) for path, mtime, kind, subdirs in rows]
+
+    def replace_scan_entries(self, entries):
+        """ Replaces the scan cache of repodiscovery with entries, as returned by
+            scan_entries.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM scan_cache")
+            self._connection.executemany(
+                "INSERT INTO scan_cache (path, mtime, kind, subdirs) VALUES (?, ?, ?, ?)",
+                [(path, mtime, kind, json.dumps(subdirs)) for path, mtime, kind, subdirs in entries])
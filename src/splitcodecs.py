@@ -0,0 +1,263 @@
+'''
+Compressed source and target files for the split engine.
+
+Source files compressed with gzip, bzip2 or xz are recognised by their magic
+bytes, and target files are compressed if their names end in .gz, .bz2 or .xz.
+
+Decompression and compression each run on their own thread, connected to the
+split by a bounded queue of chunks, so that the codecs work at the same time
+as the lines are being routed. zlib, bz2 and lzma release the GIL while they
+work, so the threads really do run in parallel.
+
+Compressed target files can be appended to, as gzip, bzip2 and xz files can
+hold several compressed streams one after another.
+
+@author: vivian
+'''
+import io
+import os
+import queue
+import threading
+
+# Size of the chunks that are passed between the codec threads and the split.
+CHUNK_SIZE = 1024 * 1024
+# Number of chunks that may be waiting between a codec thread and the split.
+QUEUE_SIZE = 8
+
+# Magic bytes at the start of compressed files.
+MAGIC = [
+    (b"\x1f\x8b", "gz"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+]
+
+
+def detect_compression(filename):
+    """ Returns "gz", "bz2" or "xz" if the file starts with the magic bytes of that
+        format, or None if it does not look compressed.
+    """
+    with open(filename, "rb") as stream:
+        head = stream.read(6)
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def compression_for_name(filename):
+    """ Returns "gz", "bz2" or "xz" if the file name has the extension of that
+        format, or None.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in (".gz", ".bz2", ".xz"):
+        return ext[1:]
+    return None
+
+
+def _open_decompressed(stream, kind):
+    """ Returns a file object that decompresses the raw stream.
+    """
+    if kind == "gz":
+        import gzip
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if kind == "bz2":
+        import bz2
+        return bz2.BZ2File(stream, "rb")
+    import lzma
+    return lzma.LZMAFile(stream, "rb")
+
+
+def _make_compressor(kind):
+    """ Returns a compressor object that writes a complete stream of the given format.
+    """
+    if kind == "gz":
+        import zlib
+        # wbits of 16 + 15 gives a gzip header and trailer.
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + 15)
+    if kind == "bz2":
+        import bz2
+        return bz2.BZ2Compressor()
+    import lzma
+    return lzma.LZMACompressor(format=lzma.FORMAT_XZ)
+
+
+class DecompressingReader(io.RawIOBase):
+    """ Reads a compressed file, decompressed on a thread of its own.
+    """
+    def __init__(self, filename, kind):
+        super(DecompressingReader, self).__init__()
+        self._raw = open(filename, "rb")
+        self.total_bytes = os.fstat(self._raw.fileno()).st_size
+        self.compressed_position = 0 # Compressed bytes read so far, for progress.
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._chunk = b""
+        self._eof = False
+        self._thread = threading.Thread(target=self._decompress, args=(kind,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        """ Puts an item on the queue, unless the reader is closed first.
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self, kind):
+        """ Runs on the codec thread.
+        """
+        try:
+            with _open_decompressed(self._raw, kind) as stream:
+                while True:
+                    data = stream.read(CHUNK_SIZE)
+                    self.compressed_position = self._raw.tell()
+                    if not data:
+                        break
+                    if not self._put(data):
+                        return
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._chunk:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+                return 0
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            self._chunk = item
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._raw.close()
+        super(DecompressingReader, self).close()
+
+
+class CompressingWriter(io.RawIOBase):
+    """ Writes a compressed file, compressed on a thread of its own.
+    """
+    def __init__(self, filename, kind, append):
+        super(CompressingWriter, self).__init__()
+        if append:
+            self._raw = open(filename, "ab")
+        else:
+            self._raw = open(filename, "wb")
+        self._kind = kind
+        self._compressor = None # Created when the first data arrives.
+        self._error = None
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._compress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _compress(self):
+        """ Runs on the codec thread.
+        """
+        while True:
+            data = self._queue.get()
+            try:
+                if data is None:
+                    return
+                if self._error is None:
+                    if self._compressor is None:
+                        self._compressor = _make_compressor(self._kind)
+                    self._raw.write(self._compressor.compress(data))
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def writable(self):
+        return True
+
+    def fileno(self):
+        return self._raw.fileno()
+
+    def write(self, data):
+        self._check_error()
+        # The caller may reuse its buffer, so the data is copied.
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def flush(self):
+        """ Waits for the codec thread to compress everything written so far.
+            The compressed stream is only finished when the writer is closed.
+        """
+        if not self._raw.closed:
+            self._queue.join()
+            self._check_error()
+            self._raw.flush()
+
+    def truncate(self, size=None):
+        """ Throws away everything written since the compressed stream was started,
+            and cuts the file back to size bytes. Used to undo a cancelled split.
+        """
+        self._queue.join()
+        self._compressor = None
+        self._raw.flush()
+        os.ftruncate(self._raw.fileno(), size)
+        return size
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._queue.join()
+                self._queue.put(None)
+                self._thread.join()
+                self._check_error()
+                if self._compressor is not None:
+                    self._raw.write(self._compressor.flush())
+            finally:
+                self._raw.close()
+        super(CompressingWriter, self).close()
+
+
+def open_source(filename, kind, text, encoding=None, buffering=CHUNK_SIZE):
+    """ Opens a compressed source file for reading, as text if text is True, or
+        as bytes. Returns the stream and the DecompressingReader below it, which
+        tells how far into the compressed file the reading has got.
+    """
+    reader = DecompressingReader(filename, kind)
+    stream = io.BufferedReader(reader, buffering)
+    if text:
+        stream = io.TextIOWrapper(stream, encoding=encoding)
+    return stream, reader
+
+
+def open_target(filename, open_flag, encoding=None, buffering=CHUNK_SIZE):
+    """ Opens a target file for writing with the given open flag, "a", "w", "ab"
+        or "wb". The file is compressed if its name ends in .gz, .bz2 or .xz.
+    """
+    kind = compression_for_name(filename)
+    if kind is None:
+        if "b" in open_flag:
+            return open(filename, open_flag, buffering=buffering)
+        return open(filename, open_flag, buffering=buffering, encoding=encoding)
+    stream = io.BufferedWriter(CompressingWriter(filename, kind, open_flag.startswith("a")),
+                               buffering)
+    if "b" not in open_flag:
+        stream = io.TextIOWrapper(stream, encoding=encoding)
+    return stream
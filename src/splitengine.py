@@ -0,0 +1,752 @@
+'''
+Split engine for the File Splitter app.
+
+Streams a source file in large buffered chunks of whole lines, and routes
+each line to one of several buffered writers, so that memory use stays flat
+no matter how big the source file is.
+
+Lines are routed by a repeating pattern of target indices: line n of the
+source file goes to target pattern[n % len(pattern)]. The default pattern
+sends the lines to the targets in turn, so with two targets the output is
+identical to reading the whole file with readlines() and writing lines[::2]
+and lines[1::2] to the two target files. Longer patterns handle corpora that
+come as triples, or as blocks of lines per language, in a single pass.
+
+A split can report its progress through a callback and be cancelled through
+a threading.Event, so that it can run on a worker thread while the GUI stays
+responsive. A cancelled split restores the target files to the size they had
+before the split started, so the target files never go out of step.
+
+There are two engines. For ASCII and UTF-8 text, the source file is memory
+mapped and split as bytes, straight from the mapped region, which skips the
+decoding, re-encoding and str allocation of every line. Universal newlines
+are translated the same way as in text mode, so the output is byte-identical.
+For other encodings, the text engine is used. Very large ASCII and UTF-8
+files can also be split by a pool of worker processes.
+
+Compressed source files are decompressed, and target files with names ending
+in .gz, .bz2 or .xz are compressed, on the fly by splitcodecs.
+
+A pairfilter.PairFilter can drop duplicate and misaligned pairs of lines
+during the split, in the same pass.
+
+An incremental split keeps a checkpoint index, see splitindex, so that a source
+file that grows is only split up to where it was split before once, and an
+interrupted split carries on from its last checkpoint.
+
+@author: vivian
+'''
+import codecs
+import contextlib
+import errno
+import locale
+import mmap
+import os
+import shutil
+import tempfile
+import splitcodecs
+import splitindex
+
+# Size of the read and write buffers. This is also the size hint used when
+# reading the source file in chunks of whole lines.
+BUFFER_SIZE = 1024 * 1024
+# Size of the windows of the memory mapped source file that are split at a time.
+# Small enough to stay in the CPU cache while the window is being split.
+MMAP_CHUNK_SIZE = 1024 * 1024
+# Smallest source file that route_file splits in parallel. Below this, starting
+# the worker processes costs more than it saves.
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+# Amount of source between checkpoints of an incremental split.
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+
+class SplitCancelled(Exception):
+    """ Raised when a split is cancelled before it completes.
+    """
+    pass
+
+
+def format_progress(bytes_done, total_bytes, line_count, elapsed):
+    """ Returns a one-line summary of the progress of a split, with the amount
+        of data and lines processed, the throughput in MB/s and the ETA.
+    """
+    mb_done = bytes_done / 1048576.0
+    mb_total = total_bytes / 1048576.0
+    if elapsed > 0:
+        rate = mb_done / elapsed
+    else:
+        rate = 0.0
+    if rate > 0:
+        eta = int((mb_total - mb_done) / rate)
+        eta_text = "%d:%02d:%02d" % (eta // 3600, eta // 60 % 60, eta % 60)
+    else:
+        eta_text = "--:--:--"
+    return "%.1f / %.1f MB, %d lines, %.1f MB/s, ETA %s" % (
+        mb_done, mb_total, line_count, rate, eta_text)
+
+
+def parse_pattern(text, target_count):
+    """ Converts a routing pattern typed by the user, such as "1,2,3" or "1 1 2 2",
+        into a list of target indices. Target files are numbered from 1, as in
+        the GUI. An empty pattern sends the lines to all targets in turn.
+        Raises ValueError if the pattern is not valid.
+    """
+    fields = text.replace(",", " ").split()
+    if not fields:
+        return list(range(target_count))
+    pattern = [int(field) - 1 for field in fields]
+    check_pattern(pattern, target_count)
+    return pattern
+
+
+def check_pattern(pattern, target_count):
+    """ Raises ValueError if pattern is empty or refers to a target that does not exist.
+    """
+    if not pattern:
+        raise ValueError("The routing pattern is empty")
+    for index in pattern:
+        if not 0 <= index < target_count:
+            raise ValueError("The routing pattern refers to target file %d, but there are "
+                             "only %d target files" % (index + 1, target_count))
+
+
+def _restore_size(stream, size):
+    """ Truncates a target file back to the size it had before the split.
+    """
+    stream.flush()
+    stream.truncate(size)
+
+
+def _open_targets(stack, target_filenames, open_flag, encoding=None):
+    """ Opens the target files on an ExitStack, and returns the list of streams
+        and the list of their sizes before the split.
+    """
+    streams = [stack.enter_context(splitcodecs.open_target(target_filename, open_flag,
+                                                           encoding, BUFFER_SIZE))
+               for target_filename in target_filenames]
+    return streams, _stream_sizes(streams)
+
+
+def _stream_sizes(streams):
+    """ Returns the sizes of the files of the target streams.
+    """
+    return [os.fstat(stream.fileno()).st_size for stream in streams]
+
+
+def _check_cancel(cancel_event, streams, start_sizes, source_filename):
+    """ Restores the target files and raises SplitCancelled if cancel_event is set.
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        for stream, start_size in zip(streams, start_sizes):
+            _restore_size(stream, start_size)
+        raise SplitCancelled("Split of %s was cancelled" % source_filename)
+
+
+def _has_distinct_positions(pattern):
+    """ Returns True if no target appears more than once in the pattern.
+    """
+    return len(set(pattern)) == len(pattern)
+
+
+def _write_lines(lines, line_count, streams, pattern):
+    """ Writes a chunk of lines that comes after line_count lines to the streams,
+        as given by the routing pattern. Works on lists of str and of bytes.
+    """
+    if not lines:
+        return
+    period = len(pattern)
+    offset = line_count % period
+    empty = lines[0][:0]
+    if _has_distinct_positions(pattern):
+        # Each target gets every period-th line, so the lines of a target can be
+        # sliced out, and joined so that each target gets a single write call.
+        for position, index in enumerate(pattern):
+            streams[index].write(empty.join(lines[(position - offset) % period::period]))
+    else:
+        buckets = [[] for stream in streams]
+        for line_number, line in enumerate(lines, offset):
+            buckets[pattern[line_number % period]].append(line)
+        for stream, bucket in zip(streams, buckets):
+            stream.write(empty.join(bucket))
+
+
+def _route_lines(lines, written, streams, pattern, pair_filter):
+    """ Passes a chunk of lines through pair_filter, if given, and writes the lines
+        that are kept after the written lines. Returns the new number of lines written.
+    """
+    if pair_filter is not None:
+        lines = pair_filter.process(lines)
+    _write_lines(lines, written, streams, pattern)
+    return written + len(lines)
+
+
+def _finish_filter(written, streams, pattern, pair_filter):
+    """ Writes the lines of an incomplete last pair held back by pair_filter, if given.
+    """
+    if pair_filter is not None:
+        _write_lines(pair_filter.finish(), written, streams, pattern)
+
+
+def _can_split_bytes(encoding):
+    """ Returns True if a file in the given encoding can be split as bytes, with
+        the same result as splitting it as text.
+    """
+    # Text mode writes os.linesep for every newline.
+    if os.linesep != "\n":
+        return False
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+    try:
+        return codecs.lookup(encoding).name in ("utf-8", "ascii")
+    except LookupError:
+        return False
+
+
+def split_file(source_filename, target1_filename, target2_filename, append=True,
+               progress=None, cancel_event=None, encoding=None, use_mmap=True, workers=1):
+    """ Read in lines from source file, then save odd lines in the first target
+        file, and even lines in the second target file.
+
+        Lines are numbered according to normal human convention, i.e. the first
+        line in the source file is an odd line and goes to the first target file.
+        Other arguments are the same as for route_file.
+        Returns the number of lines read from the source file.
+    """
+    return route_file(source_filename, [target1_filename, target2_filename], None, append,
+                      progress, cancel_event, encoding, use_mmap, workers)
+
+
+def route_file(source_filename, target_filenames, pattern=None, append=True,
+               progress=None, cancel_event=None, encoding=None, use_mmap=True, workers=1,
+               incremental=False, restart=False, pair_filter=None):
+    """ Read in lines from source file, and save each line in one of the target
+        files, in a single pass over the source file.
+
+        Line n of the source file, counting from 0, goes to the target file with
+        index pattern[n % len(pattern)]. pattern defaults to all target files in
+        turn. If append is False, the target files are overwritten.
+
+        progress, if given, is called as progress(bytes_done, total_bytes, line_count)
+        after each chunk. If cancel_event is given and gets set, the target files
+        are restored to their original size and SplitCancelled is raised.
+        encoding is the encoding of the source file, and defaults to the locale
+        encoding. ASCII and UTF-8 files are split with route_mmap, unless use_mmap
+        is False, and other files with route_text. If workers is more than 1,
+        ASCII and UTF-8 files of at least PARALLEL_MIN_SIZE bytes are split with
+        route_parallel, using that many worker processes, as long as no target
+        appears more than once in the pattern and all the target files are
+        compressed the same way.
+        Compressed source files are split with route_stream, or with route_text
+        for encodings other than ASCII and UTF-8.
+        If incremental is True, the file is split with route_incremental instead,
+        which is also given restart.
+        pair_filter, if given, is a pairfilter.PairFilter with a period of the
+        length of the pattern, which drops pairs of lines before they are written.
+        It cannot be used for incremental splits, and the split is then not done
+        in parallel.
+        Returns the number of lines read from the source file.
+    """
+    if pattern is None:
+        pattern = list(range(len(target_filenames)))
+    check_pattern(pattern, len(target_filenames))
+    if pair_filter is not None:
+        if incremental:
+            raise ValueError("Pairs cannot be filtered in an incremental split")
+        if pair_filter.period != len(pattern):
+            raise ValueError("The pair filter expects pairs of %d lines, but the routing "
+                             "pattern has %d" % (pair_filter.period, len(pattern)))
+    if incremental:
+        return route_incremental(source_filename, target_filenames, pattern, append,
+                                 progress, cancel_event, encoding, restart)
+    compression = splitcodecs.detect_compression(source_filename)
+    if use_mmap and _can_split_bytes(encoding):
+        if compression is not None:
+            return route_stream(source_filename, target_filenames, pattern, append,
+                                progress, cancel_event, compression, pair_filter)
+        source_size = os.path.getsize(source_filename)
+        target_compressions = set(splitcodecs.compression_for_name(target_filename)
+                                  for target_filename in target_filenames)
+        if workers > 1 and source_size >= PARALLEL_MIN_SIZE and pair_filter is None and \
+                _has_distinct_positions(pattern) and len(target_compressions) == 1:
+            return route_parallel(source_filename, target_filenames, pattern, append,
+                                  progress, cancel_event, workers)
+        if source_size > 0:
+            return route_mmap(source_filename, target_filenames, pattern, append,
+                              progress, cancel_event, pair_filter=pair_filter)
+    return route_text(source_filename, target_filenames, pattern, append,
+                      progress, cancel_event, encoding, compression, pair_filter)
+
+
+def _open_source(stack, source_filename, compression, text, encoding=None):
+    """ Opens the source file on an ExitStack, decompressing it if compression is
+        not None. Returns the stream, the size of the source file, and a function
+        that returns how many bytes of the source file have been read.
+    """
+    if compression is None:
+        if text:
+            stream_in = stack.enter_context(open(source_filename, buffering=BUFFER_SIZE,
+                                                 encoding=encoding))
+            raw_in = stream_in.buffer
+        else:
+            stream_in = raw_in = stack.enter_context(open(source_filename, "rb",
+                                                          buffering=BUFFER_SIZE))
+        return stream_in, os.fstat(stream_in.fileno()).st_size, raw_in.tell
+    stream_in, reader = splitcodecs.open_source(source_filename, compression, text,
+                                                encoding, BUFFER_SIZE)
+    stack.enter_context(stream_in)
+    return stream_in, reader.total_bytes, lambda: reader.compressed_position
+
+
+def route_text(source_filename, target_filenames, pattern, append=True,
+               progress=None, cancel_event=None, encoding=None, compression=None,
+               pair_filter=None):
+    """ Splits the source file as text, decoding it with the given encoding.
+        compression is the compression of the source file, as returned by
+        splitcodecs.detect_compression. Other arguments are the same as for route_file.
+    """
+    if append:
+        open_flag = "a"
+    else:
+        open_flag = "w"
+    line_count = 0
+    written = 0
+    with contextlib.ExitStack() as stack:
+        stream_in, total_bytes, position = _open_source(stack, source_filename, compression,
+                                                        True, encoding)
+        streams, start_sizes = _open_targets(stack, target_filenames, open_flag, encoding)
+        while True:
+            _check_cancel(cancel_event, streams, start_sizes, source_filename)
+            lines = stream_in.readlines(BUFFER_SIZE)
+            if not lines:
+                break
+            written = _route_lines(lines, written, streams, pattern, pair_filter)
+            line_count += len(lines)
+            if progress is not None:
+                progress(position(), total_bytes, line_count)
+        _finish_filter(written, streams, pattern, pair_filter)
+    return line_count
+
+
+def _iter_stream_lines(stream_in):
+    """ Yields lists of lines read from a binary stream in chunks, with "\r\n" and
+        "\r" newlines translated to "\n", as in text mode.
+    """
+    rest = b""
+    while True:
+        data = stream_in.read(BUFFER_SIZE)
+        if not data:
+            break
+        data = rest + data
+        # A "\r" at the very end may be the first half of "\r\n", so it waits for more data.
+        limit = len(data)
+        if data.endswith(b"\r"):
+            limit -= 1
+        newline = max(data.rfind(b"\n", 0, limit), data.rfind(b"\r", 0, limit))
+        if newline == -1:
+            rest = data
+            continue
+        chunk, rest = data[:newline + 1], data[newline + 1:]
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        yield chunk.splitlines(True)
+    if rest:
+        yield rest.replace(b"\r\n", b"\n").replace(b"\r", b"\n").splitlines(True)
+
+
+def route_stream(source_filename, target_filenames, pattern, append=True,
+                 progress=None, cancel_event=None, compression=None, pair_filter=None):
+    """ Splits the source file as bytes, read as a stream in chunks. This is used
+        for compressed source files, which cannot be memory mapped.
+        "\r\n" and "\r" newlines are translated to "\n", as in text mode.
+        Arguments are the same as for route_text.
+    """
+    if append:
+        open_flag = "ab"
+    else:
+        open_flag = "wb"
+    line_count = 0
+    written = 0
+    with contextlib.ExitStack() as stack:
+        stream_in, total_bytes, position = _open_source(stack, source_filename, compression,
+                                                        False)
+        streams, start_sizes = _open_targets(stack, target_filenames, open_flag)
+        for lines in _iter_stream_lines(stream_in):
+            _check_cancel(cancel_event, streams, start_sizes, source_filename)
+            written = _route_lines(lines, written, streams, pattern, pair_filter)
+            line_count += len(lines)
+            if progress is not None:
+                progress(position(), total_bytes, line_count)
+        _finish_filter(written, streams, pattern, pair_filter)
+    return line_count
+
+
+def _rfind_newline(mapped, start, end):
+    """ Returns the position of the last "\n" or "\r" of the mapped file between
+        start and end, or -1. Only the bytes after the last "\n" are searched for
+        "\r", so that a file without any is not read twice.
+    """
+    newline = mapped.rfind(b"\n", start, end)
+    carriage = mapped.rfind(b"\r", max(start, newline + 1), end)
+    return max(newline, carriage)
+
+
+def _find_chunk_end(mapped, start, size, chunk_size=None):
+    """ Returns the end of the chunk of the mapped file that starts at start.
+        The chunk ends after a newline, and never between the two bytes of "\r\n".
+    """
+    if chunk_size is None:
+        chunk_size = MMAP_CHUNK_SIZE
+    end = start + chunk_size
+    if end >= size:
+        return size
+    newline = _rfind_newline(mapped, start, end)
+    if newline == -1:
+        # A line longer than a whole chunk, so extend the chunk to the end of it.
+        newline = mapped.find(b"\n", end, size)
+        carriage = mapped.find(b"\r", end, size if newline == -1 else newline)
+        if carriage != -1:
+            newline = carriage
+        if newline == -1:
+            return size
+    end = newline + 1
+    if mapped[newline] == 13 and end < size and mapped[end] == 10:
+        end += 1
+    return end
+
+
+def _iter_mapped_lines(mapped, start, end):
+    """ Yields (chunk_end, lines) for each chunk of the mapped file between start
+        and end, with "\r\n" and "\r" newlines translated to "\n", as in text mode.
+        start and end must be on line boundaries.
+    """
+    while start < end:
+        chunk_end = _find_chunk_end(mapped, start, end)
+        chunk = mapped[start:chunk_end]
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        yield chunk_end, chunk.splitlines(True)
+        start = chunk_end
+
+
+def _open_mapped(stream_in):
+    """ Memory maps an open source file for reading from start to end.
+    """
+    mapped = mmap.mmap(stream_in.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped
+
+
+def _find_tail_start(mapped, start, end):
+    """ Returns where the last line of the mapped file between start and end starts,
+        if that line is not complete yet, or end if it is. A line that ends in "\r"
+        is not complete, as a "\n" may still be appended to it.
+    """
+    if end == start or mapped[end - 1] == 10:
+        return end
+    newline = _rfind_newline(mapped, start, end - 1)
+    if newline == -1:
+        return start
+    return newline + 1
+
+
+def _flush_all(streams):
+    for stream in streams:
+        stream.flush()
+
+
+def route_mmap(source_filename, target_filenames, pattern, append=True,
+               progress=None, cancel_event=None, start_offset=0, start_line=0,
+               checkpoint=None, pair_filter=None):
+    """ Splits the source file as bytes, straight from a memory mapped view of it.
+        "\r\n" and "\r" newlines are translated to "\n", as in text mode.
+
+        The split starts at byte start_offset, which must be at the start of a line,
+        and start_line is the number of lines before it. If checkpoint is given, the
+        target files are flushed about every CHECKPOINT_BYTES bytes of source, and
+        checkpoint(offset, line_count, False) is called with the source offset and
+        line count up to which the target files are complete. When the split is done,
+        checkpoint(offset, line_count, True) is called, leaving out a last line
+        that is not complete yet, although it is written to its target file. A
+        cancelled split then cuts the target files back to the last checkpoint,
+        rather than to their size at the start.
+        pair_filter cannot be used together with checkpoint.
+        Other arguments are the same as for route_file. The source file must not be
+        empty. Returns the number of lines up to the end of the source file.
+    """
+    if append:
+        open_flag = "ab"
+    else:
+        open_flag = "wb"
+    line_count = start_line
+    written = start_line
+    with contextlib.ExitStack() as stack:
+        stream_in = stack.enter_context(open(source_filename, "rb"))
+        streams, start_sizes = _open_targets(stack, target_filenames, open_flag)
+        mapped = stack.enter_context(_open_mapped(stream_in))
+        total_bytes = len(mapped)
+        tail_start = _find_tail_start(mapped, start_offset, total_bytes)
+        checkpoint_offset = start_offset
+        for chunk_end, lines in _iter_mapped_lines(mapped, start_offset, total_bytes):
+            _check_cancel(cancel_event, streams, start_sizes, source_filename)
+            if checkpoint is not None and chunk_end == total_bytes and tail_start < total_bytes:
+                # Checkpoint before the incomplete last line, so that the next run
+                # can write it again in full.
+                _write_lines(lines[:-1], line_count, streams, pattern)
+                line_count += len(lines) - 1
+                _flush_all(streams)
+                checkpoint(tail_start, line_count, False)
+                checkpoint_offset = tail_start
+                start_sizes = _stream_sizes(streams)
+                _write_lines(lines[-1:], line_count, streams, pattern)
+                line_count += 1
+            else:
+                written = _route_lines(lines, written, streams, pattern, pair_filter)
+                line_count += len(lines)
+                if checkpoint is not None and chunk_end - checkpoint_offset >= CHECKPOINT_BYTES:
+                    _flush_all(streams)
+                    checkpoint(chunk_end, line_count, False)
+                    checkpoint_offset = chunk_end
+                    start_sizes = _stream_sizes(streams)
+            if progress is not None:
+                progress(chunk_end, total_bytes, line_count)
+        _finish_filter(written, streams, pattern, pair_filter)
+        if checkpoint is not None:
+            _flush_all(streams)
+            if tail_start < total_bytes:
+                checkpoint(tail_start, line_count - 1, True)
+            else:
+                checkpoint(total_bytes, line_count, True)
+    return line_count
+
+
+def _split_segment(source_filename, start, end, segment_filenames):
+    """ Runs in a worker process of route_parallel. Writes the lines of the source
+        file between start and end to the segment files in turn, starting with
+        the first. Returns the number of lines in the segment.
+    """
+    line_count = 0
+    pattern = list(range(len(segment_filenames)))
+    with contextlib.ExitStack() as stack:
+        stream_in = stack.enter_context(open(source_filename, "rb"))
+        streams, _ = _open_targets(stack, segment_filenames, "wb")
+        mapped = stack.enter_context(_open_mapped(stream_in))
+        for _, lines in _iter_mapped_lines(mapped, start, end):
+            _write_lines(lines, line_count, streams, pattern)
+            line_count += len(lines)
+    return line_count
+
+
+def _copy_fd(in_fd, out_fd, count):
+    """ Copies count bytes from the current offset of in_fd to the current offset
+        of out_fd. The copy is done by the kernel with copy_file_range or sendfile
+        where the platform and file systems allow it.
+    """
+    for kernel_copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+        if kernel_copy is None:
+            continue
+        try:
+            while count > 0:
+                if kernel_copy is os.sendfile:
+                    copied = os.sendfile(out_fd, in_fd, None, count)
+                else:
+                    copied = kernel_copy(in_fd, out_fd, count)
+                if copied == 0:
+                    break
+                count -= copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                               errno.EBADF):
+                raise
+        else:
+            if count == 0:
+                return
+    while count > 0:
+        data = os.read(in_fd, min(count, BUFFER_SIZE))
+        if not data:
+            break
+        os.write(out_fd, data)
+        count -= len(data)
+
+
+def _partition(mapped, parts):
+    """ Returns a list of (start, end) byte ranges that cut the mapped file into
+        about the given number of parts, on line boundaries.
+    """
+    size = len(mapped)
+    part_size = max(size // parts, MMAP_CHUNK_SIZE)
+    ranges = []
+    start = 0
+    while start < size:
+        end = _find_chunk_end(mapped, start, size, part_size)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def route_parallel(source_filename, target_filenames, pattern, append=True,
+                   progress=None, cancel_event=None, workers=None):
+    """ Splits the source file as bytes in a pool of worker processes, with the
+        same result as route_mmap. No target may appear more than once in pattern,
+        and all the target files must be compressed the same way.
+
+        The source file is partitioned on line boundaries, and each worker writes
+        the lines of a partition to one segment file per position in the pattern,
+        as if the partition started at the first position. Once all partitions are
+        done, the line counts give the position each partition really starts at,
+        and the segments are concatenated into the target files of their real
+        positions with kernel-side copies.
+        workers defaults to the number of CPUs. Other arguments are the same as for
+        route_file. The source file must not be empty.
+        The worker processes run the main script of the caller again, so the apps,
+        whose main scripts import Kivy, split in a single process instead.
+    """
+    # Imported here, as it pulls in logging, which slows down starting the command line tool.
+    import concurrent.futures
+    import multiprocessing
+    # Workers are not forked from this process, which may have other threads holding
+    # locks. They run the main script of this process again, without its main block,
+    # so that script must not import anything heavy, such as Kivy, at the top.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    period = len(pattern)
+    with open(source_filename, "rb") as stream_in, _open_mapped(stream_in) as mapped:
+        total_bytes = len(mapped)
+        # More partitions than workers keeps all workers busy until the end.
+        ranges = _partition(mapped, workers * 4)
+    # Segment files go next to the first target, so kernel-side copies stay on one file system.
+    segment_dir = tempfile.mkdtemp(prefix=".split-",
+                                   dir=os.path.dirname(os.path.abspath(target_filenames[0])))
+    try:
+        # Segments are compressed like the targets, as compressed streams can be concatenated.
+        ext = os.path.splitext(target_filenames[0])[1]
+        if splitcodecs.compression_for_name(target_filenames[0]) is None:
+            ext = ""
+        segments = [[os.path.join(segment_dir, "%d.%d%s" % (i, position, ext))
+                     for position in range(period)]
+                    for i in range(len(ranges))]
+        line_counts = [0] * len(ranges)
+        bytes_done = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=context) as executor:
+            futures = {}
+            for i, (start, end) in enumerate(ranges):
+                future = executor.submit(_split_segment, source_filename, start, end, segments[i])
+                futures[future] = i
+            pending = set(futures)
+            while pending:
+                if cancel_event is not None and cancel_event.is_set():
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise SplitCancelled("Split of %s was cancelled" % source_filename)
+                done, pending = concurrent.futures.wait(
+                    pending, timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    i = futures[future]
+                    line_counts[i] = future.result()
+                    bytes_done += ranges[i][1] - ranges[i][0]
+                if done and progress is not None:
+                    progress(bytes_done, total_bytes, sum(line_counts))
+        # copy_file_range does not work on files opened for appending, so seek to the end instead.
+        flags = os.O_WRONLY | os.O_CREAT
+        if not append:
+            flags |= os.O_TRUNC
+        with contextlib.ExitStack() as stack:
+            out_fds = []
+            for target_filename in target_filenames:
+                out_fd = os.open(target_filename, flags, 0o666)
+                stack.callback(os.close, out_fd)
+                out_fds.append(out_fd)
+            start_sizes = [os.lseek(out_fd, 0, os.SEEK_END) for out_fd in out_fds]
+            line_count = 0
+            for i, segment_filenames in enumerate(segments):
+                if cancel_event is not None and cancel_event.is_set():
+                    for out_fd, start_size in zip(out_fds, start_sizes):
+                        os.ftruncate(out_fd, start_size)
+                    raise SplitCancelled("Split of %s was cancelled" % source_filename)
+                for position, segment_filename in enumerate(segment_filenames):
+                    out_fd = out_fds[pattern[(line_count + position) % period]]
+                    in_fd = os.open(segment_filename, os.O_RDONLY)
+                    try:
+                        _copy_fd(in_fd, out_fd, os.fstat(in_fd).st_size)
+                    finally:
+                        os.close(in_fd)
+                line_count += line_counts[i]
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    return line_count
+
+
+def route_incremental(source_filename, target_filenames, pattern=None, append=True,
+                      progress=None, cancel_event=None, encoding=None, restart=False):
+    """ Splits the source file with route_mmap, starting where the last split of the
+        same source file into the same target files stopped, as recorded in the
+        checkpoint index of the target files. If that split was interrupted, the
+        target files are first cut back to its last checkpoint.
+
+        If append is False, the target files are overwritten and the index is
+        cleared. If restart is True, the target files are cut back to their size
+        before the first split of the source file, and it is split again from the
+        start. Other arguments are the same as for route_file.
+        Only uncompressed ASCII and UTF-8 files can be split incrementally.
+        Raises splitindex.SourceChanged if the source file was rewritten since the
+        last split. Returns the number of lines up to the end of the source file.
+    """
+    if pattern is None:
+        pattern = list(range(len(target_filenames)))
+    check_pattern(pattern, len(target_filenames))
+    if not _can_split_bytes(encoding) or \
+            splitcodecs.detect_compression(source_filename) is not None or \
+            any(splitcodecs.compression_for_name(target_filename) is not None
+                for target_filename in target_filenames):
+        raise ValueError("Only uncompressed ASCII and UTF-8 files can be split incrementally")
+    index_filename = splitindex.index_filename(target_filenames)
+    index = splitindex.load_index(index_filename)
+    key = splitindex.source_key(source_filename)
+    record = index.get(key)
+    if not append:
+        # The target files start out empty, so no record of the index holds any more.
+        splitindex.cut_targets(target_filenames, [0] * len(target_filenames))
+        index = {}
+        record = None
+    elif record is not None and restart:
+        splitindex.cut_targets(target_filenames, record["base_sizes"])
+        record = None
+    if record is None:
+        record = splitindex.new_record(target_filenames, pattern)
+    else:
+        sizes = splitindex.resume_sizes(record, source_filename, target_filenames, pattern)
+        if sizes is not None:
+            splitindex.cut_targets(target_filenames, sizes)
+    record["target_sizes"] = splitindex.target_sizes(target_filenames)
+    if os.path.getsize(source_filename) == 0:
+        for target_filename in target_filenames:
+            open(target_filename, "ab").close()
+        record["end_sizes"] = record["target_sizes"]
+        index[key] = record
+        splitindex.save_index(index_filename, index)
+        return 0
+    record["end_sizes"] = None
+    index[key] = record
+    splitindex.save_index(index_filename, index)
+
+    def save_checkpoint(offset, line_count, finished):
+        sizes = splitindex.target_sizes(target_filenames)
+        if offset != record["offset"] or not finished:
+            record["offset"] = offset
+            record["line_count"] = line_count
+            record["target_sizes"] = sizes
+            record["prefix_hash"] = splitindex.prefix_hash(source_filename, offset)
+        if finished:
+            record["end_sizes"] = sizes
+        else:
+            record["end_sizes"] = None
+        splitindex.save_index(index_filename, index)
+
+    # If the split is cancelled, the target files are cut back to the last checkpoint,
+    # which the record holds, and the next run carries on from there.
+    return route_mmap(source_filename, target_filenames, pattern, True, progress,
+                      cancel_event, record["offset"], record["line_count"], save_checkpoint)
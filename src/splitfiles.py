@@ -0,0 +1,195 @@
+'''
+File Splitter command line tool
+
+Splits source files the same way as the File Splitter app, without starting
+the GUI, so that corpus splitting can be scripted. Only splitengine is loaded,
+never Kivy, so the tool starts in milliseconds.
+
+Several source files are split concurrently, in up to --jobs worker processes.
+Source files that share their target files are split one after another, in the
+order given, so their lines are never interleaved.
+
+Source files compressed with gzip, bzip2 or xz are decompressed on the fly, and
+target files whose names end in .gz, .bz2 or .xz are compressed.
+
+Usage:
+    python splitfiles.py corpus1.txt corpus2.txt
+    python splitfiles.py -t "{dir}/{stem}.en" -t "{dir}/{stem}.fr" --overwrite *.txt
+    python splitfiles.py -n 3 -t "{dir}/{stem}.{n}" triples.txt
+    python splitfiles.py -p "1,1,2,2" blocks.txt
+    python splitfiles.py -t "{path}.{n}.gz" corpus.txt.xz
+    python splitfiles.py --incremental growing_corpus.txt
+    python splitfiles.py --dedup --drop-empty --max-ratio 3 corpus.txt
+
+@author: vivian
+'''
+import argparse
+import os
+import sys
+import time
+import pairfilter
+import splitengine
+
+
+def expand_target(template, source_filename, number):
+    """ Fills in the placeholders of a target file name template for a source file.
+    """
+    directory, name = os.path.split(source_filename)
+    stem, ext = os.path.splitext(name)
+    return template.format(path=source_filename, dir=directory or ".", name=name,
+                           stem=stem, ext=ext, n=number)
+
+
+def make_filter(args, period):
+    """ Returns the pair filter asked for on the command line, or None.
+    """
+    if not (args.dedup or args.drop_empty or args.max_ratio is not None):
+        return None
+    return pairfilter.PairFilter(period, dedup=args.dedup, drop_empty=args.drop_empty,
+                                 max_ratio=args.max_ratio,
+                                 memory=args.filter_memory * 1024 * 1024)
+
+
+def split_group(source_filenames, target_filenames, pattern, append, encoding, workers,
+                incremental=False, restart=False, filter_args=None):
+    """ Splits source files that share the same target files one after another.
+        Only the first source file overwrites the target files if append is False.
+        filter_args, if given, are the parsed command line arguments for make_filter.
+        Returns a list of (source_filename, line_count, source_size, seconds, error,
+        filter_summary).
+    """
+    results = []
+    for source_filename in source_filenames:
+        start_time = time.time()
+        pair_filter = None
+        if filter_args is not None:
+            pair_filter = make_filter(filter_args, len(pattern))
+        try:
+            source_size = os.path.getsize(source_filename)
+            line_count = splitengine.route_file(source_filename, target_filenames, pattern,
+                                                append=append, encoding=encoding,
+                                                workers=workers, incremental=incremental,
+                                                restart=restart, pair_filter=pair_filter)
+            summary = None
+            if pair_filter is not None:
+                summary = pair_filter.summary()
+            results.append((source_filename, line_count, source_size,
+                            time.time() - start_time, None, summary))
+        except (OSError, ValueError) as e:
+            results.append((source_filename, 0, 0, time.time() - start_time, str(e), None))
+        append = True
+    return results
+
+
+def make_groups(source_filenames, templates):
+    """ Returns a list of (target_filenames, source_filenames), with the source files
+        grouped by their target files. Raises ValueError if a target file would be
+        shared by two different sets of target files.
+    """
+    groups = {}
+    for source_filename in source_filenames:
+        target_filenames = tuple(expand_target(template, source_filename, number)
+                                 for number, template in enumerate(templates, 1))
+        groups.setdefault(target_filenames, []).append(source_filename)
+    owners = {}
+    for target_filenames in groups:
+        for target_filename in target_filenames:
+            key = os.path.abspath(target_filename)
+            if owners.setdefault(key, target_filenames) != target_filenames:
+                raise ValueError("Target file %s is used together with different target files"
+                                 % target_filename)
+    return [(list(target_filenames), groups[target_filenames]) for target_filenames in groups]
+
+
+def print_results(results):
+    """ Prints one line per source file, and returns the number of failed files.
+    """
+    failures = 0
+    for source_filename, line_count, source_size, seconds, error, summary in results:
+        if error is not None:
+            failures += 1
+            print("%s: failed: %s" % (source_filename, error), file=sys.stderr)
+        else:
+            print("%s: %d lines in %.2f s, %.1f MB/s" % (
+                source_filename, line_count, seconds, source_size / 1048576.0 / max(seconds, 1e-6)))
+            if summary is not None:
+                print("%s: %s" % (source_filename, summary))
+    return failures
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Split source files line by line into target files, "
+                    "odd lines in the first and even lines in the second by default.")
+    parser.add_argument("sources", nargs="+", metavar="SOURCE", help="source files to split")
+    parser.add_argument("-t", "--target", action="append", dest="templates", metavar="TEMPLATE",
+                        help="target file name, once per target file. May use {path}, {dir}, "
+                             "{name}, {stem}, {ext} of the source file and {n}, the number "
+                             "of the target file. A single template with {n} is used for "
+                             "all target files. Defaults to {path}.{n}")
+    parser.add_argument("-n", "--targets", type=int, default=2, metavar="N",
+                        help="number of target files for a template with {n} (default 2)")
+    parser.add_argument("-p", "--pattern", default="",
+                        help="target file numbers to send the lines to in turn, e.g. 1,1,2,2")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="overwrite the target files instead of appending to them")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="only split what was added to the source files since their "
+                             "last split, and carry on with interrupted splits")
+    parser.add_argument("--restart", action="store_true",
+                        help="with --incremental, undo the earlier splits of the source "
+                             "files and split them again from the start")
+    parser.add_argument("--dedup", action="store_true",
+                        help="drop duplicate pairs of lines")
+    parser.add_argument("--drop-empty", action="store_true",
+                        help="drop pairs of lines with an empty side")
+    parser.add_argument("--max-ratio", type=float, default=None, metavar="RATIO",
+                        help="drop pairs whose longest side is more than RATIO times as "
+                             "long as their shortest side")
+    parser.add_argument("--filter-memory", type=int, default=64, metavar="MB",
+                        help="memory used to find duplicate pairs (default 64 MB)")
+    parser.add_argument("--encoding", default=None,
+                        help="encoding of the source files (default: locale encoding)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of source files to split at the same time")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="worker processes for each large source file (default 1)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    templates = args.templates or ["{path}.{n}"]
+    # A single template with {n} stands for all the target files.
+    if len(templates) == 1 and "{n}" in templates[0]:
+        templates = templates * args.targets
+    try:
+        pattern = splitengine.parse_pattern(args.pattern, len(templates))
+        groups = make_groups(args.sources, templates)
+    except ValueError as e:
+        print("splitfiles: " + str(e), file=sys.stderr)
+        return 2
+    jobs = max(1, min(args.jobs, len(groups)))
+    failures = 0
+    if jobs == 1:
+        for target_filenames, source_filenames in groups:
+            failures += print_results(split_group(source_filenames, target_filenames, pattern,
+                                                  not args.overwrite, args.encoding, args.workers,
+                                                  args.incremental, args.restart, args))
+    else:
+        # Imported here, so that splitting a single file does not pay for it.
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(split_group, source_filenames, target_filenames, pattern,
+                                       not args.overwrite, args.encoding, args.workers,
+                                       args.incremental, args.restart, args)
+                       for target_filenames, source_filenames in groups]
+            for future in concurrent.futures.as_completed(futures):
+                failures += print_results(future.result())
+    if failures:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
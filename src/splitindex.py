@@ -0,0 +1,154 @@
+'''
+Checkpoint index for incremental splitting.
+
+The index is a small JSON file next to the first target file, named after it
+with INDEX_SUFFIX added. For each source file that has been split into these
+target files, it records how far into the source file the split got: the byte
+offset and number of lines that are complete in the target files, the sizes of
+the target files at that point, and a hash of the processed part of the source
+file.
+
+A later split of the same source file can then seek straight to that offset,
+and only append the lines that were added since, or carry on from where an
+interrupted split stopped.
+
+The hash is taken over evenly spaced samples of the processed part of the
+source file, rather than over all of it, so that checking it costs the same
+for any size of file. That is enough to notice a source file that has been
+rewritten, as opposed to appended to.
+
+@author: vivian
+'''
+import hashlib
+import json
+import os
+
+INDEX_SUFFIX = ".splitindex"
+# Number and size of the samples of the source file that are hashed.
+SAMPLE_COUNT = 16
+SAMPLE_SIZE = 64 * 1024
+
+
+class SourceChanged(ValueError):
+    """ Raised when a source file was rewritten rather than appended to since it
+        was last split.
+    """
+    pass
+
+
+def index_filename(target_filenames):
+    """ Returns the name of the index file for a list of target files.
+    """
+    return target_filenames[0] + INDEX_SUFFIX
+
+
+def source_key(source_filename):
+    """ Returns the key of a source file in the index.
+    """
+    return os.path.abspath(source_filename)
+
+
+def prefix_hash(source_filename, length):
+    """ Returns a hash of samples of the first length bytes of the source file.
+    """
+    digest = hashlib.blake2b(str(length).encode("ascii"), digest_size=16)
+    with open(source_filename, "rb") as stream:
+        if length <= SAMPLE_COUNT * SAMPLE_SIZE:
+            digest.update(stream.read(length))
+        else:
+            # Evenly spaced samples, the last of which ends at length.
+            step = (length - SAMPLE_SIZE) // SAMPLE_COUNT
+            for sample in range(SAMPLE_COUNT + 1):
+                stream.seek(sample * step)
+                digest.update(stream.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def load_index(filename):
+    """ Returns the index stored in the file, or an empty index if there is none.
+    """
+    try:
+        with open(filename) as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return {}
+
+
+def save_index(filename, index):
+    """ Stores the index in the file. The file is replaced in one step, so an
+        interrupted save leaves the previous index intact.
+    """
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "w") as stream:
+        json.dump(index, stream, indent=1, sort_keys=True)
+    os.replace(temp_filename, filename)
+
+
+def target_sizes(target_filenames):
+    """ Returns the current sizes of the target files, with 0 for missing files.
+    """
+    sizes = []
+    for target_filename in target_filenames:
+        try:
+            sizes.append(os.path.getsize(target_filename))
+        except FileNotFoundError:
+            sizes.append(0)
+    return sizes
+
+
+def new_record(target_filenames, pattern):
+    """ Returns the record of a source file that has not been split yet.
+    """
+    sizes = target_sizes(target_filenames)
+    return {
+        "targets": [os.path.abspath(target_filename) for target_filename in target_filenames],
+        "pattern": list(pattern),
+        "offset": 0,
+        "line_count": 0,
+        "prefix_hash": None,
+        "base_sizes": sizes,    # Sizes of the target files before the first split.
+        "target_sizes": sizes,  # Sizes of the target files at the checkpoint.
+        "end_sizes": sizes,     # Sizes when the last split finished, or None if it did not.
+    }
+
+
+def resume_sizes(record, source_filename, target_filenames, pattern):
+    """ Checks that a split of the source file can carry on from its record, and
+        returns the sizes the target files must be cut back to first, or None if
+        they can be appended to as they are.
+
+        Raises SourceChanged if the processed part of the source file has changed,
+        and ValueError if the target files or pattern do not match the record.
+    """
+    if record["targets"] != [os.path.abspath(target_filename)
+                             for target_filename in target_filenames]:
+        raise ValueError("%s was split into other target files before" % source_filename)
+    if record["pattern"] != list(pattern):
+        raise ValueError("%s was split with another routing pattern before" % source_filename)
+    offset = record["offset"]
+    if os.path.getsize(source_filename) < offset or \
+            (offset > 0 and prefix_hash(source_filename, offset) != record["prefix_hash"]):
+        raise SourceChanged("%s was rewritten since it was last split" % source_filename)
+    sizes = target_sizes(target_filenames)
+    if record["end_sizes"] is None:
+        # The last split was interrupted, so its output after the checkpoint is dropped.
+        if any(size < checkpoint_size
+               for size, checkpoint_size in zip(sizes, record["target_sizes"])):
+            raise ValueError("The target files of %s were changed since the last split"
+                             % source_filename)
+        return record["target_sizes"]
+    if record["end_sizes"] == record["target_sizes"]:
+        return None
+    # The last split ended with an incomplete line, which is written again in full.
+    if sizes != record["end_sizes"]:
+        raise ValueError("The target files of %s were changed since the last split"
+                         % source_filename)
+    return record["target_sizes"]
+
+
+def cut_targets(target_filenames, sizes):
+    """ Cuts the target files back to the given sizes.
+    """
+    for target_filename, size in zip(target_filenames, sizes):
+        if os.path.exists(target_filename):
+            os.truncate(target_filename, size)
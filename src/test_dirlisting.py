@@ -0,0 +1,68 @@
+'''
+Tests of dirlisting, run with pytest from this directory.
+
+@author: vivian
+'''
+import os
+import threading
+import time
+import dirlisting
+
+
+def make_directory(tmp_path, count):
+    for i in range(count):
+        (tmp_path / ("file%04d.txt" % i)).write_bytes(b"x" * i)
+    return str(tmp_path)
+
+
+def wait_complete(cache, path):
+    for _ in range(500):
+        if cache.is_complete(path):
+            return
+        time.sleep(0.01)
+    raise AssertionError("The scan of %s did not finish" % path)
+
+
+def test_listing_has_all_entries(tmp_path):
+    path = make_directory(tmp_path, 1200)
+    os.mkdir(os.path.join(path, "sub"))
+    cache = dirlisting.DirectoryCache()
+    cache.request(path)
+    wait_complete(cache, path)
+    assert len(cache.listdir(path)) == 1201
+    assert cache.entry(os.path.join(path, "file0007.txt")) == (False, 7, False)
+    assert cache.entry(os.path.join(path, "sub")).is_dir
+
+
+def test_listener_joins_a_running_scan(tmp_path, monkeypatch):
+    path = make_directory(tmp_path, 50)
+    read_entry = dirlisting._read_entry
+    def slow_read_entry(entry):
+        time.sleep(0.01)
+        return read_entry(entry)
+    monkeypatch.setattr(dirlisting, "_read_entry", slow_read_entry)
+    cache = dirlisting.DirectoryCache()
+    # As the apps do at startup, without a listener.
+    cache.request(path)
+    done = threading.Event()
+    def listener(changed):
+        if cache.is_complete(changed):
+            done.set()
+    assert cache.listdir(path, listener) == []
+    assert done.wait(5)
+    assert len(cache.listdir(path)) == 50
+
+
+def test_changed_directory_is_listed_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(dirlisting, "RECHECK_SECONDS", 0)
+    path = make_directory(tmp_path, 3)
+    cache = dirlisting.DirectoryCache()
+    cache.request(path)
+    wait_complete(cache, path)
+    (tmp_path / "new.txt").write_bytes(b"")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    done = threading.Event()
+    # The old listing is shown until the new one is complete.
+    assert "new.txt" not in cache.listdir(path, lambda changed: done.set())
+    assert done.wait(5)
+    assert "new.txt" in cache.listdir(path)
@@ -0,0 +1,114 @@
+'''
+Tests of gitmetrics, run with pytest from this directory.
+
+@author: vivian
+'''
+import json
+import os
+import gitmetrics
+import gitupdater
+
+
+def make_result(path, status=gitupdater.OK, seconds=1.0, err="", bytes_received=100):
+    exitcode = 1 if status == gitupdater.FAILED else 0
+    return gitupdater.UpdateResult(path, status, exitcode, "", err, seconds,
+                                   gitupdater.PullTiming(0.5, 0.1, 0.01, 0.6, 0.2,
+                                                         bytes_received))
+
+
+class Recorder(gitmetrics.MetricsHook):
+    def __init__(self):
+        self.repos = []
+        self.runs = []
+
+    def repo_finished(self, metrics):
+        self.repos.append(metrics)
+
+    def run_finished(self, summary, metrics):
+        self.runs.append((summary, metrics))
+
+
+class Broken(gitmetrics.MetricsHook):
+    def repo_finished(self, metrics):
+        raise RuntimeError("broken hook")
+
+
+def test_error_summary_is_the_last_line():
+    assert gitmetrics.error_summary("remote: counting\nfatal: could not read\n\n") == \
+        "fatal: could not read"
+    assert gitmetrics.error_summary("") is None
+    assert len(gitmetrics.error_summary("x" * 1000)) == gitmetrics.ERROR_LENGTH
+
+
+def test_summary_and_hooks():
+    recorder = Recorder()
+    collector = gitmetrics.UpdateMetrics([Broken(), recorder])
+    results = [make_result("/a", seconds=1.0), make_result("/b", seconds=3.0),
+               make_result("/c", gitupdater.UP_TO_DATE, seconds=0.1, bytes_received=0),
+               make_result("/d", gitupdater.FAILED, seconds=2.0, err="fatal: no\n",
+                           bytes_received=None)]
+    collector.run_started([result.path for result in results])
+    for result in results:
+        collector.repo_finished(result)
+    summary = collector.run_finished(results)
+    assert (summary.repositories, summary.ok, summary.up_to_date, summary.failed) == (4, 2, 1, 1)
+    assert summary.bytes_received == 200
+    assert [path for path, seconds in summary.slowest] == ["/b", "/d", "/a", "/c"]
+    # The broken hook is logged, and does not keep the others from being called.
+    assert [metrics.path for metrics in recorder.repos] == ["/a", "/b", "/c", "/d"]
+    assert recorder.runs[0][0] is summary
+    assert collector.repos["/d"].error == "fatal: no"
+    assert collector.repos["/a"].error is None
+
+
+def test_json_lines_exporter(tmp_path):
+    filename = str(tmp_path / "metrics.jsonl")
+    collector = gitmetrics.UpdateMetrics([gitmetrics.JsonLinesExporter(filename)])
+    results = [make_result("/a")]
+    collector.run_started(["/a"])
+    collector.repo_finished(results[0])
+    collector.run_finished(results)
+    with open(filename) as stream:
+        records = [json.loads(line) for line in stream]
+    assert [record["type"] for record in records] == ["repo", "run"]
+    assert records[0]["path"] == "/a" and records[0]["network"] == 0.6
+    assert records[1]["ok"] == 1
+
+
+def test_prometheus_text_escapes_labels():
+    metrics = gitmetrics.metrics_from_result(make_result('/odd "path"\\x'), finished=10.0)
+    text = gitmetrics.prometheus_text({metrics.path: metrics}, None)
+    assert '# TYPE gitpull_repo_duration_seconds gauge' in text
+    assert 'gitpull_repo_duration_seconds{path="/odd \\"path\\"\\\\x"} 1.0' in text
+    assert 'gitpull_repo_phase_seconds{path="/odd \\"path\\"\\\\x",phase="network"} 0.6' in text
+    assert "gitpull_run_" not in text
+
+
+def test_prometheus_exporter_replaces_its_file(tmp_path):
+    filename = str(tmp_path / "gitpull.prom")
+    collector = gitmetrics.UpdateMetrics([gitmetrics.PrometheusExporter(filename)])
+    for path in ("/a", "/b"):
+        results = [make_result(path)]
+        collector.run_started([path])
+        collector.repo_finished(results[0])
+        collector.run_finished(results)
+    with open(filename) as stream:
+        text = stream.read()
+    # Repositories of earlier updates are kept.
+    assert 'gitpull_repo_success{path="/a",status="ok"} 1.0' in text
+    assert 'gitpull_run_repositories{status="ok"} 1.0' in text
+    assert os.listdir(str(tmp_path)) == ["gitpull.prom"]
+
+
+def test_listener_sees_the_metrics_of_its_result(tmp_path):
+    collector = gitmetrics.UpdateMetrics()
+    seen = {}
+    def listener(result):
+        if result.timing is not None:
+            seen[result.path] = collector.repos.get(result.path)
+    path = str(tmp_path)    # Not a repository, so the pull fails.
+    updater = gitupdater.RepoUpdater(precheck=False, listener=listener, metrics=collector,
+                                     head_cache=gitupdater.RemoteHeadCache())
+    result, = updater.update([path])
+    assert result.status == gitupdater.FAILED
+    assert seen[path] is not None and seen[path].status == gitupdater.FAILED
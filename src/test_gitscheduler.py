@@ -0,0 +1,91 @@
+'''
+Tests of gitscheduler, run with pytest from this directory.
+
+@author: vivian
+'''
+import random
+import gitscheduler
+import reporegistry
+
+
+def make_scheduler(**kwargs):
+    kwargs.setdefault("jitter", 0)
+    return gitscheduler.UpdateScheduler(rng=random.Random(1), **kwargs)
+
+
+def test_failures_back_off_up_to_the_limit():
+    scheduler = make_scheduler(interval=100, max_backoff=1000)
+    scheduler.sync(["/a"])
+    now = 0.0
+    dues = []
+    for _ in range(6):
+        scheduler.record("/a", failed=True, changed=False, now=now)
+        dues.append(scheduler.repos["/a"].due - now)
+        now = scheduler.repos["/a"].due
+    assert dues == [200, 400, 800, 1000, 1000, 1000]
+    # A pull that works again goes back to the plain interval.
+    scheduler.record("/a", failed=False, changed=False, now=now)
+    assert scheduler.repos["/a"].due - now == 100
+
+
+def test_active_repositories_are_pulled_more_often():
+    scheduler = make_scheduler(interval=100)
+    scheduler.record("/a", failed=False, changed=True, now=0.0)
+    assert scheduler.repos["/a"].activity == gitscheduler.ACTIVITY_WEIGHT
+    assert scheduler.repos["/a"].due == 100 / (1 + gitscheduler.ACTIVITY_WEIGHT)
+
+
+def test_jitter_spreads_due_times():
+    scheduler = gitscheduler.UpdateScheduler(interval=100, jitter=0.1, rng=random.Random(1))
+    for i in range(20):
+        scheduler.record("/repo%d" % i, failed=False, changed=False, now=0.0)
+    dues = [schedule.due for schedule in scheduler.repos.values()]
+    assert all(90 <= due <= 110 for due in dues)
+    assert len(set(dues)) == len(dues)
+
+
+def test_load_counts_a_failed_last_pull():
+    records = [reporegistry.RepoRecord("/ok", 0, 50.0, 1.0, 0, "ok", None),
+               reporegistry.RepoRecord("/failed", 1, 50.0, 1.0, 1, "failed", None),
+               reporegistry.RepoRecord("/new", 2, None, None, None, None, None)]
+    scheduler = make_scheduler(interval=100)
+    scheduler.load(records)
+    assert [scheduler.repos[path].due for path in ("/ok", "/failed", "/new")] == [150, 250, 0]
+    assert scheduler.next_due() == 0
+
+
+def test_stalest_are_taken_first():
+    scheduler = make_scheduler(interval=10)
+    scheduler.record("/old", failed=False, changed=False, now=0.0)
+    scheduler.record("/recent", failed=False, changed=False, now=50.0)
+    scheduler.sync(["/old", "/recent", "/never"])
+    assert scheduler.take_due(now=100.0) == ["/never", "/old", "/recent"]
+
+
+def test_token_bucket_limits_the_rate():
+    scheduler = make_scheduler(rate=6)
+    scheduler.sync(["/repo%d" % i for i in range(10)])
+    assert len(scheduler.take_due(limit=4, now=0.0)) == 4
+    assert len(scheduler.take_due(now=0.0)) == 2
+    assert scheduler.take_due(now=5.0) == []
+    # Six pulls a minute is one every ten seconds.
+    assert len(scheduler.take_due(now=10.0)) == 1
+    # The bucket does not fill up beyond the rate, however long it waited.
+    assert len(scheduler.take_due(now=3600.0)) == 6
+
+
+def test_nothing_is_taken_while_paused():
+    scheduler = make_scheduler(rate=6)
+    scheduler.sync(["/a", "/b"])
+    scheduler.pause()
+    assert scheduler.take_due(now=0.0) == []
+    scheduler.resume()
+    assert scheduler.take_due(now=0.0) == ["/a", "/b"]
+
+
+def test_sync_drops_removed_repositories():
+    scheduler = make_scheduler()
+    scheduler.record("/a", failed=False, changed=False, now=0.0)
+    scheduler.sync(["/b"])
+    assert list(scheduler.repos) == ["/b"]
+    assert make_scheduler().next_due() is None
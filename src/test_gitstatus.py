@@ -0,0 +1,108 @@
+'''
+Tests of gitstatus, run with pytest from this directory.
+
+@author: vivian
+'''
+import os
+import subprocess
+import pytest
+import gitstatus
+import gitupdater
+
+
+def git(args, cwd=None):
+    return subprocess.run(["git"] + args, cwd=cwd, check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE).stdout.decode("utf-8").strip()
+
+
+def commit(path, name):
+    with open(os.path.join(path, name), "w") as stream:
+        stream.write(name + "\n")
+    git(["add", name], path)
+    git(["commit", "-q", "-m", name], path)
+
+
+@pytest.fixture
+def clone(tmp_path, monkeypatch):
+    """ Returns a clone of a bare remote, one commit behind it, whose master
+        tracks origin/master.
+    """
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv("GIT_%s_NAME" % name, "Test")
+        monkeypatch.setenv("GIT_%s_EMAIL" % name, "test@example.com")
+    remote = str(tmp_path / "remote.git")
+    git(["init", "-q", "--bare", remote])
+    git(["symbolic-ref", "HEAD", "refs/heads/master"], remote)
+    pusher = str(tmp_path / "pusher")
+    git(["clone", "-q", remote, pusher])
+    git(["checkout", "-q", "-b", "master"], pusher)
+    commit(pusher, "first")
+    git(["push", "-q", "origin", "master"], pusher)
+    path = str(tmp_path / "clone")
+    git(["clone", "-q", remote, path])
+    commit(pusher, "second")
+    git(["push", "-q", "origin", "master"], pusher)
+    git(["fetch", "-q"], path)
+    return path
+
+
+@pytest.fixture
+def git_calls(monkeypatch):
+    """ Returns a list that gets an entry for every time git status is run.
+    """
+    calls = []
+    read_git = gitupdater.read_git
+    def counting_read_git(*args, **kwargs):
+        calls.append(args)
+        return read_git(*args, **kwargs)
+    monkeypatch.setattr(gitupdater, "read_git", counting_read_git)
+    return calls
+
+
+def test_parse_config():
+    settings = gitstatus.parse_config('[branch "fix \\"it\\""]\n\tremote = origin\n'
+                                      '# comment\n[Remote "origin"]\n  URL = "/srv/repo"\n')
+    assert settings == {'branch.fix "it".remote': "origin", "remote.origin.url": "/srv/repo"}
+
+
+def test_fast_status_matches_git(clone, git_calls):
+    status = gitstatus.StatusCache().status(clone, slow=False)
+    assert not git_calls
+    assert (status.branch, status.upstream) == ("master", "origin/master")
+    assert status.head == git(["rev-parse", "HEAD"], clone)
+    assert (status.ahead, status.behind, status.dirty) == (None, None, None)
+
+
+def test_packed_and_detached_heads(clone):
+    git(["pack-refs", "--all"], clone)
+    cache = gitstatus.StatusCache()
+    assert cache.status(clone, slow=False).head == git(["rev-parse", "HEAD"], clone)
+    git(["checkout", "-q", "--detach", "origin/master"], clone)
+    status = cache.status(clone, slow=False)
+    assert status.branch is None and status.head == git(["rev-parse", "origin/master"], clone)
+
+
+def test_slow_fields_are_only_read_again_when_git_changes(clone, git_calls):
+    cache = gitstatus.StatusCache()
+    status = cache.status(clone)
+    assert (status.ahead, status.behind, status.dirty) == (0, 1, False)
+    assert len(git_calls) == 1
+    # Nothing in .git changed, so git is not run, even for an edit that is not added.
+    with open(os.path.join(clone, "first"), "a") as stream:
+        stream.write("edit\n")
+    assert cache.status(clone).dirty is False
+    assert len(git_calls) == 1
+    # Unless the caller says the answer is too old.
+    assert cache.status(clone, max_age=0).dirty is True
+    assert len(git_calls) == 2
+    git(["merge", "-q", "--ff-only", "origin/master"], clone)
+    status = cache.status(clone)
+    assert (status.behind, status.dirty) == (0, True)
+    assert len(git_calls) == 3
+    assert gitstatus.describe(status) == "master %s, dirty" % status.head[:7]
+
+
+def test_not_a_repository(tmp_path):
+    status = gitstatus.StatusCache().status(str(tmp_path))
+    assert status.error == "not a git repository"
+    assert gitstatus.describe(status) == "not a git repository"
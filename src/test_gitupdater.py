@@ -0,0 +1,82 @@
+'''
+Tests of gitupdater, run with pytest from this directory.
+
+The repositories are clones of bare repositories in a temporary directory, so
+no network is needed, only git.
+
+@author: vivian
+'''
+import os
+import subprocess
+import pytest
+import gitupdater
+
+
+def git(args, cwd=None):
+    return subprocess.run(["git"] + args, cwd=cwd, check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE).stdout.decode("utf-8").strip()
+
+
+def commit(path, name):
+    with open(os.path.join(path, name), "w") as stream:
+        stream.write(name + "\n")
+    git(["add", name], path)
+    git(["commit", "-q", "-m", name], path)
+
+
+@pytest.fixture
+def remotes(tmp_path, monkeypatch):
+    """ Returns a function that makes a bare remote with a commit on master, and
+        returns (remote, clone, pusher): the remote, a clone to be updated, and
+        another clone to push new commits from.
+    """
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv("GIT_%s_NAME" % name, "Test")
+        monkeypatch.setenv("GIT_%s_EMAIL" % name, "test@example.com")
+    def make(name):
+        remote = str(tmp_path / (name + ".git"))
+        git(["init", "-q", "--bare", remote])
+        git(["symbolic-ref", "HEAD", "refs/heads/master"], remote)
+        pusher = str(tmp_path / (name + "-pusher"))
+        git(["clone", "-q", remote, pusher])
+        git(["checkout", "-q", "-b", "master"], pusher)
+        commit(pusher, "first")
+        git(["push", "-q", "origin", "master"], pusher)
+        clone = str(tmp_path / name)
+        git(["clone", "-q", remote, clone])
+        return remote, clone, pusher
+    return make
+
+
+def test_precheck_skips_unchanged_and_pulls_behind(remotes):
+    _, unchanged, _ = remotes("unchanged")
+    _, behind, pusher = remotes("behind")
+    commit(pusher, "second")
+    git(["push", "-q", "origin", "master"], pusher)
+    updater = gitupdater.RepoUpdater(workers=2, precheck=True,
+                                     head_cache=gitupdater.RemoteHeadCache())
+    results = updater.update([unchanged, behind])
+    assert [result.status for result in results] == [gitupdater.UP_TO_DATE, gitupdater.OK]
+    assert git(["rev-parse", "HEAD"], behind) == git(["rev-parse", "HEAD"], pusher)
+
+
+def test_without_precheck_everything_is_pulled(remotes):
+    _, clone, _ = remotes("unchanged")
+    updater = gitupdater.RepoUpdater(precheck=False, head_cache=gitupdater.RemoteHeadCache())
+    assert [result.status for result in updater.update([clone])] == [gitupdater.OK]
+
+
+def test_log_joins_crlf_split_across_reads():
+    log = gitupdater.RepoLog()
+    for data in [b"first\r", b"\nsecond\r", b"\n", b"third\r\n"]:
+        log.feed("out", data)
+    log.close()
+    assert log.text("out") == "first\nsecond\nthird"
+
+
+def test_log_replaces_progress_lines():
+    log = gitupdater.RepoLog()
+    for data in [b"Receiving 10%\r", b"Receiving 50%\r", b"Receiving 100%\r", b"\ndone\n"]:
+        log.feed("err", data)
+    log.close()
+    assert log.text("err") == "Receiving 100%\ndone"
@@ -0,0 +1,60 @@
+'''
+Tests of pairfilter, run with pytest from this directory.
+
+@author: vivian
+'''
+import pytest
+import pairfilter
+import splitengine
+from test_splitengine import read_lines
+
+MEMORY = 64 * 1024
+
+
+def test_bloom_filter_remembers_what_was_added():
+    bloom = pairfilter.BloomFilter(MEMORY)
+    keys = [b"key %d" % i for i in range(1000)]
+    assert not any(bloom.add(key) for key in keys)
+    assert all(bloom.add(key) for key in keys)
+
+
+def test_drops_duplicate_empty_and_misaligned_pairs():
+    pair_filter = pairfilter.PairFilter(max_ratio=3, memory=MEMORY)
+    lines = ["hello\n", "bonjour\n",
+             "hello\n", "bonjour\n",
+             "\n", "vide\n",
+             "a\n", "a much longer line\n",
+             "hello\n", "salut\n"]
+    assert pair_filter.process(lines) == ["hello\n", "bonjour\n", "hello\n", "salut\n"]
+    assert (pair_filter.dropped_duplicate, pair_filter.dropped_empty,
+            pair_filter.dropped_ratio) == (1, 1, 1)
+    assert pair_filter.summary() == \
+        "3 of 5 pairs dropped: 1 duplicate, 1 empty, 1 length ratio"
+
+
+def test_pairs_split_across_chunks_are_joined():
+    pair_filter = pairfilter.PairFilter(period=3, memory=MEMORY)
+    assert pair_filter.process([b"1\n", b"2\n"]) == []
+    assert pair_filter.process([b"3\n", b"1\n", b"2\n", b"3\n", b"4\n"]) == [b"1\n", b"2\n", b"3\n"]
+    assert pair_filter.dropped_duplicate == 1
+    assert pair_filter.finish() == [b"4\n"]
+
+
+def test_ratio_counts_characters_rather_than_bytes():
+    pair_filter = pairfilter.PairFilter(dedup=False, max_ratio=1.5, memory=MEMORY)
+    assert pair_filter.process(["abcd\n", "漢字漢字\n", b"abcd\n", "漢字漢字\n".encode("utf-8")]) == \
+        ["abcd\n", "漢字漢字\n", b"abcd\n", "漢字漢字\n".encode("utf-8")]
+
+
+@pytest.mark.parametrize("use_mmap", [True, False], ids=["mmap", "text"])
+def test_split_with_filter_keeps_targets_aligned(use_mmap, tmp_path):
+    source = str(tmp_path / "source.txt")
+    with open(source, "wb") as stream:
+        stream.write(b"one\nun\none\nun\n\nvide\ntwo\ndeux\nodd\n")
+    targets = [str(tmp_path / "odd.txt"), str(tmp_path / "even.txt")]
+    pair_filter = pairfilter.PairFilter(memory=MEMORY)
+    assert splitengine.route_file(source, targets, append=False, use_mmap=use_mmap,
+                                  pair_filter=pair_filter) == 9
+    assert read_lines(targets[0]) == [b"one\n", b"two\n", b"odd\n"]
+    assert read_lines(targets[1]) == [b"un\n", b"deux\n"]
+    assert pair_filter.dropped() == 2
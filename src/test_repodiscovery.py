@@ -0,0 +1,90 @@
+'''
+Tests of repodiscovery, run with pytest from this directory.
+
+@author: vivian
+'''
+import os
+import subprocess
+import pytest
+import repodiscovery
+import reporegistry
+
+
+def git(args, cwd=None):
+    subprocess.run(["git"] + args, cwd=cwd, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """ Returns a directory holding a clone, a bare repository, a worktree, a clone
+        inside node_modules, and a clone too deep to be found.
+    """
+    root = tmp_path / "git"
+    git(["init", "-q", str(root / "plain")])
+    git(["init", "-q", "--bare", str(root / "group" / "bare.git")])
+    git(["-c", "user.name=Test", "-c", "user.email=test@example.com", "commit", "-q",
+         "--allow-empty", "-m", "first"], str(root / "plain"))
+    git(["worktree", "add", "-q", str(root / "group" / "tree")], str(root / "plain"))
+    git(["init", "-q", str(root / "app" / "node_modules" / "dependency")])
+    git(["init", "-q", str(root / "a" / "b" / "c" / "d" / "e" / "deep")])
+    return str(root)
+
+
+def kinds(found, root):
+    return dict((os.path.relpath(repo.path, root), repo.kind) for repo in found)
+
+
+def test_scan_finds_repositories_of_every_kind(tree):
+    scanner = repodiscovery.RepoScanner(scan_cache=repodiscovery.ScanCache())
+    assert kinds(scanner.scan(tree), tree) == {
+        "plain": repodiscovery.REPOSITORY,
+        os.path.join("group", "bare.git"): repodiscovery.BARE,
+        os.path.join("group", "tree"): repodiscovery.WORKTREE,
+    }
+
+
+def test_rescan_only_lists_changed_directories(tree):
+    scanner = repodiscovery.RepoScanner(scan_cache=repodiscovery.ScanCache())
+    scanner.scan(tree)
+    listed = scanner.listed
+    scanner.scan(tree)
+    assert (scanner.listed, scanner.cached) == (0, listed)
+    git(["init", "-q", os.path.join(tree, "group", "new")])
+    found = scanner.scan(tree)
+    assert scanner.listed == 2      # group, which changed, and the new repository.
+    assert os.path.join(tree, "group", "new") in [repo.path for repo in found]
+
+
+def test_cache_is_kept_in_the_registry(tree, tmp_path):
+    filename = str(tmp_path / reporegistry.REGISTRY_NAME)
+    registry = reporegistry.RepoRegistry(filename)
+    scanner = repodiscovery.RepoScanner(scan_cache=repodiscovery.ScanCache())
+    first = repodiscovery.scan_cached(scanner, registry, tree)
+    listed = scanner.listed
+    registry.close()
+    # As pullrepos.py does when it runs again, in a fresh process.
+    registry = reporegistry.RepoRegistry(filename)
+    scanner = repodiscovery.RepoScanner(scan_cache=repodiscovery.ScanCache())
+    assert repodiscovery.scan_cached(scanner, registry, tree) == first
+    assert (scanner.listed, scanner.cached) == (0, listed)
+
+
+def test_removed_directories_leave_the_cache(tree, tmp_path):
+    registry = reporegistry.RepoRegistry(str(tmp_path / reporegistry.REGISTRY_NAME))
+    scanner = repodiscovery.RepoScanner(scan_cache=repodiscovery.ScanCache())
+    repodiscovery.scan_cached(scanner, registry, tree)
+    os.rename(os.path.join(tree, "app"), os.path.join(tree, "..", "app"))
+    repodiscovery.scan_cached(scanner, registry, tree)
+    assert not [path for path, _, _, _ in registry.scan_entries()
+                if path.startswith(os.path.join(tree, "app"))]
+
+
+def test_sync_registry_adds_and_reports_vanished(tree, tmp_path):
+    registry = reporegistry.RepoRegistry(str(tmp_path / reporegistry.REGISTRY_NAME))
+    registry.add(str(tmp_path / "gone"))
+    scanner = repodiscovery.RepoScanner(scan_cache=repodiscovery.ScanCache())
+    added, vanished = repodiscovery.sync_registry(registry, scanner.scan(tree))
+    assert sorted(os.path.relpath(path, tree) for path in added) == \
+        [os.path.join("group", "tree"), "plain"]
+    assert vanished == [reporegistry.normalize_path(str(tmp_path / "gone"))]
@@ -0,0 +1,62 @@
+'''
+Tests of reporegistry, run with pytest from this directory.
+
+@author: vivian
+'''
+import os
+import threading
+import pytest
+import reporegistry
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / reporegistry.REGISTRY_NAME)
+
+
+def test_paths_are_normalized_and_unique(filename, tmp_path):
+    registry = reporegistry.RepoRegistry(filename)
+    path = str(tmp_path / "repo")
+    assert registry.add(path + os.sep + "." + os.sep) == path
+    assert registry.add(path) is None
+    assert registry.add_many([path, "  ", str(tmp_path / "other")]) == [str(tmp_path / "other")]
+    assert registry.paths() == [path, str(tmp_path / "other")]
+    assert path in registry and len(registry) == 2
+    assert registry.remove(path) and not registry.remove(path)
+    assert registry.paths() == [str(tmp_path / "other")]
+
+
+def test_record_pull(filename, tmp_path):
+    registry = reporegistry.RepoRegistry(filename)
+    path = registry.add(str(tmp_path / "repo"))
+    assert registry.get(path).last_pull is None
+    registry.record_pull(path, 1.5, 0, "ok", "abc123", last_pull=100.0)
+    registry.close()
+    record = reporegistry.RepoRegistry(filename).get(path)
+    assert (record.last_pull, record.duration, record.exitcode, record.status,
+            record.last_head) == (100.0, 1.5, 0, "ok", "abc123")
+
+
+def test_repo_list_is_migrated_only_once(filename, tmp_path):
+    repo_list = ",".join(str(tmp_path / name) for name in ("a", "b", "a"))
+    registry = reporegistry.RepoRegistry(filename)
+    assert registry.migrate_repo_list(repo_list) == [str(tmp_path / "a"), str(tmp_path / "b")]
+    registry.remove(str(tmp_path / "a"))
+    registry.close()
+    # The config value is read again on the next start, but removed repositories stay removed.
+    registry = reporegistry.RepoRegistry(filename)
+    assert registry.migrate_repo_list(repo_list) == []
+    assert registry.paths() == [str(tmp_path / "b")]
+
+
+def test_threads_share_the_registry(filename, tmp_path):
+    registry = reporegistry.RepoRegistry(filename)
+    def add(start):
+        for i in range(start, start + 50):
+            registry.add(str(tmp_path / ("repo%d" % i)))
+    threads = [threading.Thread(target=add, args=(start,)) for start in (0, 50, 100, 150)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(registry) == 200
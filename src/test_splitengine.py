@@ -0,0 +1,177 @@
+'''
+Tests of splitengine, run with pytest from this directory.
+
+Every way of splitting a file must give the same target files: the lines of the
+source file taken in turn, as readlines()[::2] and readlines()[1::2] would,
+after what the targets held before when appending.
+
+@author: vivian
+'''
+import bz2
+import gzip
+import lzma
+import random
+import pytest
+import splitengine
+
+# Lines before the split in the targets of appending splits.
+OLD_LINES = [b"old first\n", b"old second\n"]
+
+
+def route_gzip(source_filename, target_filenames, append):
+    # A compressed source file cannot be memory mapped, so it is split as a stream.
+    with open(source_filename, "rb") as stream:
+        data = stream.read()
+    with open(source_filename + ".gz", "wb") as stream:
+        stream.write(gzip.compress(data, 1))
+    return splitengine.route_file(source_filename + ".gz", target_filenames, append=append)
+
+
+ENGINES = {
+    "text": lambda source, targets, append: splitengine.route_text(
+        source, targets, [0, 1], append, encoding="utf-8"),
+    "split_file": lambda source, targets, append: splitengine.split_file(
+        source, targets[0], targets[1], append, encoding="utf-8", use_mmap=False),
+    "mmap": lambda source, targets, append: splitengine.route_mmap(
+        source, targets, [0, 1], append),
+    "parallel": lambda source, targets, append: splitengine.route_parallel(
+        source, targets, [0, 1], append, workers=3),
+    "stream": lambda source, targets, append: splitengine.route_stream(
+        source, targets, [0, 1], append),
+    "gzip": route_gzip,
+}
+
+
+def make_lines(count, seed=1):
+    """ Returns lines of all lengths, some of them not ASCII, as bytes.
+    """
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "漢字", "été", ""]
+    return [("%d %s\n" % (i, " ".join(rng.choice(words)
+                                      for _ in range(rng.choice([0, 1, 8, 300]))))).encode("utf-8")
+            for i in range(count)]
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    """ Returns the name of a source file of a few MB, larger than a chunk of the
+        memory mapped engines, with a last line without a line end.
+    """
+    filename = str(tmp_path_factory.mktemp("corpus") / "source.txt")
+    with open(filename, "wb") as stream:
+        stream.writelines(make_lines(20000))
+        stream.write(b"last line")
+    return filename
+
+
+def read_lines(filename):
+    with open(filename, "rb") as stream:
+        return stream.readlines()
+
+
+def make_targets(tmp_path, count=2):
+    targets = [str(tmp_path / ("target%d.txt" % i)) for i in range(count)]
+    for target, line in zip(targets, OLD_LINES):
+        with open(target, "wb") as stream:
+            stream.write(line)
+    return targets
+
+
+@pytest.mark.parametrize("append", [True, False], ids=["append", "overwrite"])
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_split_matches_readlines(engine, append, corpus, tmp_path):
+    targets = make_targets(tmp_path)
+    lines = read_lines(corpus)
+    assert ENGINES[engine](corpus, targets, append) == len(lines)
+    before = [[line] if append else [] for line in OLD_LINES]
+    assert read_lines(targets[0]) == before[0] + lines[::2]
+    assert read_lines(targets[1]) == before[1] + lines[1::2]
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_newlines_are_translated(engine, tmp_path):
+    source = str(tmp_path / "source.txt")
+    with open(source, "wb") as stream:
+        stream.write(b"one\r\ntwo\rthree\nfour\r\n")
+    targets = make_targets(tmp_path)
+    assert ENGINES[engine](source, targets, False) == 4
+    assert read_lines(targets[0]) == [b"one\n", b"three\n"]
+    assert read_lines(targets[1]) == [b"two\n", b"four\n"]
+
+
+def test_empty_source_creates_empty_targets(tmp_path):
+    source = str(tmp_path / "empty.txt")
+    open(source, "wb").close()
+    targets = [str(tmp_path / "odd.txt"), str(tmp_path / "even.txt")]
+    assert splitengine.split_file(source, targets[0], targets[1]) == 0
+    assert [read_lines(target) for target in targets] == [[], []]
+
+
+def test_cancel_restores_targets(corpus, tmp_path):
+    class CancelAtOnce(object):
+        def is_set(self):
+            return True
+    targets = make_targets(tmp_path)
+    with pytest.raises(splitengine.SplitCancelled):
+        splitengine.route_text(corpus, targets, [0, 1], cancel_event=CancelAtOnce())
+    assert [read_lines(target) for target in targets] == [[line] for line in OLD_LINES]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7])
+def test_mmap_chunks_never_split_a_line_end(chunk_size, tmp_path, monkeypatch):
+    monkeypatch.setattr(splitengine, "MMAP_CHUNK_SIZE", chunk_size)
+    source = str(tmp_path / "source.txt")
+    with open(source, "wb") as stream:
+        stream.write(b"a\r\nbb\r\r\nccc\n\ndddd\reeeee\r\nf")
+    targets = make_targets(tmp_path)
+    assert splitengine.route_mmap(source, targets, [0, 1], False) == 8
+    assert read_lines(targets[0]) == [b"a\n", b"\n", b"\n", b"eeeee\n"]
+    assert read_lines(targets[1]) == [b"bb\n", b"ccc\n", b"dddd\n", b"f"]
+
+
+def test_partitions_cover_the_file_on_line_boundaries(corpus):
+    with open(corpus, "rb") as stream, splitengine._open_mapped(stream) as mapped:
+        ranges = splitengine._partition(mapped, 5)
+        assert len(ranges) > 1
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(mapped)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            assert end == start and mapped[end - 1] == ord("\n")
+
+
+def test_parse_pattern():
+    assert splitengine.parse_pattern("1, 1 2,2", 2) == [0, 0, 1, 1]
+    assert splitengine.parse_pattern("  ", 3) == [0, 1, 2]
+    with pytest.raises(ValueError):
+        splitengine.parse_pattern("1,3", 2)
+    with pytest.raises(ValueError):
+        splitengine.parse_pattern("1,x", 2)
+
+
+@pytest.mark.parametrize("use_mmap", [True, False], ids=["mmap", "text"])
+def test_pattern_routes_lines_to_targets(use_mmap, corpus, tmp_path):
+    targets = make_targets(tmp_path, 3)
+    lines = read_lines(corpus)
+    pattern = [0, 0, 2, 1, 2]
+    assert splitengine.route_file(corpus, targets, pattern, append=False,
+                                  use_mmap=use_mmap) == len(lines)
+    for index, target in enumerate(targets):
+        assert read_lines(target) == [line for number, line in enumerate(lines)
+                                      if pattern[number % len(pattern)] == index]
+
+
+@pytest.mark.parametrize("module,ext", [(gzip, ".gz"), (bz2, ".bz2"), (lzma, ".xz")],
+                         ids=["gz", "bz2", "xz"])
+@pytest.mark.parametrize("use_mmap", [True, False], ids=["bytes", "text"])
+def test_compressed_source_and_targets(module, ext, use_mmap, tmp_path):
+    lines = make_lines(600)
+    source = str(tmp_path / ("source.txt" + ext))
+    with open(source, "wb") as stream:
+        stream.write(module.compress(b"".join(lines)))
+    targets = [str(tmp_path / ("odd.txt" + ext)), str(tmp_path / ("even.txt" + ext))]
+    for append in (False, True):
+        assert splitengine.route_file(source, targets, append=append,
+                                      use_mmap=use_mmap) == len(lines)
+    # Appending adds a second compressed stream, which is read as part of the file.
+    for target, expected in zip(targets, (lines[::2], lines[1::2])):
+        with open(target, "rb") as stream:
+            assert module.decompress(stream.read()).splitlines(True) == expected * 2
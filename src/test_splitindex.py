@@ -0,0 +1,102 @@
+'''
+Tests of incremental splits with splitindex, run with pytest from this directory.
+
+@author: vivian
+'''
+import pytest
+import splitengine
+import splitindex
+from test_splitengine import OLD_LINES, make_lines, make_targets, read_lines
+
+
+class CancelAfter(object):
+    """ A cancel event that is set once it has been checked count times.
+    """
+    def __init__(self, count):
+        self.count = count
+
+    def is_set(self):
+        self.count -= 1
+        return self.count < 0
+
+
+def write_source(filename, lines, mode="wb"):
+    with open(filename, mode) as stream:
+        stream.writelines(lines)
+
+
+def assert_split(targets, lines, appended=True):
+    before = [[line] if appended else [] for line in OLD_LINES]
+    assert read_lines(targets[0]) == before[0] + lines[::2]
+    assert read_lines(targets[1]) == before[1] + lines[1::2]
+
+
+def record_of(source, targets):
+    index = splitindex.load_index(splitindex.index_filename(targets))
+    return index[splitindex.source_key(source)]
+
+
+@pytest.fixture
+def lines():
+    return make_lines(20000)
+
+
+@pytest.mark.parametrize("append", [True, False], ids=["append", "overwrite"])
+def test_incremental_split_matches_readlines(append, lines, tmp_path):
+    source = str(tmp_path / "source.txt")
+    write_source(source, lines)
+    targets = make_targets(tmp_path)
+    assert splitengine.route_incremental(source, targets, [0, 1], append) == len(lines)
+    assert_split(targets, lines, append)
+    # Nothing is new, so nothing is written again.
+    assert splitengine.route_incremental(source, targets, [0, 1]) == len(lines)
+    assert_split(targets, lines, append)
+
+
+def test_growing_file_carries_on_where_it_stopped(lines, tmp_path):
+    source = str(tmp_path / "growing.txt")
+    targets = make_targets(tmp_path)
+    write_source(source, lines[:1001])
+    splitengine.route_incremental(source, targets, [0, 1])
+    write_source(source, lines[1001:], "ab")
+    assert splitengine.route_incremental(source, targets, [0, 1]) == len(lines)
+    assert_split(targets, lines)
+
+
+def test_incomplete_last_line_is_written_again(tmp_path):
+    source = str(tmp_path / "source.txt")
+    targets = make_targets(tmp_path)
+    write_source(source, [b"one\n", b"two\n", b"thr"])
+    assert splitengine.route_incremental(source, targets, [0, 1]) == 3
+    write_source(source, [b"ee\n", b"four\n"], "ab")
+    assert splitengine.route_incremental(source, targets, [0, 1]) == 4
+    assert_split(targets, [b"one\n", b"two\n", b"three\n", b"four\n"])
+
+
+def test_rewritten_source_is_refused(lines, tmp_path):
+    source = str(tmp_path / "source.txt")
+    targets = make_targets(tmp_path)
+    write_source(source, lines[:100])
+    splitengine.route_incremental(source, targets, [0, 1])
+    write_source(source, [b"changed\n"] + lines[1:200])
+    with pytest.raises(splitindex.SourceChanged):
+        splitengine.route_incremental(source, targets, [0, 1])
+    # A restart drops what the first split wrote, and splits it again.
+    lines = [b"changed\n"] + lines[1:200]
+    assert splitengine.route_incremental(source, targets, [0, 1], restart=True) == len(lines)
+    assert_split(targets, lines)
+
+
+def test_cancel_keeps_the_last_checkpoint(lines, tmp_path, monkeypatch):
+    monkeypatch.setattr(splitengine, "MMAP_CHUNK_SIZE", 64 * 1024)
+    monkeypatch.setattr(splitengine, "CHECKPOINT_BYTES", 1)
+    source = str(tmp_path / "source.txt")
+    write_source(source, lines)
+    targets = make_targets(tmp_path)
+    with pytest.raises(splitengine.SplitCancelled):
+        splitengine.route_incremental(source, targets, [0, 1], cancel_event=CancelAfter(5))
+    record = record_of(source, targets)
+    assert record["offset"] > 0 and record["end_sizes"] is None
+    assert splitindex.target_sizes(targets) == record["target_sizes"]
+    assert splitengine.route_incremental(source, targets, [0, 1]) == len(lines)
+    assert_split(targets, lines)